@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.batch import read_history, f_score
+from src.database import Database, epoch_to_timestamp
+from src.parser import HL7MessageParser, SplitHL7MessageParser
+from src.replay import replay_stream, message_mrn
+from src.simulator import read_hl7_messages
+from model.model_class import AKIPredictor
+
+
+HISTORY_COLUMNS = ("mrns", "timestamps", "creatinine_levels")
+
+_worker = {}  # per-process state set up by _init_worker
+
+
+def save_history_snapshot(history_csv_path, directory):
+    """Writes history.csv as .npy columns that every worker memory-maps read-only."""
+    history = read_history(history_csv_path)
+    columns = {
+        "mrns": history["mrn"].to_numpy(dtype=np.int64),
+        "timestamps": history["timestamp"].to_numpy(dtype=np.int64),
+        "creatinine_levels": history["value"].to_numpy(dtype=np.float32),
+    }
+    for name in HISTORY_COLUMNS:
+        np.save(os.path.join(directory, f"{name}.npy"), columns[name])
+
+
+def load_history_snapshot(directory):
+    return {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in HISTORY_COLUMNS
+    }
+
+
+def in_shard(mrn, shard, shards):
+    # Messages without a usable MRN all go to shard 0 so that each message is replayed once.
+    mrn = (mrn or "").strip()  # as HL7MessageParser._convert_mrn
+    if not mrn.isdigit():
+        return shard == 0
+    return int(mrn) % shards == shard
+
+
+def _init_worker(snapshot_dir, model_path, hl7apy, cascade=False):
+    _worker["history"] = load_history_snapshot(snapshot_dir)
+    _worker["predictor"] = AKIPredictor(model_path, cascade=cascade)
+    _worker["parser"] = HL7MessageParser() if hl7apy else SplitHL7MessageParser()
+
+
+def replay_shard(path, shard, shards):
+    """Replays the messages of one MRN shard of a file against its own in-memory database.
+
+    Returns (seq, mrn, timestamp) for each page, seq being the position in the whole file,
+    and the number of messages replayed.
+    """
+    seqs, messages = [], []
+    for seq, message in enumerate(read_hl7_messages(path)):
+        if in_shard(message_mrn(message), shard, shards):
+            seqs.append(seq)
+            messages.append(message)
+
+    history = _worker["history"]
+    rows = np.asarray(history["mrns"]) % shards == shard
+    db = Database(":memory:")
+    db.write_history(zip(
+        history["mrns"][rows].tolist(),
+        history["timestamps"][rows].tolist(),
+        history["creatinine_levels"][rows].astype(np.float64).tolist(),
+    ))
+    outputs = replay_stream(messages, db, _worker["parser"], _worker["predictor"])
+    db.close()
+    return [(seqs[seq], mrn, timestamp) for seq, mrn, timestamp in outputs], len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-scores archived .mllp files in parallel. Each file is replayed on its own from history.csv."
+    )
+    parser.add_argument("files", nargs="+", help=".mllp replay files, in the order their pages are merged")
+    parser.add_argument("--history", default="history.csv", help="Path to history.csv")
+    parser.add_argument("--model", default="model/xgb_model.pkl", help="Path to the pickled model")
+    parser.add_argument("--workers", default=os.cpu_count(), type=int, help="Worker processes")
+    parser.add_argument("--shards", default=None, type=int,
+                        help="MRN shards per file (default: one per worker for a single file, else 1)")
+    parser.add_argument("--hl7apy", action="store_true", help="Parse with hl7apy (slower, same results)")
+    parser.add_argument("--expected", default=None, help="Expected pages, for the F3 score")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Settle results with ratios certified negative for the model without running it")
+    parser.add_argument("--output", default="pred_aki.csv")
+    flags = parser.parse_args()
+
+    shards = flags.shards or (flags.workers if len(flags.files) == 1 else 1)
+    tasks = [(i, path, shard) for i, path in enumerate(flags.files) for shard in range(shards)]
+
+    snapshot_dir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    pages, replayed = [], 0
+    try:
+        save_history_snapshot(flags.history, snapshot_dir)
+        with ProcessPoolExecutor(
+            flags.workers, initializer=_init_worker, initargs=(snapshot_dir, flags.model, flags.hl7apy, flags.cascade)
+        ) as pool:
+            futures = {pool.submit(replay_shard, path, shard, shards): i for i, path, shard in tasks}
+            for done, future in enumerate(as_completed(futures), 1):
+                outputs, n_messages = future.result()
+                pages += [(futures[future],) + output for output in outputs]
+                replayed += n_messages
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(tasks)} shards, {replayed} messages, "
+                      f"{replayed / elapsed:.0f} messages/s, {elapsed:.1f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+    # Each message belongs to exactly one shard, so (file, seq) orders pages as a serial replay would.
+    pages.sort(key=lambda page: page[:2])
+    output = pd.DataFrame([(mrn, epoch_to_timestamp(ts)) for _, _, mrn, ts in pages], columns=["mrn", "timestamp"])
+    output.to_csv(flags.output, index=False)
+
+    summary = f"{len(flags.files)} files, {replayed} messages in {time.perf_counter() - start:.2f}s, {len(output)} pages"
+    if flags.expected:
+        expected = pd.read_csv(flags.expected)
+        f3 = f_score(zip(output["mrn"], output["timestamp"]), zip(expected["mrn"], expected["date"]))
+        summary += f", F3 {f3:.3f} against {flags.expected}"
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Compares the unified single-connection store with the old split patients.db / blood_tests.db layout.
+
+Run from the repository root:
+
+    python -m benchmarks.database_layout --history history.csv
+
+Fetch latency is measured in-process. fsync counts need strace; without it, only the number of
+COMMITs (each of which syncs the journal and database file of every database it touches) is shown.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+from src.database import ConnectionPool, Database, timestamp_to_epoch
+
+
+DOB = timestamp_to_epoch("1980-01-01 00:00:00")
+FIRST_RESULT = timestamp_to_epoch("2024-05-01 00:00:00")
+FETCH_UNTIL = timestamp_to_epoch("2024-06-01 00:00:00")
+
+
+class SplitDatabase(Database):
+    """The previous layout: one file and one connection per table, with the current epoch-int values."""
+
+    def __init__(self, directory):
+        self.db_exists = False
+        self.in_transaction = False
+        self.pat_db = sqlite3.connect(os.path.join(directory, "patients.db"))
+        # Database.populate_history writes through the pool, so give it the blood_tests file.
+        self.pool = ConnectionPool(os.path.join(directory, "blood_tests.db"), readers=0)
+        self.tests_db = self.pool.writer
+        self.pat_db.execute("CREATE TABLE patients(mrn, dob, sex)")
+        self.tests_db.execute("CREATE TABLE blood_tests(mrn, timestamp, creatinine_level)")
+
+    def write_pas_data(self, mrn, dob, sex):
+        self.pat_db.execute("INSERT INTO patients VALUES (?, ?, ?)", (int(mrn), dob, sex))
+        self.pat_db.commit()
+
+    def write_lims_data(self, mrn, date, result):
+        self.tests_db.execute("INSERT INTO blood_tests VALUES (?, ?, ?)", (int(mrn), date, float(result)))
+        self.tests_db.commit()
+
+    def fetch_data(self, mrn, timestamp):
+        pas_data = self.pat_db.execute(
+            "SELECT * FROM patients WHERE mrn=? ORDER BY rowid DESC", (int(mrn),)
+        ).fetchone()
+        if pas_data is None:
+            return None
+        lims_data = self.tests_db.execute(
+            "SELECT * FROM blood_tests WHERE mrn=? AND timestamp<=? ORDER BY timestamp, rowid", (int(mrn), timestamp)
+        ).fetchall()
+        return {
+            "mrn": pas_data[0],
+            "dob": pas_data[1],
+            "sex": pas_data[2],
+            "dates": [ld[1] for ld in lims_data],
+            "creatinine_levels": [ld[2] for ld in lims_data],
+        }
+
+    def close(self):
+        self.pat_db.close()
+        self.tests_db.close()
+
+
+def open_layout(layout, directory):
+    """Returns the database and the connections whose commits should be counted."""
+    if layout == "split":
+        db = SplitDatabase(directory)
+        return db, [db.pat_db, db.tests_db]
+    db = Database(os.path.join(directory, "aki.db"))
+    return db, [db.pool.writer]
+
+
+def run_layout(layout, history, n_messages, n_fetches, seed=0):
+    directory = tempfile.mkdtemp()
+    try:
+        db, connections = open_layout(layout, directory)
+        db.populate_history(history)
+        mrns = [int(row.split(",", 1)[0]) for row in open(history).read().splitlines()[1:]]
+
+        commits = []
+        for connection in connections:
+            connection.set_trace_callback(lambda sql: commits.append(sql) if sql == "COMMIT" else None)
+
+        rng = random.Random(seed)
+        for i in range(n_messages):
+            mrn = rng.choice(mrns)
+            db.write_pas_data(mrn, DOB, i % 2)
+            db.write_lims_data(mrn, FIRST_RESULT + 3600 * (i % 24) + 60 * (i % 60), 100.0 + i % 50)
+        writes_commits = len(commits)
+
+        latencies = []
+        for _ in range(n_fetches):
+            mrn = rng.choice(mrns)
+            start = time.perf_counter()
+            db.fetch_data(mrn, FETCH_UNTIL)
+            latencies.append(time.perf_counter() - start)
+        db.close()
+    finally:
+        shutil.rmtree(directory)
+
+    latencies = np.asarray(latencies) * 1e6
+    return {
+        "fetch_p50_us": float(np.percentile(latencies, 50)),
+        "fetch_p99_us": float(np.percentile(latencies, 99)),
+        "commits_per_message": writes_commits / n_messages,
+    }
+
+
+def count_fsyncs(layout, flags):
+    """Re-runs one layout under strace and returns fsync + fdatasync calls per message."""
+    if shutil.which("strace") is None:
+        return None
+    cmd = [
+        "strace", "-f", "-c", "-e", "trace=fsync,fdatasync",
+        sys.executable, "-m", "benchmarks.database_layout", "--history", flags.history,
+        "--messages", str(flags.messages), "--fetches", "0", "--only", layout,
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True).stderr
+    calls = 0
+    for line in out.splitlines():
+        fields = line.split()
+        if fields and fields[-1] in ("fsync", "fdatasync"):
+            calls += int(fields[3])
+    return calls / flags.messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", default="history.csv", help="Path to history.csv")
+    parser.add_argument("--messages", default=500, type=int, help="PAS + LIMS message pairs to write")
+    parser.add_argument("--fetches", default=2000, type=int, help="fetch_data calls to time")
+    parser.add_argument("--only", choices=["split", "unified"], help=argparse.SUPPRESS)
+    flags = parser.parse_args()
+
+    if flags.only:
+        run_layout(flags.only, flags.history, flags.messages, max(flags.fetches, 1))
+        return
+
+    for layout in ("split", "unified"):
+        result = run_layout(layout, flags.history, flags.messages, flags.fetches)
+        fsyncs = count_fsyncs(layout, flags)
+        result["fsyncs_per_message"] = "n/a (strace not found)" if fsyncs is None else fsyncs
+        print(layout, " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
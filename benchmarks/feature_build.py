@@ -0,0 +1,78 @@
+"""Per-call cost of building the model features with text timestamps and with epoch seconds.
+
+Run from the repository root:
+
+    python -m benchmarks.feature_build --results 2 10 100
+
+A call is what happens for every creatinine result: converting the OBR-7 date in the parser and
+turning the patient's data into the feature vector. Only the feature build is timed, not the
+model itself.
+"""
+import timeit
+import argparse
+import numpy as np
+from datetime import datetime
+
+from src.parser import HL7MessageParser
+from src.database import timestamp_to_epoch
+from model.model_class import AKIPredictor
+
+
+HL7_DATE = "20240331005400"
+
+
+def legacy_convert_to_datetime(date_str):
+    """The parser's date conversion before timestamps were stored as epoch seconds."""
+    return datetime.strptime(date_str, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def legacy_preprocess(input_dict):
+    """AKIPredictor.preprocess_and_transform before timestamps were stored as epoch seconds."""
+    dob = datetime.fromisoformat(input_dict["dob"])
+    dates = input_dict["dates"]
+    latest_date = datetime.fromisoformat(dates[-1])
+    age = (latest_date - dob).days // 365
+    creatinine_levels = input_dict["creatinine_levels"]
+    latest_creatinine = creatinine_levels[-1]
+    rv1 = latest_creatinine / np.min(creatinine_levels)
+    rv2 = latest_creatinine / np.median(creatinine_levels)
+    return np.asarray([age, input_dict["sex"], latest_creatinine, rv1, rv2]), latest_date
+
+
+def patient(n_results, to_date):
+    dates = [f"2024-01-{1 + i % 28:02d} {i % 24:02d}:00:00" for i in range(n_results)]
+    return {
+        "mrn": 185620675,
+        "dob": to_date("1980-11-06 00:00:00"),
+        "sex": 1,
+        "dates": sorted(to_date(date) for date in dates),
+        "creatinine_levels": [70.0 + i % 50 for i in range(n_results)],
+    }
+
+
+def per_call_us(function, number, repeat):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results", default=[2, 10, 100], type=int, nargs="+",
+                        help="Results per patient in the fetched window")
+    parser.add_argument("--number", default=20000, type=int, help="Calls per timing")
+    parser.add_argument("--repeat", default=5, type=int, help="Timings per case; the fastest is reported")
+    flags = parser.parse_args()
+
+    predictor = AKIPredictor.__new__(AKIPredictor)  # the model is not needed to build features
+    convert = HL7MessageParser._convert_to_epoch
+    for n_results in flags.results:
+        text, epoch = patient(n_results, str), patient(n_results, timestamp_to_epoch)
+        legacy = per_call_us(lambda: (legacy_convert_to_datetime(HL7_DATE), legacy_preprocess(text)),
+                             flags.number, flags.repeat)
+        current = per_call_us(lambda: (convert(HL7_DATE), predictor.preprocess_and_transform(epoch)),
+                              flags.number, flags.repeat)
+        print(f"{n_results} results: text {legacy:.1f} us/call, epoch {current:.1f} us/call "
+              f"({legacy / current:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Timing, result files and comparison for benchmarks.micro.
+
+Each case is timed as repeat samples after warmup untimed ones. A sample runs the case number
+times back to back, with number picked so one sample takes about SAMPLE_SECONDS, and the
+garbage collector is off while it runs, as in timeit. Each sample gives the mean time of its
+number calls, and the percentiles are taken over those sample means, not over single calls:
+they show how the mean varies between samples, and with the default 30 samples p99 is close
+to the slowest one. Results are written as JSON together with the machine they were measured
+on, and compare() flags cases whose median sample mean grew by more than a threshold.
+"""
+import gc
+import sys
+import json
+import time
+import platform
+import subprocess
+import numpy as np
+from datetime import datetime, timezone
+
+
+SAMPLE_SECONDS = 0.01
+WARMUP = 3
+REPEAT = 30
+PERCENTILES = [50, 90, 99]
+SLOWDOWN_THRESHOLD = 0.10
+
+
+class Case:
+    """A benchmark case: function(state) is timed, with state = setup() made fresh for each sample.
+
+    Without setup the function takes no argument and the state is made once. teardown(state),
+    if given, runs after each sample. number fixes the calls per sample instead of calibrating it.
+    """
+
+    def __init__(self, name, function, setup=None, teardown=None, number=None, repeat=None):
+        self.name = name
+        self.function = function
+        self.setup = setup
+        self.teardown = teardown
+        self.number = number
+        self.repeat = repeat
+
+
+def _sample(case, number):
+    state = case.setup() if case.setup else None
+    call = (lambda: case.function(state)) if case.setup else case.function
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter_ns() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+        if case.teardown:
+            case.teardown(state)
+    return elapsed / number / 1e3  # microseconds per call
+
+
+def calibrate(case):
+    """Calls per sample so that a sample takes about SAMPLE_SECONDS."""
+    if case.number:
+        return case.number
+    number = 1
+    while True:
+        per_call = _sample(case, number)
+        if per_call * number >= SAMPLE_SECONDS * 1e6 / 10 or number >= 1 << 20:
+            return max(1, min(1 << 20, round(SAMPLE_SECONDS * 1e6 / per_call)))
+        number *= 10
+
+
+def measure(case, warmup=WARMUP, repeat=REPEAT):
+    """Statistics of a case's sample means (time per call within each sample), in microseconds."""
+    number = calibrate(case)
+    repeat = case.repeat or repeat
+    for _ in range(warmup):
+        _sample(case, number)
+    samples = np.array([_sample(case, number) for _ in range(repeat)])
+    stats = {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(samples, PERCENTILES))}
+    stats.update(min=float(samples.min()), mean=float(samples.mean()), max=float(samples.max()),
+                 stdev=float(samples.std()), number=number, repeat=repeat)
+    return stats
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def save(path, results):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(baseline, current, threshold=SLOWDOWN_THRESHOLD):
+    """(name, baseline p50, current p50, ratio, slower) for the cases both result sets have.
+
+    slower is True when the current median sample mean exceeds the baseline's by more than
+    threshold, and also exceeds the baseline's p90, so that one noisy run is not flagged.
+    """
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name], current[name]
+        ratio = after["p50"] / before["p50"]
+        rows.append((name, before["p50"], after["p50"], ratio, ratio > 1 + threshold and after["p50"] > before["p90"]))
+    return rows
@@ -0,0 +1,102 @@
+"""Compares startup cost of the streaming history.csv ingester with the previous pandas path.
+
+Run from the repository root:
+
+    python -m benchmarks.history_ingest --history history.csv --scale 1 10
+
+Each measurement runs in a fresh interpreter, so import time and peak RSS are those of a
+cold start. --scale N writes a history with N copies of every patient (under new MRNs) to
+show how memory grows with file size.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+def legacy_populate_history(db, history_csv_path):
+    """The pandas implementation populate_history used before the streaming ingester."""
+    import numpy as np
+    import pandas as pd
+    from datetime import datetime
+
+    hist = pd.read_csv(history_csv_path)
+    hist_rows = []
+    for _, row in hist.iterrows():
+        row = row[~pd.isnull(row)]
+        mrn = row["mrn"]
+        date_creatinine = row.values[1:].reshape(-1, 2)
+        dates = list(map(datetime.fromisoformat, date_creatinine[:, 0]))
+        creatinine_levels = date_creatinine[:, 1].astype(np.float32)
+        for date, creatinine_level in zip(dates, creatinine_levels):
+            hist_rows.append(f"({mrn}, '{date}', {creatinine_level})")
+
+    with db.pool.write() as conn:
+        conn.execute(f"INSERT OR IGNORE INTO blood_tests VALUES {', '.join(hist_rows)}")
+        conn.commit()
+
+
+def measure(path, history, db_name):
+    """Runs in the child interpreter: loads history into a new database and prints the cost."""
+    import time
+    import resource
+    start = time.perf_counter()
+    from src.database import Database
+    db = Database(db_name)
+    if path == "pandas":
+        legacy_populate_history(db, history)
+    else:
+        db.populate_history(history)
+    seconds = time.perf_counter() - start
+    rows = db.pool.writer.execute("SELECT COUNT(*) FROM blood_tests").fetchone()[0]
+    db.close()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": peak_rss_mb, "rows": rows}))
+
+
+def scale_history(history, scale, directory):
+    if scale == 1:
+        return history
+    scaled = os.path.join(directory, f"history_x{scale}.csv")
+    with open(history) as src, open(scaled, "w") as dst:
+        header, *rows = src.read().splitlines()
+        dst.write(header + "\n")
+        for copy in range(scale):
+            for row in rows:
+                mrn, rest = row.split(",", 1)
+                dst.write(f"{int(mrn) + copy * 10 ** 9},{rest}\n")
+    return scaled
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", default="history.csv", help="Path to history.csv")
+    parser.add_argument("--scale", default=[1], type=int, nargs="+", help="Copies of the history to load")
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    flags = parser.parse_args()
+
+    if flags.measure:
+        measure(flags.measure[0], flags.history, flags.measure[1])
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        for scale in flags.scale:
+            history = scale_history(flags.history, scale, directory)
+            for path in ("pandas", "streaming"):
+                db_name = os.path.join(directory, f"{path}.db")
+                cmd = [sys.executable, "-m", "benchmarks.history_ingest", "--history", history,
+                       "--measure", path, db_name]
+                result = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout)
+                os.remove(db_name)
+                print(f"x{scale} {path}: {result['rows']} rows, startup {result['seconds']:.2f}s, "
+                      f"peak RSS {result['peak_rss_mb']:.0f} MB")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
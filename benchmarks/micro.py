@@ -0,0 +1,201 @@
+"""Microbenchmarks of the parser, MLLP framing, database, features and model, with a compare mode.
+
+Run from the repository root:
+
+    python -m benchmarks.micro run --output before.json
+    python -m benchmarks.micro run --output after.json --filter database
+    python -m benchmarks.micro compare before.json after.json
+
+run times every case whose name contains one of the --filter strings (all by default) and
+prints and saves percentiles of its sample means, each the mean time per call over one sample;
+see benchmarks/harness.py for how. compare prints the median of every case in both files and
+exits with status 1 if any got slower by more than --threshold. Compare results measured on
+the same machine only.
+"""
+import os
+import sys
+import random
+import itertools
+import shutil
+import argparse
+import tempfile
+
+from src import simulator
+from src.parser import HL7MessageParser, SplitHL7MessageParser
+from src.database import Database
+from model.model_class import AKIPredictor
+from benchmarks import harness
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(ROOT, "model", "xgb_model.pkl")
+HISTORY_PATH = os.path.join(ROOT, "history.csv")
+TABLE_SIZES = [1000, 10000, 100000]
+RESULTS_PER_PATIENT = 10
+FEATURE_RESULTS = [2, 10, 100]
+MLLP_BATCH = 100
+
+MESSAGES = {
+    "ADT^A01": "MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A01|||2.5\r"
+               "PID|1||497030||ROSCOE DOHERTY||19870515|M\r"
+               "NK1|1|SUNNY BALWANI|PARTNER\r",
+    "ADT^A03": "MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102141500||ADT^A03|||2.5\r"
+               "PID|1||497030\r",
+    "ORU^R01": "MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102142000||ORU^R01|||2.5\r"
+               "PID|1||497030\r"
+               "OBR|1||||||20240102142000\r"
+               "OBX|1|SN|CREATININE||103.4\r",
+}
+
+
+def parser_cases():
+    for parser in (HL7MessageParser(), SplitHL7MessageParser()):
+        for msg_type, message in MESSAGES.items():
+            yield harness.Case(f"parser.{type(parser).__name__}.parse/{msg_type}",
+                               lambda parser=parser, message=message: parser.parse(message))
+
+
+def mllp_cases():
+    messages = [m.encode("ascii") for m in MESSAGES.values()] * (MLLP_BATCH // len(MESSAGES) + 1)
+    buffer = b"".join(bytes([simulator.MLLP_START_OF_BLOCK]) + m
+                      + bytes([simulator.MLLP_END_OF_BLOCK, simulator.MLLP_CARRIAGE_RETURN])
+                      for m in messages[:MLLP_BATCH])
+    yield harness.Case(f"simulator.parse_mllp_messages/{MLLP_BATCH} messages",
+                       lambda: simulator.parse_mllp_messages(buffer, "benchmark"))
+
+
+def patient(n_results):
+    return {
+        "mrn": 185620675,
+        "dob": 342316800,
+        "sex": 1,
+        "dates": [1704067200 + 3600 * i for i in range(n_results)],
+        "creatinine_levels": [70.0 + i % 50 for i in range(n_results)],
+    }
+
+
+def model_cases():
+    features = AKIPredictor.__new__(AKIPredictor)  # the model is not needed to build features
+    for n_results in FEATURE_RESULTS:
+        data = patient(n_results)
+        yield harness.Case(f"model.preprocess_and_transform/{n_results} results",
+                           lambda data=data: features.preprocess_and_transform(data))
+    rising = patient(10)
+    rising["creatinine_levels"][-1] = 250.0
+    for cascade in (False, True):
+        predictor = AKIPredictor(MODEL_PATH, cascade=cascade)
+        suffix = " cascade" if cascade else ""
+        for label, data in (("stable", patient(10)), ("rising", rising)):
+            yield harness.Case(f"model.predict/{label}{suffix}", lambda predictor=predictor, data=data: predictor.predict(data))
+
+
+class DatabaseFixture:
+    """A database file holding rows blood test results, RESULTS_PER_PATIENT per patient."""
+
+    def __init__(self, directory, rows):
+        self.db = Database(os.path.join(directory, f"bench-{rows}.db"))
+        self.mrns = list(range(100000000, 100000000 + rows // RESULTS_PER_PATIENT))
+        self.rng = random.Random(rows)
+        self.next_timestamp = 1704067200 + 3600 * RESULTS_PER_PATIENT
+        with self.db.transaction():
+            for mrn in self.mrns:
+                self.db.write_pas_data(mrn, 342316800, mrn % 2)
+        self.db.write_history((mrn, 1704067200 + 3600 * i, 70.0 + i)
+                              for mrn in self.mrns for i in range(RESULTS_PER_PATIENT))
+
+    def insert(self):
+        self.next_timestamp += 1
+        self.db.write_lims_data(self.rng.choice(self.mrns), self.next_timestamp, 80.0)
+
+    def fetch(self):
+        self.db.fetch_data(self.rng.choice(self.mrns), self.next_timestamp)
+
+
+def database_cases(directory, history_path):
+    for rows in TABLE_SIZES:
+        fixture = None
+
+        def get(rows=rows):
+            nonlocal fixture
+            if fixture is None:
+                fixture = DatabaseFixture(directory, rows)
+            return fixture
+
+        # The fixture is built untimed on first use, so filtered-out sizes cost nothing.
+        # Fetches run first, before inserts leave rows in the write-ahead log for them to read through.
+        yield harness.Case(f"database.fetch_data/{rows} rows", DatabaseFixture.fetch, setup=get)
+        yield harness.Case(f"database.write_lims_data/{rows} rows", DatabaseFixture.insert, setup=get)
+
+    if os.path.exists(history_path):
+        copies = itertools.count()
+
+        def setup():
+            path = os.path.join(directory, f"history-{next(copies)}.db")
+            return Database(path), path
+
+        def teardown(state):
+            db, path = state
+            db.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        yield harness.Case(f"database.populate_history/{os.path.basename(history_path)}",
+                           lambda state: state[0].populate_history(history_path),
+                           setup=setup, teardown=teardown, number=1, repeat=10)
+
+
+def cases(directory, history_path):
+    yield from parser_cases()
+    yield from mllp_cases()
+    yield from database_cases(directory, history_path)
+    yield from model_cases()
+
+
+def run(flags):
+    directory = tempfile.mkdtemp(prefix="micro-")
+    results = {}
+    try:
+        for case in cases(directory, flags.history):
+            if flags.filter and not any(f in case.name for f in flags.filter):
+                continue
+            stats = harness.measure(case, warmup=flags.warmup, repeat=flags.repeat)
+            results[case.name] = stats
+            print(f"{case.name:58} p50 {stats['p50']:10.1f} us  p90 {stats['p90']:10.1f} us  "
+                  f"p99 {stats['p99']:10.1f} us  of {stats['repeat']} means of {stats['number']} calls", flush=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    if flags.output:
+        harness.save(flags.output, results)
+    return 0
+
+
+def compare(flags):
+    rows = harness.compare(harness.load(flags.baseline), harness.load(flags.current), flags.threshold)
+    for name, before, after, ratio, slower in rows:
+        print(f"{name:58} {before:10.1f} us -> {after:10.1f} us  {ratio:5.2f}x{'  SLOWER' if slower else ''}")
+    slower = [row for row in rows if row[4]]
+    print(f"{len(slower)} of {len(rows)} cases slower by more than {flags.threshold:.0%}")
+    return 1 if slower else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Time the cases")
+    run_parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    run_parser.add_argument("--filter", default=[], nargs="+", help="Only cases whose name contains one of these")
+    run_parser.add_argument("--warmup", default=harness.WARMUP, type=int, help="Untimed samples per case")
+    run_parser.add_argument("--repeat", default=harness.REPEAT, type=int, help="Timed samples per case")
+    run_parser.add_argument("--history", default=HISTORY_PATH, help="history.csv timed by populate_history")
+    compare_parser = commands.add_parser("compare", help="Flag cases that got slower between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", default=harness.SLOWDOWN_THRESHOLD, type=float,
+                                help="Slowdown of the median flagged, as a fraction")
+    flags = parser.parse_args()
+    sys.exit(run(flags) if flags.command == "run" else compare(flags))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Syscalls and copies per message on the MLLP receive path, before and after MLLPReceiver.
+
+Run from the repository root with a recorded message file:
+
+    python -m benchmarks.mllp_receive --messages messages.mllp
+
+The messages are replayed over a localhost socket twice: --mode ack waits for a one byte
+acknowledgement after each message, as the hospital's sender does, and --mode stream sends
+them back to back, as after a reconnect with a backlog. Copies are the bytes copied in user
+space after recv returns; decoding the message to text, which both paths do, is not counted.
+"""
+import time
+import socket
+import argparse
+import threading
+
+from src import simulator
+from src.mllp import MLLPReceiver
+
+
+def send(sock, messages, mode):
+    for message in messages:
+        sock.sendall(bytes([simulator.MLLP_START_OF_BLOCK]) + message
+                     + bytes([simulator.MLLP_END_OF_BLOCK, simulator.MLLP_CARRIAGE_RETURN]))
+        if mode == "ack":
+            sock.recv(1)
+    sock.shutdown(socket.SHUT_WR)
+
+
+class LegacyReceiver:
+    """The receive loop of main_simulator before MLLPReceiver: recv, append, reparse."""
+
+    def __init__(self):
+        self.buffer = b""
+        self.recv_calls = 0
+        self.bytes_copied = 0
+
+    def receive(self, sock):
+        data = sock.recv(simulator.MLLP_BUFFER_SIZE)
+        self.recv_calls += 1
+        if len(data) == 0:
+            raise ConnectionError("closed")
+        self.buffer += data
+        self.bytes_copied += len(self.buffer)
+        messages, self.buffer = simulator.parse_mllp_messages(self.buffer, "")
+        self.bytes_copied += sum(len(m) for m in messages) + len(self.buffer)
+        return messages
+
+    def release(self):
+        pass
+
+
+def run(receiver, messages, mode):
+    ours, theirs = socket.socketpair()
+    sender = threading.Thread(target=send, args=(theirs, messages, mode), daemon=True)
+    start = time.perf_counter()
+    sender.start()
+    received = 0
+    try:
+        while True:
+            for frame in receiver.receive(ours):
+                str(frame, "utf-8", "replace")
+                receiver.release()
+                received += 1
+                if mode == "ack":
+                    ours.sendall(b"A")
+    except ConnectionError:
+        pass
+    seconds = time.perf_counter() - start
+    sender.join()
+    ours.close()
+    theirs.close()
+    assert received == len(messages), f"received {received} of {len(messages)} messages"
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", required=True, help="MLLP-framed messages to replay")
+    parser.add_argument("--mode", default=["ack", "stream"], choices=["ack", "stream"], nargs="+")
+    parser.add_argument("--repeat", default=3, type=int, help="Replays per case; the fastest is reported")
+    flags = parser.parse_args()
+
+    messages = simulator.read_hl7_messages(flags.messages)
+    size = sum(len(m) for m in messages) / len(messages)
+    print(f"{len(messages)} messages, {size:.0f} bytes each on average")
+    for mode in flags.mode:
+        for name, new in [("legacy", LegacyReceiver), ("ring buffer", MLLPReceiver)]:
+            runs = [(run(receiver, messages, mode), receiver) for receiver in (new() for _ in range(flags.repeat))]
+            seconds, receiver = min(runs, key=lambda r: r[0])
+            print(f"{mode:6} {name:11}: {receiver.recv_calls / len(messages):.2f} recv/message, "
+                  f"{receiver.bytes_copied / len(messages):.0f} bytes copied/message, "
+                  f"{len(messages) / seconds:.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Memory and throughput of parsed messages as slotted records, against the nested dicts they replace.
+
+Run from the repository root with a recorded message file:
+
+    python -m benchmarks.parsed_records --messages messages.mllp
+
+Both sides use the split parser, so the difference is only in what it builds. Memory is what
+tracemalloc sees allocated for the parsed backlog of the whole file, and for the entries a full
+score queue would hold, one per creatinine result; the message text itself is not counted.
+Throughput is parsing every message and then reading the fields persist and score use.
+"""
+import time
+import argparse
+import tracemalloc
+
+from src import simulator
+from src.parser import SplitHL7MessageParser
+
+
+class LegacySplitHL7MessageParser(SplitHL7MessageParser):
+    """The split parser before records: nested dicts holding the message's strings."""
+
+    def parse(self, hl7_message):
+        segments = [segment.split("|") for segment in hl7_message.split("\r") if segment]
+        names = [segment[0] for segment in segments]
+        if "MSH" not in names or "PID" not in names:
+            return None, None, "error"
+        msh = segments[names.index("MSH")]
+        pid = segments[names.index("PID")]
+        msg_type = self._field(msh, 8)
+        mrn = self._field(pid, 3)
+        if msg_type == "ADT^A01":
+            dob = self._convert_to_epoch(self._field(pid, 7))
+            sex = {"M": 0, "F": 1}.get(self._field(pid, 8), None)
+            if dob == None or sex == None:
+                return None, None, "error"
+            return "PAS_admit", {"mrn": mrn, "dob": dob, "sex": sex}, "no error"
+        elif msg_type == "ADT^A03":
+            return "PAS_discharge", {"mrn": mrn}, "no error"
+        elif msg_type == "ORU^R01":
+            results = []
+            current_obr = None
+            for segment in segments:
+                if segment[0] == "OBR":
+                    current_obr = segment
+                elif segment[0] == "OBX" and self._field(segment, 3) == "CREATININE":
+                    if current_obr is None:
+                        return None, None, "error"
+                    results.append({
+                        "result": self._field(segment, 5),
+                        "date": self._convert_to_epoch(self._field(current_obr, 7))
+                    })
+            if not results:
+                return None, None, "error"
+            return "LIMS", {"mrn": mrn, "results": results}, "no error"
+        return None, None, "error"
+
+
+def legacy_entries(parsed):
+    """Score queue entries as main_simulator queued them before records: (mrn, result dict)."""
+    return [(fields["mrn"], obs) for msg, fields, _ in parsed if msg == "LIMS" for obs in fields["results"]]
+
+
+def legacy_consume(parsed):
+    """Reads what persist and score read from each message, in the old shape."""
+    total = 0
+    for msg, fields, _ in parsed:
+        if msg == "LIMS":
+            for obs in fields["results"]:
+                total += int(fields["mrn"]) + obs["date"] + float(obs["result"])
+        elif msg == "PAS_admit":
+            total += int(fields["mrn"]) + fields["dob"] + fields["sex"]
+    return total
+
+
+def record_entries(parsed):
+    return [result for msg, fields, _ in parsed if msg == "LIMS" for result in fields.results]
+
+
+def record_consume(parsed):
+    total = 0
+    for msg, fields, _ in parsed:
+        if msg == "LIMS":
+            for result in fields.results:
+                total += result.mrn + result.date + result.value
+        elif msg == "PAS_admit":
+            total += fields.mrn + fields.dob + fields.sex
+    return total
+
+
+def traced_bytes(build):
+    """Bytes allocated by build() and still held by what it returns."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        held = build()
+        return tracemalloc.get_traced_memory()[0] - before, held
+    finally:
+        tracemalloc.stop()
+
+
+def throughput(parser, consume, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        consume([parser.parse(text) for text in texts])
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(texts) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", required=True, help="MLLP-framed messages to parse")
+    parser.add_argument("--repeat", default=5, type=int, help="Timings per side; the fastest is reported")
+    flags = parser.parse_args()
+
+    texts = [str(m, "utf-8", "replace") for m in simulator.read_hl7_messages(flags.messages)]
+    sides = [
+        ("dicts", LegacySplitHL7MessageParser(), legacy_entries, legacy_consume),
+        ("records", SplitHL7MessageParser(), record_entries, record_consume),
+    ]
+    print(f"{len(texts)} messages")
+    for name, message_parser, entries, consume in sides:
+        parsed_bytes, parsed = traced_bytes(lambda: [message_parser.parse(text) for text in texts])
+        entry_bytes, queued = traced_bytes(lambda: entries(parsed))
+        rate = throughput(message_parser, consume, texts, flags.repeat)
+        print(f"{name:8}: {parsed_bytes / len(texts):6.0f} bytes/parsed message, "
+              f"{entry_bytes / len(queued):5.0f} bytes/score queue entry, {rate:8.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Messages per second through router.py and 1, 2, 4... engine shards, end to end.
+
+Run from the repository root with a recorded message file:
+
+    python -m benchmarks.sharded_throughput --messages messages.mllp --shards 1 2 4
+
+For each shard count the script lays out src/, model/, main_simulator.py and router.py flat in
+a temporary directory, as the Docker image does, starts the router and one main_simulator.py
+per shard, each with its own state directory, waits for every engine to connect, and then
+starts src/simulator.py as the hospital's sender. The time reported is from the sender
+starting until the shards have acknowledged every message once, read from the router's
+router_messages_acknowledged metric. Each engine loads only its shard's part of --history.
+The shards share the machine's CPUs, so scaling is bounded by the number of cores.
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+from src import simulator
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def layout(directory):
+    for path in glob.glob(os.path.join(ROOT, "src", "*.py")) + glob.glob(os.path.join(ROOT, "model", "*")):
+        if os.path.isfile(path):
+            shutil.copy(path, directory)
+    for name in ("main_simulator.py", "router.py"):
+        shutil.copy(os.path.join(ROOT, name), directory)
+
+
+def metric(port, name):
+    """Sum of every sample of a metric, or None while the server is not up."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(name + "{"))
+
+
+def wait_for(condition, seconds, what):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if condition():
+            return
+        time.sleep(0.1)
+    raise TimeoutError(f"timed out waiting for {what}")
+
+
+def run(shards, flags, messages):
+    base = flags.base_port
+    mllp, pager, listen, metrics = base, base + 1, base + 10, base + 100
+    work = tempfile.mkdtemp(prefix="sharded-")
+    code = os.path.join(work, "simulator")
+    os.makedirs(code)
+    layout(code)
+    env = dict(os.environ, MLLP_ADDRESS=f"127.0.0.1:{mllp}", PAGER_ADDRESS=f"127.0.0.1:{pager}")
+    processes = []
+    try:
+        for name in ["router"] + [f"shard{i}" for i in range(shards)]:
+            os.makedirs(os.path.join(work, name))
+        log = open(os.path.join(work, "router", "out.txt"), "w")
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(code, "router.py"), "--shards", str(shards), "--listen-port", str(listen),
+             "--state", os.path.join(work, "router"), "--metrics-port", str(metrics)],
+            env=env, stdout=log, stderr=subprocess.STDOUT))
+        for i in range(shards):
+            log = open(os.path.join(work, f"shard{i}", "out.txt"), "w")
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(code, "main_simulator.py"), "--history", flags.history,
+                 "--state", os.path.join(work, f"shard{i}"), "--metrics-port", str(metrics + 1 + i),
+                 "--shard", str(i), "--shards", str(shards)] + flags.engine_args,
+                env=dict(env, MLLP_ADDRESS=f"127.0.0.1:{listen + i}"), stdout=log, stderr=subprocess.STDOUT))
+        wait_for(lambda: metric(metrics, "router_shard_connected") == shards, flags.timeout, "the engines to connect")
+
+        start = time.perf_counter()
+        log = open(os.path.join(work, "sender.txt"), "w")
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "src", "simulator.py"), f"--messages={flags.messages}",
+             f"--mllp={mllp}", f"--pager={pager}"], stdout=log, stderr=subprocess.STDOUT))
+        wait_for(lambda: (metric(metrics, "router_messages_acknowledged") or 0) >= len(messages), flags.timeout,
+                 "every message to be acknowledged")
+        return time.perf_counter() - start
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not flags.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", required=True, help="MLLP-framed messages to replay")
+    parser.add_argument("--history", default=os.path.join(ROOT, "history.csv"))
+    parser.add_argument("--shards", default=[1, 2, 4], type=int, nargs="+")
+    parser.add_argument("--base-port", default=28800, type=int, help="Ports from here up to here + 100 + shards are used")
+    parser.add_argument("--timeout", default=600, type=float, help="Seconds to wait for each step")
+    parser.add_argument("--keep", action="store_true", help="Keep each run's state and logs")
+    parser.add_argument("engine_args", nargs=argparse.REMAINDER, help="Extra main_simulator.py flags, after --")
+    flags = parser.parse_args()
+    flags.engine_args = [arg for arg in flags.engine_args if arg != "--"]
+
+    messages = simulator.read_hl7_messages(flags.messages)
+    print(f"{len(messages)} messages, {os.cpu_count()} CPUs")
+    baseline = None
+    for shards in flags.shards:
+        seconds = run(shards, flags, messages)
+        rate = len(messages) / seconds
+        baseline = baseline or rate
+        print(f"{shards} shard(s): {rate:.0f} messages/s ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Time from a blood test result being sent to its page reaching the pager, as percentiles.
+
+Run src/simulator.py with the load-test pager and both records, then point this at them:
+
+    ./src/simulator.py --messages messages.mllp --pager_mode async --pager_latency lognormal:0.05,0.5 \
+        --pager_error_rate 0.05 --pager_outage 20-30 --mllp_record sent.csv --pager_record pages.csv
+    python -m benchmarks.time_to_page --sent sent.csv --pages pages.csv
+
+Each page answered 200 is matched to the last result (ORU^R01) sent for its MRN before the
+page arrived. Attempts answered 500 or dropped during an outage are counted separately, and
+retried pages are matched like any other, so their time includes the retries.
+"""
+import csv
+import bisect
+import argparse
+from collections import defaultdict, Counter
+
+import numpy as np
+
+
+PERCENTILES = [50, 90, 99]
+
+
+def read(filename):
+    with open(filename, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def time_to_page(sent, pages):
+    """Seconds from result to page for every page answered 200, and the status of every attempt."""
+    results = defaultdict(list)  # MRN -> times its results were sent, in order
+    for row in sent:
+        if row["type"].startswith("ORU"):
+            results[row["mrn"]].append(float(row["sent_at"]))
+    for times in results.values():
+        times.sort()
+    seconds = []
+    statuses = Counter(row["status"] for row in pages)
+    for row in pages:
+        if row["status"] != "200":
+            continue
+        times = results.get(row["mrn"], [])
+        received_at = float(row["received_at"])
+        i = bisect.bisect_right(times, received_at)
+        if i:
+            seconds.append(received_at - times[i - 1])
+    return seconds, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sent", required=True, help="CSV written by src/simulator.py --mllp_record")
+    parser.add_argument("--pages", required=True, help="CSV written by src/simulator.py --pager_record")
+    flags = parser.parse_args()
+
+    seconds, statuses = time_to_page(read(flags.sent), read(flags.pages))
+    print(", ".join(f"{count} {status}" for status, count in sorted(statuses.items())))
+    if not seconds:
+        print("no pages matched a result")
+        return
+    values = np.percentile(seconds, PERCENTILES)
+    print(f"{len(seconds)} pages: " + ", ".join(f"p{p} {v * 1000:.1f} ms" for p, v in zip(PERCENTILES, values))
+          + f", max {max(seconds) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
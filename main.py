@@ -1,50 +1,82 @@
-import os
+import time
+import argparse
 import pandas as pd
 from tqdm import tqdm
 
-from src.database import Database
-from src.parser import HL7MessageParser
+from src.batch import parse_messages, read_history, point_in_time_features, score, f_score
+from src.database import Database, epoch_to_timestamp
+from src.parser import HL7MessageParser, SplitHL7MessageParser
+from src.replay import replay_stream
 from src.simulator import read_hl7_messages
 from model.model_class import AKIPredictor
 from prometheus_client import start_http_server, Counter
 
 
 
-messages_counter = Counter('messaged_received', 'Number of messages received') 
+messages_counter = Counter('messaged_received', 'Number of messages received')
 lims_counter = Counter('blood_test_received', 'Number of LIMs messages receieved')
 
 
+def count_message(msg):
+    messages_counter.inc() # increment counter
+    if msg == "LIMS":
+        lims_counter.inc()
+
+
+def run_stream(hl7_messages, history_csv_path, parser, predictor):
+    """Replays the feed one message at a time through the same steps as main_simulator."""
+    db = Database(":memory:")
+    db.populate_history(history_csv_path)
+    outputs = replay_stream(tqdm(hl7_messages), db, parser, predictor, on_message=count_message)
+    db.close()
+    return pd.DataFrame([(mrn, epoch_to_timestamp(ts)) for _, mrn, ts in outputs], columns=["mrn", "timestamp"])
+
+
+def run_batch(hl7_messages, history_csv_path, parser, predictor):
+    """Scores every result of the feed at once. Produces the same output as run_stream."""
+    admits, results = parse_messages(hl7_messages, parser)
+    features = point_in_time_features(admits, results, read_history(history_csv_path))
+    scored = score(features, predictor)
+    positives = scored[scored["prediction"] == 1]
+    return pd.DataFrame({
+        "mrn": positives["mrn"].astype(int),
+        "timestamp": [epoch_to_timestamp(ts) for ts in positives["timestamp"]],
+    })
+
+
 if __name__ == "__main__":
-    start_http_server(8000)
-    hl7_messages = read_hl7_messages("messages.mllp")
-
-    parser = HL7MessageParser()
-    db = Database()
-    db.populate_history("history.csv")
-    predictor = AKIPredictor("model/xgb_model.pkl")
-    outputs = []
-
-    for message in tqdm(hl7_messages[:5000]):
-        messages_counter.inc() # increment counter
-        msg, fields = parser.parse(message.decode("utf-8"))
-        mrn = fields["mrn"]
-
-        if msg == "PAS_admit":
-            db.write_pas_data(**fields)
-        elif msg == "LIMS":
-            for obs in fields["results"]:
-                db.write_lims_data(mrn, **obs)
-        else:
-            continue
-
-        if msg == "LIMS":
-            lims_counter.inc()
-            data = db.fetch_data(mrn)
-            preds = predictor.predict(data)
-            if preds[0] == 1:
-                outputs.append([mrn, preds[2]])
-
-    output = pd.DataFrame(outputs, columns=["mrn", "timestamp"])
-    output.to_csv("pred_aki.csv", index=False)
-    os.remove("patients.db")
-    os.remove("blood_tests.db")
+    flags = argparse.ArgumentParser()
+    flags.add_argument("--messages", default="messages.mllp", help="Path to the .mllp replay file")
+    flags.add_argument("--history", default="history.csv", help="Path to history.csv")
+    flags.add_argument("--mode", default="stream", choices=["stream", "batch"],
+                       help="Replay message by message, or score the whole feed vectorized")
+    flags.add_argument("--limit", default=None, type=int, help="Only replay the first N messages")
+    flags.add_argument("--hl7apy", action="store_true",
+                       help="Parse with hl7apy in batch mode too (slower, same results)")
+    flags.add_argument("--expected", default="tests/aki.csv", help="Expected pages, for the F3 score")
+    flags.add_argument("--cascade", action="store_true",
+                       help="Settle results with ratios certified negative for the model without running it")
+    flags.add_argument("--output", default="pred_aki.csv")
+    flags = flags.parse_args()
+
+    hl7_messages = read_hl7_messages(flags.messages)[:flags.limit]
+    predictor = AKIPredictor("model/xgb_model.pkl", cascade=flags.cascade)
+
+    start = time.perf_counter()
+    if flags.mode == "stream":
+        start_http_server(8000)
+        output = run_stream(hl7_messages, flags.history, HL7MessageParser(), predictor)
+    else:
+        parser = HL7MessageParser() if flags.hl7apy else SplitHL7MessageParser()
+        output = run_batch(hl7_messages, flags.history, parser, predictor)
+    elapsed = time.perf_counter() - start
+
+    output.to_csv(flags.output, index=False)
+    expected = pd.read_csv(flags.expected)
+    f3 = f_score(zip(output["mrn"], output["timestamp"]), zip(expected["mrn"], expected["date"]))
+    print(f"{flags.mode}: {len(hl7_messages)} messages in {elapsed:.2f}s, "
+          f"{len(output)} pages, F3 {f3:.3f} against {flags.expected}")
+    if predictor.thresholds is not None:
+        print(f"cascade: rv1 < {predictor.thresholds[0]:.3f} and rv2 < {predictor.thresholds[1]:.3f}, "
+              f"{predictor.short_circuit_fraction:.1%} of results settled without the model, "
+              f"{predictor.latency_saved_seconds * 1e3:.0f}ms of model time saved")
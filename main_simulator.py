@@ -1,96 +1,244 @@
 import os
-import gc
 import sys
 import time
 import pickle
 import socket
+import shutil
 import signal
 import logging
 import argparse
+import threading
 import urllib.request
-from copy import deepcopy
+from functools import partial
 from threading import Thread
 
-from database import Database
-from parser import HL7MessageParser
+from database import Database, timestamp_to_epoch
+from parser import HL7MessageParser, Result
+from patient_cache import PatientCache
+from retention import RetentionCompactor, RETENTION_DAYS
+from model_registry import ModelRegistry
+from shadow import ShadowLane
+from dedup import DedupIndex
+from alerts import AlertManager, SUPPRESSION_HOURS
+from pipeline import Pipeline
+from lims_queue import LIMSQueue
+from memory import MemoryMonitor, AllocationTracker, MEMORY_BUDGET_MB
+from debug_server import start_debug_server
+from mllp import MLLPReceiver
+from prefetch import Prefetcher
+from sharding import HashRing
+from profiler import StackSampler, collapsed, PROFILE_SECONDS, SAMPLE_HZ, MAX_PROFILE_SECONDS, MAX_SAMPLE_HZ
 from model_class import AKIPredictor
 from acknowledgements import create_acknowledgement
-from prometheus_client import start_http_server, Counter
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, REGISTRY
 
-import simulator
 
+class Total:
+    """A running total kept by another object, exported as a counter.
+
+    Like Gauge.set_function, the function is called on every scrape, but the metric is a counter
+    so rate() and increase() apply. It resets when the object keeping the total is replaced.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = list(labelnames)
+        self.functions = {}  # label values -> function returning the total
+        REGISTRY.register(self)
+
+    def set_function(self, function, labelvalues=()):
+        self.functions[tuple(labelvalues)] = function
+
+    def describe(self):
+        yield CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+
+    def collect(self):
+        family = CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for labelvalues, function in list(self.functions.items()):
+            family.add_metric(list(labelvalues), function())
+        yield family
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("/state/logs.txt"),
-        logging.StreamHandler()]
-)
 
 messages_counter = Counter('messaged_received', 'Number of messages received') 
 lims_counter = Counter('blood_test_received', 'Number of LIMs messages receieved')
 mllp_counter = Counter('mllp_connections_made', 'Number of connections to the MLLP socket')
 http_counter = Counter('failed_http', 'Number of times the pager HTTP request failed')
 pos_counter = Counter('pos_predictions', 'Number of positive AKI predictions made')
-
-
+hot_gauge = Gauge('patients_hot', 'Number of patients whose state is held in memory, including the mapped snapshot')
+cold_gauge = Gauge('patients_cold', 'Number of patients whose state is held only in SQLite')
+demoted_total = Total('patients_demoted', 'Discharged patients moved out of memory to SQLite')
+promotion_histogram = Histogram('patient_promotion_seconds', 'Time to load an admitted patient into memory ahead of their results')
+prefetch_hit_rate_gauge = Gauge('prefetch_hit_rate', 'Share of first results after an admission scored from patients already in memory')
+prefetch_dropped_total = Total('prefetch_dropped', 'Admissions not prefetched because the prefetch queue was full')
+pages_delivered_total = Total('pages_delivered', 'Number of pages delivered to the pager')
+pages_suppressed_total = Total('pages_suppressed', 'Positive results suppressed as part of an already paged AKI event')
+pages_coalesced_total = Total('pages_coalesced', 'New AKI events merged into a page that was not delivered yet')
+pages_pending_gauge = Gauge('pages_pending', 'Pages waiting to be delivered')
+duplicate_counter = Counter('duplicate_results', 'Blood test results dropped because they were already processed')
+model_swaps_total = Total('model_swaps', 'Number of models swapped in, including rollbacks')
+model_rejections_total = Total('model_rejections', 'Number of new models that failed validation')
+shadow_counter = Counter('shadow_predictions', 'Shadow model predictions, by agreement with production', ['model', 'agreement'])
+shadow_latency_histogram = Histogram('shadow_prediction_seconds', 'Shadow model prediction latency', ['model'])
+shadow_divergence_histogram = Histogram(
+    'shadow_probability_divergence', 'Absolute difference between shadow and production AKI probability', ['model'],
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0)
+)
+shadow_queue_gauge = Gauge('shadow_queue_depth', 'LIMS results waiting for shadow evaluation')
+shadow_dropped_total = Total('shadow_dropped', 'LIMS results skipped by shadow evaluation because its queue was full')
+stage_depth_gauge = Gauge('pipeline_queue_depth', 'Items waiting in front of each ingest stage', ['stage'])
+stage_blocked_total = Total('pipeline_blocked_seconds', 'Time spent waiting for room in front of each ingest stage', ['stage'])
+lims_queue_gauge = Gauge('lims_queue_depth', 'LIMS results waiting for PAS data')
+lims_queue_dropped_counter = Counter('lims_queue_dropped', 'LIMS results dropped unscored from a full LIMS queue')
+# RSS itself is exported by the default process collector as process_resident_memory_bytes.
+structure_bytes_gauge = Gauge('memory_structure_bytes', 'Size of in-memory structures, estimated from a sample of their entries', ['structure'])
+memory_budget_gauge = Gauge('memory_budget_bytes', 'Soft RSS budget above which patients are evicted from memory')
+memory_evicted_total = Total('memory_evicted_patients', 'Patients evicted from memory to stay within the budget')
+cascade_short_circuited_total = Total('cascade_short_circuited', 'Results the active model settled as negatives without running it')
+cascade_model_calls_total = Total('cascade_model_calls', 'Results the active model ran the full model for')
+cascade_fraction_gauge = Gauge('cascade_short_circuit_fraction', 'Share of results the active model settled without running it')
+cascade_latency_saved_gauge = Gauge('cascade_latency_saved_seconds', 'Estimated model time saved by the cascade for the active model')
+mllp_recv_calls_total = Total('mllp_recv_calls', 'recv_into calls made on the MLLP socket')
+mllp_bytes_received_total = Total('mllp_bytes_received', 'Bytes received on the MLLP socket')
+mllp_bytes_copied_total = Total('mllp_bytes_copied', 'Bytes copied within the MLLP receive buffer to make room')
+mllp_messages_total = Total('mllp_messages_framed', 'Messages framed from the MLLP socket')
+mllp_buffer_gauge = Gauge('mllp_buffer_bytes', 'Size of the MLLP receive buffer')
+
+
+HTTP_PORT = 8000
 MLLP_RETRY_SECONDS = 1
+LIMS_QUEUE_SIZE = 10000
+STATE_DIR = "/state"  # set from --state; each shard of a sharded deployment has its own
+DB_FILE = "aki.db"
+LEGACY_PAT_DB_FILE = "patients.db"
+LEGACY_TESTS_DB_FILE = "blood_tests.db"
+SNAPSHOT_DIR = "snapshot"
+SNAPSHOT_INTERVAL_SECONDS = 300
+MODEL_DIR = "models"
+ALERTS_FILE = "alerts.pkl"
+LIMS_QUEUE_FILE = "lims_queue.pkl"
+LEGACY_PAGER_QUEUE_FILE = "pager_queue.pkl"
+
+lims_queue = LIMSQueue(LIMS_QUEUE_SIZE)
+
+
+def state_path(name):
+    return os.path.join(STATE_DIR, name)
+
+
+def load_lims_queue():
+    if os.path.isfile(state_path(LIMS_QUEUE_FILE)):
+        with open(state_path(LIMS_QUEUE_FILE), "rb") as f:
+            # Saved as (mrn, timestamp, value). Queues saved by earlier versions hold (mrn, timestamp)
+            # pairs, some with "YYYY-MM-DD HH:MM:SS" timestamps, blank if unknown.
+            for entry in pickle.load(f):
+                mrn, timestamp, value = entry if len(entry) == 3 else (*entry, None)
+                if not isinstance(timestamp, int):
+                    if not timestamp.strip():
+                        continue
+                    timestamp = timestamp_to_epoch(timestamp)
+                lims_queue.append(Result(int(mrn), timestamp, value))
 
-if os.path.isfile("/state/lims_queue.pkl"):
-    with open("/state/lims_queue.pkl", "rb") as f:
-        lims_queue = pickle.load(f)
-    with open("/state/pager_queue.pkl", "rb") as f:
-        pager_queue = pickle.load(f)
-else:
-    lims_queue, pager_queue = [], []
 
+def queue_for_pas_data(result):
+    if lims_queue.append(result):
+        lims_queue_dropped_counter.inc()
 
-def process_lims_queue(predictor, logger):
-    while True:
-        if not lims_queue:
-            time.sleep(1)
-            continue
 
-        lims_queue_copy = deepcopy(lims_queue)
-        db_copy = Database("/state/patients.db", "/state/blood_tests.db")
+def process_lims_queue(db, registry, alerts, logger):
+    def score(result):
+        mrn, timestamp = result.mrn, result.date
+        data = db.fetch_data(mrn, timestamp)
+        if data is None:
+            return False
 
-        for lims_data in lims_queue_copy:
-            mrn, timestamp = lims_data
-            data = db_copy.fetch_data(mrn, timestamp)
-            if data is None:
-                continue
+        y_pred, test_date = registry.predictor.predict(data, count=True)
+        logger.info(f"LIMS Queue, Prediction: {y_pred}, made for MRN: {mrn}, timestamp: {timestamp}")
+        if y_pred == 1:
+            alerts.raise_alert(mrn, test_date)
+        return True
 
-            y_pred, test_date = predictor.predict(data)
-            logger.info(f"LIMS Queue, Prediction: {y_pred}, made for MRN: {mrn}, timestamp: {timestamp}")
-            if y_pred == 1:
-                pager_data = f"{mrn},{test_date.strftime('%Y%m%d%H%M%S')}".encode("utf-8")
-                pager_queue.append(pager_data)
+    while True:
+        try:
+            if lims_queue:
+                lims_queue.retry(score)
+        except Exception as e:
+            logger.warning(f"LIMS queue retry failed: {e}")
+        time.sleep(1)  # Results still waiting for PAS data are retried on the next pass
+
+
+def send_page(pager_host, pager_port, pager_data):
+    try:
+        urllib.request.urlopen(f"http://{pager_host}:{pager_port}/page", timeout=1, data=pager_data)
+    except Exception:
+        http_counter.inc()
+        raise
+
+
+def load_alerts(alerts, logger):
+    if os.path.isfile(state_path(ALERTS_FILE)):
+        with open(state_path(ALERTS_FILE), "rb") as f:
+            state = pickle.load(f)
+        # Test dates were saved as datetimes before they became epoch seconds.
+        state["last_positive"] = {
+            mrn: date if isinstance(date, int) else timestamp_to_epoch(str(date))
+            for mrn, date in state["last_positive"].items()
+        }
+        alerts.restore(state)
+    if os.path.isfile(state_path(LEGACY_PAGER_QUEUE_FILE)):
+        with open(state_path(LEGACY_PAGER_QUEUE_FILE), "rb") as f:
+            for pager_data in pickle.load(f):
+                alerts.enqueue(pager_data)
+        os.remove(state_path(LEGACY_PAGER_QUEUE_FILE))
+    if alerts.pending:
+        logger.info(f"{len(alerts.pending)} undelivered pages restored")
+
+
+def record_shadow_result(name, agreed, seconds, divergence):
+    shadow_counter.labels(name, "agree" if agreed else "disagree").inc()
+    shadow_latency_histogram.labels(name).observe(seconds)
+    if divergence is not None:
+        shadow_divergence_histogram.labels(name).observe(divergence)
+
+
+def snapshot_patient_cache(cache, logger):
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            path = cache.save_snapshot(state_path(SNAPSHOT_DIR))
+            logger.info(f"Patient cache snapshot written to {path}")
+        except Exception as e:
+            logger.warning(f"Patient cache snapshot failed: {e}")
 
-            lims_queue.remove(lims_data)
 
-        db_copy.close()
-        del lims_queue_copy, db_copy
-        gc.collect()
+def debug_memory(monitor, tracker, query):
+    """/debug/memory: RSS, budget and structure sizes, then the top allocating lines.
 
+    Structure sizes are measured by walking every object, which holds up ingest for a moment
+    on a large cache. The first request starts tracemalloc; ?diff=1 shows growth since the
+    previous request, ?limit=N sets the number of lines and ?stop=1 stops tracing again.
+    """
+    budget = "none" if monitor.budget_bytes is None else f"{monitor.budget_bytes >> 20} MB"
+    lines = [f"rss {monitor.rss >> 20} MB (at last check), budget {budget}, evicted {monitor.evicted} patients"]
+    lines += [f"{name} {size >> 10} KiB" for name, size in sorted(monitor.measured_sizes().items())]
+    report = tracker.report(
+        limit=int(query.get("limit", 25)), diff=query.get("diff") == "1", stop=query.get("stop") == "1"
+    )
+    return "text/plain; charset=utf-8", ("\n".join(lines) + "\n\n" + report).encode("utf-8")
 
-def process_pager_queue(pager_host, pager_port, logger):
-    while True:
-        if not pager_queue:
-            time.sleep(1)
-            continue
 
-        pager_queue_copy = deepcopy(pager_queue)
-        for pager_data in pager_queue_copy:
-            try:
-                urllib.request.urlopen(f"http://{pager_host}:{pager_port}/page", timeout=1, data=pager_data)
-                logger.info(f"Pager queue, Pager request sent successfully for {pager_data.decode('utf-8')}")
-            except:
-                continue
-            pager_queue.remove(pager_data)
+def debug_profile(sampler, query):
+    """/debug/profile: samples every thread's stack for ?seconds=N (default 10) at ?hz=H (default 100).
 
-        del pager_queue_copy
-        gc.collect()
+    Returns collapsed stacks for flamegraph.pl or speedscope. Nothing is sampled between requests.
+    """
+    seconds = min(float(query.get("seconds", PROFILE_SECONDS)), MAX_PROFILE_SECONDS)
+    hz = min(float(query.get("hz", SAMPLE_HZ)), MAX_SAMPLE_HZ)
+    stacks = sampler.profile(seconds, hz)
+    if stacks is None:
+        raise RuntimeError("A profile is already running")
+    return "text/plain; charset=utf-8", collapsed(stacks).encode("utf-8")
 
 
 def connect_to_mllp_server(host, port, logger):
@@ -107,8 +255,90 @@ def connect_to_mllp_server(host, port, logger):
     return s
 
 
+class MLLPConnection:
+    """The MLLP socket, shared by the receive loop and the pipeline stage that sends ACKs.
+
+    Either side may find the connection broken. generation counts reconnects, so a failure
+    seen by both sides reconnects once, and an ACK for a message received on an earlier
+    connection is never sent on the new one: the sender resends that message instead.
+    """
+
+    def __init__(self, host, port, logger):
+        self.host, self.port, self.logger = host, port, logger
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.socket = connect_to_mllp_server(host, port, logger)
+        self.receiver = MLLPReceiver()
+        self.received_generation = 0
+
+    def recv(self):
+        """Returns the generation received from and the frames completed, see MLLPReceiver."""
+        with self.lock:
+            generation, s = self.generation, self.socket
+        if generation != self.received_generation:
+            self.receiver.reset()  # a partial message from the old connection is resent
+            self.received_generation = generation
+        return generation, self.receiver.receive(s)
+
+    def reconnect(self, generation, reason):
+        with self.lock:
+            if generation != self.generation:
+                return  # the other side already reconnected
+            self.logger.warning(f"{reason}. Reconnecting")
+            self.close()
+            self.socket = connect_to_mllp_server(self.host, self.port, self.logger)
+            self.generation += 1
+
+    def send_ack(self, generation, ack):
+        with self.lock:
+            if generation != self.generation:
+                return False
+            try:
+                self.socket.sendall(ack)
+                return True
+            except Exception as e:
+                failure = f"MLLP connection failed: {e}"
+        self.reconnect(generation, failure)
+        return False
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # wakes up a recv blocked in the other thread
+        except OSError:
+            pass
+        self.socket.close()
+
+
 if __name__ == "__main__":
-    start_http_server(8000)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", default="/data/history.csv", help="Path to history.csv")
+    parser.add_argument("--state", default=STATE_DIR, help="Directory holding this instance's state")
+    parser.add_argument("--metrics-port", default=HTTP_PORT, type=int, help="Port for /metrics and /debug")
+    parser.add_argument("--shard", default=0, type=int,
+                        help="MRN shard this instance owns, when behind router.py (only its history is loaded)")
+    parser.add_argument("--shards", default=1, type=int, help="Number of MRN shards")
+    parser.add_argument("--retention-days", default=RETENTION_DAYS, type=float,
+                        help="Days of raw blood test results to keep before compacting them")
+    parser.add_argument("--shadow-model", action="append", default=[],
+                        help="Candidate model scored alongside production without paging (repeatable)")
+    parser.add_argument("--page-suppression-hours", default=SUPPRESSION_HOURS, type=float,
+                        help="Positive results this close to a patient's previous one are part of the same event")
+    parser.add_argument("--memory-budget-mb", default=MEMORY_BUDGET_MB, type=float,
+                        help="Soft RSS budget; above it the least recently used patients leave memory (0 disables)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Settle results with ratios certified negative for the model without running it")
+    flags = parser.parse_args()
+
+    STATE_DIR = flags.state
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(state_path("logs.txt")),
+            logging.StreamHandler()]
+    )
+    routes = {"/metrics": lambda query: (CONTENT_TYPE_LATEST, generate_latest())}
+    start_debug_server(flags.metrics_port, routes)
     logger = logging.getLogger(__name__)
     logger.info("Starting system")
 
@@ -117,110 +347,225 @@ if __name__ == "__main__":
     PAGER_HOST, PAGER_PORT = os.getenv("PAGER_ADDRESS").split(":")
     PAGER_PORT = int(PAGER_PORT)
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--history", default="/data/history.csv", help="Path to history.csv")
-    flags = parser.parse_args()
-
+    load_lims_queue()
     msg_parser = HL7MessageParser()
-    db = Database("/state/patients.db", "/state/blood_tests.db")
-    db.populate_history(flags.history)
+    db = Database(state_path(DB_FILE))
+    db.pool.claim_writer()
+    restarted = db.db_exists
+    if not restarted and os.path.isfile(state_path(LEGACY_PAT_DB_FILE)):
+        db.migrate_legacy(state_path(LEGACY_PAT_DB_FILE), state_path(LEGACY_TESTS_DB_FILE))
+        logger.info("Migrated legacy patients.db / blood_tests.db into the unified store.")
+    if flags.shards > 1:
+        ring = HashRing(flags.shards)
+        db.populate_history(flags.history, keep=lambda mrn: ring.owner(mrn) == flags.shard)
+        logger.info(f"Shard {flags.shard} of {flags.shards}")
+    else:
+        db.populate_history(flags.history)
     logger.info("Database loaded successfully.")
 
-    predictor = AKIPredictor("/simulator/xgb_model.pkl")
+    if db.removed_duplicates:
+        logger.info(f"Removed {db.removed_duplicates} duplicate blood test results")
 
-    s = connect_to_mllp_server(MLLP_HOST, MLLP_PORT, logger)
-    buffer = b""  # Buffer to store incomplete messages
+    cache = PatientCache(db)
+    dedup = DedupIndex()
+    if not restarted or db.removed_duplicates:
+        # Snapshot watermarks refer to rowids of a previous store, or the snapshot holds removed duplicates.
+        shutil.rmtree(state_path(SNAPSHOT_DIR), ignore_errors=True)
+    else:
+        replayed = cache.load_snapshot(state_path(SNAPSHOT_DIR))
+        if replayed is not None:
+            logger.info(f"Patient cache restored from snapshot ({len(cache)} patients, {replayed} rows replayed)")
+
+    load_model = partial(AKIPredictor, cascade=flags.cascade)
+    model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xgb_model.pkl")
+    registry = ModelRegistry(state_path(MODEL_DIR), load_model, model_path)
+    logger.info(f"Model {registry.version} loaded")
+    if registry.predictor.thresholds is not None:
+        logger.info(f"Cascade settles results with rv1 < {registry.predictor.thresholds[0]:.3f} "
+                    f"and rv2 < {registry.predictor.thresholds[1]:.3f} without the model")
+
+    alerts = AlertManager(partial(send_page, PAGER_HOST, PAGER_PORT), flags.page_suppression_hours)
+    load_alerts(alerts, logger)
+
+    conn = MLLPConnection(MLLP_HOST, MLLP_PORT, logger)
 
     def graceful_shutdown(signum, frame):
         logger.info("Shutting down system.")
+        # Nothing more is received while this runs. Messages not acknowledged yet are resent after
+        # the restart; results already stored and acknowledged are scored by the score stage
+        # before it stops, or queued for the restart.
+        for name in pipeline.names:
+            if not pipeline.stop(name):
+                logger.warning(f"Pipeline stage {name} did not stop in time")
+        for result in pipeline.drain("score"):
+            lims_queue.append(result)
+        conn.close()
+        if cache.save_snapshot(state_path(SNAPSHOT_DIR), blocking=False) is None:
+            logger.warning("Patient cache busy, skipped shutdown snapshot")
         db.close()
-        s.close()
-        with open("/state/lims_queue.pkl", "wb") as f:
-            pickle.dump(lims_queue, f)
-        with open("/state/pager_queue.pkl", "wb") as f:
-            pickle.dump(pager_queue, f)
+        with open(state_path(LIMS_QUEUE_FILE), "wb") as f:
+            pickle.dump([(r.mrn, r.date, r.value) for r in lims_queue.items()], f)
+        with open(state_path(ALERTS_FILE), "wb") as f:
+            pickle.dump(alerts.state(), f)
         logger.info("Received SIGTERM. Flushing and shutting down...")
         logging.shutdown() 
         sys.exit(0)
 
-    signal.signal(signal.SIGTERM, graceful_shutdown)
-
-    lims_queue_thread = Thread(target=process_lims_queue, args=(predictor, logger), daemon=True)
+    lims_queue_thread = Thread(target=process_lims_queue, args=(db, registry, alerts, logger), daemon=True)
     lims_queue_thread.start()
 
-    pager_queue_thread = Thread(target=process_pager_queue, args=(PAGER_HOST, PAGER_PORT, logger), daemon=True)
-    pager_queue_thread.start()
-
-    while True:
-        try:
-            data = s.recv(simulator.MLLP_BUFFER_SIZE)
-        except Exception as e:
-            logger.warning(f"MLLP connection failed: {e}. Reconnecting")
-            s.close()
-            s = connect_to_mllp_server(MLLP_HOST, MLLP_PORT, logger)
-            continue
-
-        if len(data) == 0:
-            logger.warning("MLLP connection closed by peer. Reconnecting")
-            s.close()
-            s = connect_to_mllp_server(MLLP_HOST, MLLP_PORT, logger)
-            continue
-
-        buffer += data  # Append received data to buffer
+    alerts.start()
+
+    snapshot_thread = Thread(target=snapshot_patient_cache, args=(cache, logger), daemon=True)
+    snapshot_thread.start()
+
+    RetentionCompactor(db, cache, flags.retention_days).start()
+    registry.start()
+
+    shadow = None
+    if flags.shadow_model:
+        shadow = ShadowLane.from_paths(flags.shadow_model, load_model, record_shadow_result)
+        shadow.start()
+        shadow_queue_gauge.set_function(shadow.queue.qsize)
+        shadow_dropped_total.set_function(lambda: shadow.dropped)
+        logger.info(f"Shadow models: {', '.join(shadow.candidates)}")
+
+    prefetcher = Prefetcher(cache, on_load=promotion_histogram.observe)
+    prefetcher.start()
+    prefetch_hit_rate_gauge.set_function(lambda: cache.prefetch_hit_rate)
+    prefetch_dropped_total.set_function(lambda: prefetcher.dropped)
+
+    hot_gauge.set_function(lambda: len(cache))
+    cold_gauge.set_function(lambda: max(0, db.count_patients() - len(cache)))
+    demoted_total.set_function(lambda: cache.demoted)
+    model_swaps_total.set_function(lambda: registry.swaps)
+    model_rejections_total.set_function(lambda: registry.rejections)
+    cascade_short_circuited_total.set_function(lambda: registry.predictor.short_circuited)
+    cascade_model_calls_total.set_function(lambda: registry.predictor.model_calls)
+    cascade_fraction_gauge.set_function(lambda: registry.predictor.short_circuit_fraction)
+    cascade_latency_saved_gauge.set_function(lambda: registry.predictor.latency_saved_seconds)
+    pages_delivered_total.set_function(lambda: alerts.delivered)
+    pages_suppressed_total.set_function(lambda: alerts.suppressed)
+    pages_coalesced_total.set_function(lambda: alerts.coalesced)
+    pages_pending_gauge.set_function(lambda: len(alerts.pending))
+
+    def parse_stage(item, emit):
+        generation, frame = item
         try:
-            messages, buffer = simulator.parse_mllp_messages(buffer, "")
-        except Exception as e:
-            logger.warning(f"Couldn't parse buffer: {buffer} due to exception: {e}")
-            messages = []
-
-        for message in messages:
-            messages_counter.inc()  # increment counter
-            msg, fields, status = msg_parser.parse(message.decode("utf-8"))
-            if status == "error":
-                logger.warning(f"Couldn't parse message: {message}")
-                continue
-
-            mrn = fields["mrn"]
-
+            message = str(frame, "utf-8", "replace")  # the only copy of the message's bytes
+        finally:
+            conn.receiver.release()
+        messages_counter.inc()  # increment counter
+        msg, fields, status = msg_parser.parse(message)
+        if status == "error":
+            logger.warning(f"Couldn't parse message: {message}")
+        emit((generation, msg, fields))
+
+    def persist_stage(item, emit):
+        """Stores a message, queues its new results for scoring, then acknowledges it.
+
+        Results are queued before the ACK, so a full score queue holds the ACK, and with it the
+        sender, back. If storing fails the message is not acknowledged and will be resent.
+        """
+        generation, msg, fields = item
+        if msg is not None:
+            mrn = fields.mrn
             if msg == "PAS_admit":
-                db.write_pas_data(**fields)
+                cache.write_pas_data(mrn, fields.dob, fields.sex)
+                prefetcher.submit(mrn)  # results usually follow an admission
+            elif msg == "PAS_discharge":
+                cache.demote(mrn)
             elif msg == "LIMS":
                 lims_counter.inc()
-                for obs in fields["results"]:
-                    db.write_lims_data(mrn, **obs)
+                # Results resent after a reconnect are neither stored nor scored (and so never paged) twice.
+                keys = [DedupIndex.key(result) for result in fields.results]
+                new_results = [result for key, result in zip(keys, fields.results) if not dedup.seen(key)]
+                if new_results:
+                    new_results = cache.write_lims_results(mrn, new_results)
+                for key in keys:
+                    dedup.add(key)
+                if len(new_results) < len(keys):
+                    duplicate_counter.inc(len(keys) - len(new_results))
+                    logger.info(f"Dropped {len(keys) - len(new_results)} duplicate results for MRN: {mrn}")
+                for result in new_results:
+                    emit(result)
 
             logger.info(f"{msg} message parsed successfully for MRN: {mrn}")
             logger.debug(f"Parsed fields: {fields}")
 
-            if msg == "LIMS":
-                for obs in fields["results"]:
-                    timestamp = obs["date"]
-                    data = db.fetch_data(mrn, timestamp)
-                    if data is None:
-                        logger.warning("Couldn't find PAS data. Added to LIMS queue")
-                        lims_queue.append((mrn, timestamp))
-                        continue
+        if conn.send_ack(generation, create_acknowledgement("AA")):
+            logger.info("Acknowledgement sent")
+
+    def score_stage(result, emit):
+        registry.activate_pending()  # models only change between results
+        mrn, timestamp = result.mrn, result.date
+        if timestamp is None:
+            logger.warning(f"Result without a date for MRN: {mrn} stored but not scored")
+            return
+        data = cache.fetch_data(mrn, timestamp)
+        if data is None:
+            logger.warning("Couldn't find PAS data. Added to LIMS queue")
+            queue_for_pas_data(result)
+            return
+
+        predictor = registry.predictor
+        y_pred, test_date = predictor.predict(data, count=True)
+        registry.record(data)
+        if shadow is not None:
+            shadow.submit(data, predictor, y_pred)
+        logger.info(f"Prediction: {y_pred}, made for MRN: {mrn}, timestamp: {timestamp}")
+
+        if y_pred == 1:
+            pos_counter.inc()
+            if not alerts.raise_alert(mrn, test_date):
+                logger.info(f"Page for MRN: {mrn} suppressed, AKI already paged")
+
+    pipeline = Pipeline([("parse", parse_stage), ("persist", persist_stage), ("score", score_stage)])
+    for name in pipeline.names:
+        stage_depth_gauge.labels(name).set_function(partial(pipeline.depth, name))
+        stage_blocked_total.set_function(partial(pipeline.blocked_seconds.get, name), [name])
+    lims_queue_gauge.set_function(lambda: len(lims_queue))
+    threads = pipeline.start()
+    db.pool.claim_writer(threads[pipeline.names.index("persist")])
+    signal.signal(signal.SIGTERM, graceful_shutdown)
 
-                    y_pred, test_date = predictor.predict(data)
-                    logger.info(f"Prediction: {y_pred}, made for MRN: {mrn}, timestamp: {timestamp}")
-
-                    if y_pred == 1:
-                        pos_counter.inc()
-                        pager_data = f"{mrn},{test_date.strftime('%Y%m%d%H%M%S')}".encode("utf-8")
-                        try:
-                            urllib.request.urlopen(f"http://{PAGER_HOST}:{PAGER_PORT}/page", timeout=1, data=pager_data)
-                            logger.info(f"Pager request sent successfully for MRN: {mrn}")
-                        except Exception as e:
-                            logger.warning(f"Pager request failed: {e}. Added to pager queue")
-                            pager_queue.append(pager_data)
-
-        ack = create_acknowledgement("AA")
-        while True:
-            try:
-                s.sendall(ack)
-                logger.info("Acknowledgement sent")
-                break
-            except Exception as e:
-                logger.warning(f"MLLP connection failed: {e}. Reconnecting")
-                s.close()
-                s = connect_to_mllp_server(MLLP_HOST, MLLP_PORT, logger)
+    monitor = MemoryMonitor(
+        {
+            "patient_cache.patients": lambda: cache.patients,
+            "patient_cache.series": lambda: cache.series,
+            "patient_cache.summaries": lambda: cache.summaries,
+            "dedup_index": lambda: dedup.keys,
+            "lims_queue": lambda: lims_queue.results,
+            "pages_pending": lambda: alerts.pending,
+            "pipeline_queues": lambda: [stage_queue.queue for stage_queue in pipeline.queues],
+        },
+        lambda fraction: cache.evict(max(1, int(len(cache.patients) * fraction))),
+        budget_bytes=int(flags.memory_budget_mb * 2 ** 20) or None,
+    )
+    for name in monitor.structures:
+        structure_bytes_gauge.labels(name).set_function(partial(monitor.estimated_size, name))
+    memory_budget_gauge.set(monitor.budget_bytes or 0)
+    memory_evicted_total.set_function(lambda: cache.evicted)
+    monitor.start()
+    routes["/debug/memory"] = partial(debug_memory, monitor, AllocationTracker())
+    routes["/debug/profile"] = partial(debug_profile, StackSampler())
+
+    receiver = conn.receiver
+    mllp_recv_calls_total.set_function(lambda: receiver.recv_calls)
+    mllp_bytes_received_total.set_function(lambda: receiver.bytes_received)
+    mllp_bytes_copied_total.set_function(lambda: receiver.bytes_copied)
+    mllp_messages_total.set_function(lambda: receiver.messages)
+    mllp_buffer_gauge.set_function(lambda: receiver.size)
+
+    # Receive stage: frames messages and hands them to the pipeline. While the parse stage is full
+    # nothing more is read, so the socket's receive window fills up and the sender waits.
+    while True:
+        generation = conn.generation
+        try:
+            generation, frames = conn.recv()
+        except Exception as e:
+            conn.reconnect(generation, f"MLLP connection failed: {e}")
+            continue
+
+        for frame in frames:
+            pipeline.put((generation, frame))
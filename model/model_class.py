@@ -1,31 +1,175 @@
+import json
+import time
 import pickle
+import logging
+import threading
 import numpy as np
-from datetime import datetime
+
+
+SECONDS_PER_DAY = 86400
+FEATURE_NAMES = ["age", "sex", "latest", "rv1", "rv2"]
+RV1, RV2 = 3, 4
+NHS_RATIO_THRESHOLD = 1.5  # the NHS AKI algorithm flags stage 1 from this creatinine ratio up
+MARGIN_SAFETY = 1e-3  # the booster sums leaves in float32; a certified bound must clear 0 by this much
+
+
+def _tree_max(node, upper):
+    """Largest leaf of a dumped tree reachable by rows whose features are below upper (name -> bound)."""
+    if "leaf" in node:
+        return node["leaf"]
+    children = {child["nodeid"]: child for child in node["children"]}
+    best = _tree_max(children[node["yes"]], upper)  # "x < split" or missing; always reachable from below
+    bound = upper.get(node["split"])
+    # The booster compares float32 values: x < bound only guarantees float32(x) <= float32(bound).
+    if bound is None or np.float32(node["split_condition"]) <= np.float32(bound):
+        best = max(best, _tree_max(children[node["no"]], upper))
+    if node["missing"] not in (node["yes"], node["no"]):
+        best = max(best, _tree_max(children[node["missing"]], upper))
+    return best
+
+
+def _dump(model):
+    """(feature names as the booster calls them, base log-odds, trees as dicts) of an XGBoost model."""
+    booster = model.get_booster()
+    names = booster.feature_names or [f"f{i}" for i in range(len(FEATURE_NAMES))]
+    base_score = float(json.loads(booster.save_config())["learner"]["learner_model_param"]["base_score"])
+    trees = [json.loads(tree) for tree in booster.get_dump(dump_format="json")]
+    return names, np.log(base_score / (1 - base_score)), trees
+
+
+def margin_upper_bound(model, upper, dump=None):
+    """Upper bound of the model's log-odds over every row whose features are below upper.
+
+    upper maps feature names to strict upper bounds; other features may take any value.
+    Exact for each tree, so the sum only overestimates when the trees' worst cases differ.
+    """
+    names, base_margin, trees = dump or _dump(model)
+    upper = {names[FEATURE_NAMES.index(name)]: bound for name, bound in upper.items()}
+    return base_margin + sum(_tree_max(tree, upper) for tree in trees)
+
+
+def certified_ratio_thresholds(model, ceiling=NHS_RATIO_THRESHOLD):
+    """Largest (rv1, rv2) bounds, at most ceiling, below which the model provably predicts no AKI.
+
+    Only the model's own split points on rv1 and rv2 can change the bound, so they are the
+    candidates. The largest bound shared by both ratios is found first, then each is raised on
+    its own as far as it stays certified. Returns None if no bound can be certified.
+    """
+    dump = names, _, trees = _dump(model)
+    splits = set()
+    stack = list(trees)
+    while stack:
+        node = stack.pop()
+        if "leaf" not in node:
+            if node["split"] in (names[RV1], names[RV2]):
+                splits.add(float(np.float32(node["split_condition"])))
+            stack.extend(node["children"])
+    candidates = sorted({c for c in splits if c < ceiling} | {ceiling})
+
+    def certified(rv1, rv2):
+        return margin_upper_bound(model, {"rv1": rv1, "rv2": rv2}, dump) < -MARGIN_SAFETY
+
+    # Each bound only gets less safe as it grows, so the first failing candidate ends each search.
+    shared = None
+    for c in candidates:
+        if not certified(c, c):
+            break
+        shared = c
+    if shared is None:
+        return None
+    rv1 = rv2 = shared
+    for c in candidates:
+        if c > rv1:
+            if not certified(c, rv2):
+                break
+            rv1 = c
+    for c in candidates:
+        if c > rv2:
+            if not certified(rv1, c):
+                break
+            rv2 = c
+    return rv1, rv2
 
 
 class AKIPredictor:
-    def __init__(self, model_path="xgb_model.pkl"):
+    def __init__(self, model_path="xgb_model.pkl", cascade=False):
         with open(model_path, "rb") as f:
             self.model = pickle.load(f)
 
+        # With cascade, results whose rv1 and rv2 are both below certified thresholds are
+        # settled as negatives without running the model. The thresholds are derived from the
+        # model's trees (see certified_ratio_thresholds), so predictions are unchanged.
+        self.thresholds = None
+        if cascade:
+            try:
+                self.thresholds = certified_ratio_thresholds(self.model)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Cascade disabled for {model_path}: {e}")
+            if self.thresholds is None:
+                logging.getLogger(__name__).warning(f"No ratio thresholds certified for {model_path}")
+        # Cascade statistics of scored results only; validation and shadow predictions are not counted.
+        self.counts_lock = threading.Lock()
+        self.short_circuited = 0
+        self.model_calls = 0
+        self.model_seconds = 0.0
+
     def preprocess_and_transform(self, input_dict):
-        dob = datetime.fromisoformat(input_dict["dob"])
+        dob = input_dict["dob"]  # dates are integer epoch seconds
 
         dates = input_dict["dates"]
-        latest_date = datetime.fromisoformat(dates[-1])
-        age = (latest_date - dob).days // 365
+        latest_date = dates[-1]
+        age = (latest_date - dob) // SECONDS_PER_DAY // 365
 
         sex = input_dict["sex"]
         creatinine_levels = input_dict["creatinine_levels"]
 
         latest_creatinine = creatinine_levels[-1]
-        rv1 = latest_creatinine / np.min(creatinine_levels)
-        rv2 = latest_creatinine / np.median(creatinine_levels)
+        summary = input_dict.get("summary")  # results compacted out of the retention window
+        if summary is None:
+            rv1 = latest_creatinine / np.min(creatinine_levels)
+            rv2 = latest_creatinine / np.median(creatinine_levels)
+        else:
+            rv1 = latest_creatinine / min(summary.min, np.min(creatinine_levels))
+            rv2 = latest_creatinine / summary.median(creatinine_levels)
 
         new_data = np.asarray([age, sex, latest_creatinine, rv1, rv2])
         return new_data, latest_date
 
-    def predict(self, data):
+    def settled_negative(self, x):
+        """Boolean mask of the feature rows (2-d, FEATURE_NAMES order) the cascade settles as negatives."""
+        if self.thresholds is None:
+            return np.zeros(len(x), dtype=bool)
+        return (x[:, RV1] < self.thresholds[0]) & (x[:, RV2] < self.thresholds[1])  # NaN ratios go to the model
+
+    def record_scored(self, short_circuited, model_calls, model_seconds):
+        """Adds scored results to the cascade statistics."""
+        with self.counts_lock:
+            self.short_circuited += short_circuited
+            self.model_calls += model_calls
+            self.model_seconds += model_seconds
+
+    @property
+    def short_circuit_fraction(self):
+        scored = self.short_circuited + self.model_calls
+        return self.short_circuited / scored if scored else 0.0
+
+    @property
+    def latency_saved_seconds(self):
+        """Model time not spent thanks to the cascade, estimated from the mean time of a model call."""
+        if self.model_calls == 0:
+            return 0.0
+        return self.short_circuited * self.model_seconds / self.model_calls
+
+    def predict(self, data, count=False):
+        """(prediction, latest date) for a fetch_data dict. count=True adds it to the cascade statistics."""
         processed_data, latest_date = self.preprocess_and_transform(data)
+        if self.thresholds is not None and processed_data[RV1] < self.thresholds[0] \
+                and processed_data[RV2] < self.thresholds[1]:
+            if count:
+                self.record_scored(1, 0, 0.0)
+            return 0, latest_date
+        start = time.perf_counter()
         y_pred = self.model.predict(processed_data[None, :])[0]
+        if count:
+            self.record_scored(0, 1, time.perf_counter() - start)
         return y_pred, latest_date
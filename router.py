@@ -0,0 +1,115 @@
+import os
+import time
+import socket
+import logging
+import argparse
+from functools import partial
+
+from sharding import HashRing, Journal, ShardLink, Router, SHARD_WINDOW, ACK_TIMEOUT_SECONDS
+from mllp import MLLPReceiver
+from replay import message_mrn
+from debug_server import start_debug_server
+from acknowledgements import create_acknowledgement
+from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
+
+
+routed_gauge = Gauge('router_messages_routed', 'Messages journaled and queued for each shard', ['shard'])
+forwarded_gauge = Gauge('router_messages_forwarded', 'Messages sent to each shard, including resends', ['shard'])
+acknowledged_gauge = Gauge('router_messages_acknowledged', 'Messages acknowledged by each shard', ['shard'])
+resent_gauge = Gauge('router_messages_resent', 'Messages sent to a shard again after its connection dropped', ['shard'])
+depth_gauge = Gauge('router_shard_depth', 'Messages routed to each shard and not acknowledged yet', ['shard'])
+connected_gauge = Gauge('router_shard_connected', 'Whether the engine of each shard is connected', ['shard'])
+
+
+METRICS_PORT = 8000
+LISTEN_PORT = 8440
+STATE_DIR = "/state"
+MLLP_RETRY_SECONDS = 1
+
+
+def connect(host, port, logger):
+    while True:
+        try:
+            s = socket.create_connection((host, port))
+            logger.info("Connected to MLLP server")
+            return s
+        except Exception as e:
+            logger.warning(f"MLLP connection failed: {e}. Retrying in {MLLP_RETRY_SECONDS}s")
+            time.sleep(MLLP_RETRY_SECONDS)
+
+
+def listen(host, port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1)
+    return listener
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Splits the MLLP feed by MRN between several main_simulator.py instances, one per shard."
+    )
+    parser.add_argument("--shards", required=True, type=int, help="Number of MRN shards")
+    parser.add_argument("--listen-host", default="127.0.0.1")
+    parser.add_argument("--listen-port", default=LISTEN_PORT, type=int,
+                        help="Shard i's engine connects to this port + i, as if it were the hospital's sender")
+    parser.add_argument("--state", default=STATE_DIR, help="Directory holding the router's journal")
+    parser.add_argument("--metrics-port", default=METRICS_PORT, type=int)
+    parser.add_argument("--window", default=SHARD_WINDOW, type=int,
+                        help="Messages sent to a shard ahead of its ACKs")
+    parser.add_argument("--ack-timeout", default=ACK_TIMEOUT_SECONDS, type=float,
+                        help="Seconds to wait for a shard's ACK before resending")
+    flags = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(os.path.join(flags.state, "router_logs.txt")),
+            logging.StreamHandler()]
+    )
+    logger = logging.getLogger(__name__)
+    start_debug_server(flags.metrics_port, {"/metrics": lambda query: (CONTENT_TYPE_LATEST, generate_latest())})
+
+    MLLP_HOST, MLLP_PORT = os.getenv("MLLP_ADDRESS").split(":")
+    MLLP_PORT = int(MLLP_PORT)
+
+    journal = Journal(os.path.join(flags.state, "router.db"))
+    links = [
+        ShardLink(shard, listen(flags.listen_host, flags.listen_port + shard), journal, MLLPReceiver,
+                  flags.window, flags.ack_timeout)
+        for shard in range(flags.shards)
+    ]
+    router = Router(HashRing(flags.shards), journal, links, message_mrn)
+    restored = router.restore()
+    if restored:
+        logger.info(f"{restored} journaled messages queued again")
+    router.start()
+
+    for shard, link in enumerate(links):
+        routed_gauge.labels(shard).set_function(partial(router.routed.__getitem__, shard))
+        forwarded_gauge.labels(shard).set_function(lambda link=link: link.forwarded)
+        acknowledged_gauge.labels(shard).set_function(lambda link=link: link.acknowledged)
+        resent_gauge.labels(shard).set_function(lambda link=link: link.resent)
+        depth_gauge.labels(shard).set_function(link.depth)
+        connected_gauge.labels(shard).set_function(lambda link=link: link.connected)
+
+    # The sender gets its ACK once the message is journaled, so shards work through their
+    # messages in parallel while the sender goes on to the next one.
+    receiver = MLLPReceiver()
+    sock = connect(MLLP_HOST, MLLP_PORT, logger)
+    while True:
+        try:
+            for frame in receiver.receive(sock):
+                try:
+                    message = bytes(frame)
+                finally:
+                    receiver.release()
+                router.route(message)
+                sock.sendall(create_acknowledgement("AA"))
+        except Exception as e:
+            logger.warning(f"MLLP connection failed: {e}. Reconnecting")
+            sock.close()
+            receiver = MLLPReceiver()  # drops a partial message and any frame still held
+            sock = connect(MLLP_HOST, MLLP_PORT, logger)
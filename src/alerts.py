@@ -0,0 +1,101 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+
+SUPPRESSION_HOURS = 48
+DELIVERY_RETRY_SECONDS = 1
+
+
+class AlertManager:
+    """Turns positive predictions into pages, one per clinical event rather than per test.
+
+    A positive result for a patient whose previous positive result is less than the
+    suppression window away (in test time, so replays behave) continues the same event and is
+    suppressed. A new event for a patient whose earlier page is still undelivered is coalesced
+    into it. Pages are delivered in order by a background thread, retrying while the pager is
+    unreachable, so raise_alert never blocks on HTTP.
+    """
+
+    def __init__(self, send, window_hours=SUPPRESSION_HOURS, retry_seconds=DELIVERY_RETRY_SECONDS):
+        self.send = send  # pager_data bytes -> None, raises on failure
+        self.window = window_hours * 3600  # seconds, test dates are epoch seconds
+        self.retry_seconds = retry_seconds
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = OrderedDict()  # mrn -> pager_data, oldest first
+        self.last_positive = {}  # mrn -> test date of the latest positive result
+        self.delivered = 0
+        self.suppressed = 0
+        self.coalesced = 0
+        self.logger = logging.getLogger(__name__)
+
+    def raise_alert(self, mrn, test_date):
+        """Records a positive result. Returns True if it starts a new event."""
+        mrn = int(mrn)
+        with self.lock:
+            last = self.last_positive.get(mrn)
+            self.last_positive[mrn] = test_date if last is None else max(last, test_date)
+            if last is not None and abs(test_date - last) < self.window:
+                self.suppressed += 1
+                return False
+            if mrn in self.pending:
+                self.coalesced += 1  # the undelivered page already covers this patient
+                return True
+            self.pending[mrn] = f"{mrn},{time.strftime('%Y%m%d%H%M%S', time.gmtime(test_date))}".encode("utf-8")
+        self.wakeup.set()
+        return True
+
+    def enqueue(self, pager_data):
+        """Queues an already formatted page, e.g. one saved by an earlier version."""
+        mrn = int(pager_data.split(b",")[0])
+        with self.lock:
+            self.pending.setdefault(mrn, pager_data)
+        self.wakeup.set()
+
+    def deliver_pending(self):
+        """Sends queued pages in order until one fails. Returns the number delivered."""
+        delivered = 0
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return delivered
+                mrn, pager_data = next(iter(self.pending.items()))
+            try:
+                self.send(pager_data)
+            except Exception as e:
+                self.logger.warning(f"Pager request failed for {pager_data.decode('utf-8')}: {e}")
+                return delivered
+            with self.lock:
+                if self.pending.get(mrn) == pager_data:
+                    del self.pending[mrn]
+                self.delivered += 1
+            delivered += 1
+            self.logger.info(f"Pager request sent successfully for {pager_data.decode('utf-8')}")
+
+    def state(self):
+        with self.lock:
+            return {"pending": list(self.pending.values()), "last_positive": dict(self.last_positive)}
+
+    def restore(self, state):
+        with self.lock:
+            self.last_positive.update(state["last_positive"])
+        for pager_data in state["pending"]:
+            self.enqueue(pager_data)
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.deliver_pending()
+            with self.lock:
+                failed = bool(self.pending)
+            if failed:
+                time.sleep(self.retry_seconds)
+                self.wakeup.set()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
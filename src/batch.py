@@ -0,0 +1,135 @@
+import time
+import numpy as np
+import pandas as pd
+
+
+NO_EARLIER_RESULT = np.iinfo(np.int64).min
+FEATURES = ["age", "sex", "latest", "rv1", "rv2"]
+
+
+def parse_messages(messages, parser):
+    """Parses a whole replay into an admissions frame and a results frame.
+
+    seq is the position of the message in the feed, so both frames can be joined in arrival order.
+    Dates are epoch seconds; results without one are left out, as the streaming path never scores
+    or reads them.
+    """
+    admits, results = [], []
+    for seq, message in enumerate(messages):
+        msg, fields, _ = parser.parse(message.decode("utf-8"))
+        if msg == "PAS_admit":
+            admits.append((seq, fields.mrn, fields.dob, fields.sex))
+        elif msg == "LIMS":
+            results.extend((seq, r.mrn, r.date, r.value) for r in fields.results if r.date is not None)
+
+    admits = pd.DataFrame(admits, columns=["seq", "mrn", "dob", "sex"]).astype(
+        {"seq": np.int64, "mrn": np.int64, "dob": np.int64}
+    )
+    results = pd.DataFrame(results, columns=["seq", "mrn", "timestamp", "value"]).astype(
+        {"seq": np.int64, "mrn": np.int64, "timestamp": np.int64, "value": np.float64}
+    )
+    return admits, results
+
+
+def read_history(history_csv_path):
+    """Reads history.csv into a results frame, placed before the first message of the feed."""
+    hist = pd.read_csv(history_csv_path, dtype=str)
+    dates = hist.iloc[:, 1::2].to_numpy().ravel()
+    values = hist.iloc[:, 2::2].to_numpy().ravel()
+    mrns = np.repeat(hist["mrn"].astype(np.int64).to_numpy(), hist.shape[1] // 2)
+    present = ~pd.isnull(dates)
+    return pd.DataFrame({
+        "seq": -1,
+        "mrn": mrns[present],
+        "timestamp": pd.to_datetime(dates[present]).to_numpy(dtype="datetime64[s]").astype(np.int64),
+        "value": values[present].astype(np.float32).astype(np.float64),  # as Database.populate_history stores them
+    })
+
+
+def _exact_features(rows, i):
+    """Features for one result whose window is not a prefix of its patient's arrival order."""
+    mrn, seq, ts = rows["mrn"][i], rows["seq"][i], rows["timestamp"][i]
+    visible = (rows["mrn"] == mrn) & (rows["seq"] <= seq) & (rows["timestamp"] <= ts)
+    levels = rows["value"][visible]
+    order = np.argsort(rows["timestamp"][visible], kind="stable")
+    return levels[order][-1], np.min(levels), np.median(levels)
+
+
+def point_in_time_features(admits, results, history=None):
+    """Computes the model features for every result as the streaming path would see them.
+
+    The streaming path writes a message's results and then, for each one, fetches the patient's
+    results up to its timestamp. When a result is not older than anything that arrived before it,
+    that window is a prefix of the patient's results in arrival order, so the minimum and median
+    come from a grouped cumulative min and expanding median. The few results that arrive out of
+    order are computed one by one. Results with the same timestamp are ordered by arrival, as
+    Database and PatientCache order them.
+
+    Returns one row per scorable result (admitted patient, not a repeat of an earlier result),
+    in feed order.
+    """
+    rows = pd.concat([history, results], ignore_index=True) if history is not None else results.copy()
+    rows = rows.sort_values("seq", kind="stable")
+    rows = rows.drop_duplicates(["mrn", "timestamp", "value"]).reset_index(drop=True)  # as the UNIQUE index does
+    rows["arrival"] = np.arange(len(rows))
+    rows = rows.sort_values(["mrn", "arrival"], kind="stable").reset_index(drop=True)
+
+    by_patient = rows.groupby("mrn", sort=False)
+    rows["cummin"] = by_patient["value"].cummin()
+    rows["median"] = by_patient["value"].expanding().median().reset_index(level=0, drop=True)
+
+    newest_before = by_patient["timestamp"].cummax().groupby(rows["mrn"], sort=False).shift()
+    reverse = rows.iloc[::-1]
+    rest_of_message = reverse.groupby(["mrn", "seq"], sort=False)["timestamp"].cummin()
+    rest_of_message = rest_of_message.groupby([reverse["mrn"], reverse["seq"]], sort=False).shift()
+    in_order = (
+        (newest_before.fillna(NO_EARLIER_RESULT).to_numpy() <= rows["timestamp"].to_numpy())
+        & (rest_of_message.reindex(rows.index).fillna(np.inf).to_numpy() > rows["timestamp"].to_numpy())
+    )
+
+    rows["latest"] = rows["value"]
+    scored = rows["seq"] >= 0
+    columns = {name: rows[name].to_numpy() for name in ("mrn", "seq", "timestamp", "value")}
+    for i in np.flatnonzero(scored & ~in_order):
+        rows.loc[i, ["latest", "cummin", "median"]] = _exact_features(columns, i)
+
+    rows = pd.merge_asof(
+        rows[scored].sort_values("seq", kind="stable"), admits.sort_values("seq"), on="seq", by="mrn", direction="backward", allow_exact_matches=False
+    )
+    rows = rows[rows["dob"].notna()].sort_values("arrival").reset_index(drop=True)
+
+    days = (rows["timestamp"].to_numpy() - rows["dob"].to_numpy(dtype=np.int64)) // 86400
+    rows["age"] = days // 365
+    rows["rv1"] = rows["latest"] / rows["cummin"]
+    rows["rv2"] = rows["latest"] / rows["median"]
+    return rows[["seq", "mrn", "timestamp"] + FEATURES]
+
+
+def score(features, predictor):
+    """Scores every row of point_in_time_features in a single model call.
+
+    Rows the predictor's cascade settles as negatives are left out of the call.
+    """
+    features = features.copy()
+    x = features[FEATURES].to_numpy(dtype=np.float64)
+    prediction = np.zeros(len(x), dtype=int)
+    uncertain = ~predictor.settled_negative(x)
+    seconds = 0.0
+    if uncertain.any():
+        start = time.perf_counter()
+        prediction[uncertain] = predictor.model.predict(x[uncertain])
+        seconds = time.perf_counter() - start
+    predictor.record_scored(int(len(x) - uncertain.sum()), int(uncertain.sum()), seconds)
+    features["prediction"] = prediction
+    return features
+
+
+def f_score(predicted, expected, beta=3):
+    """F-beta of predicted against expected (mrn, date) pairs. Recall is weighted beta times as much."""
+    predicted, expected = set(predicted), set(expected)
+    true_positives = len(predicted & expected)
+    if true_positives == 0:
+        return 0.0
+    precision = true_positives / len(predicted)
+    recall = true_positives / len(expected)
+    return (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
@@ -1,103 +1,487 @@
 import os
+import csv
+import json
+import math
+import queue
 import sqlite3
+import threading
 import numpy as np
-import pandas as pd
-from datetime import datetime
+from itertools import islice
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
+
+SCHEMA_VERSION = 4
+READER_POOL_SIZE = 4
+SKETCH_RELATIVE_ACCURACY = 0.005
+HISTORY_CHUNK_SIZE = 10000
+EPOCH = datetime(1970, 1, 1)
+
+
+def timestamp_to_epoch(text):
+    """Converts an ISO timestamp ("2024-01-20 22:43:00") to integer epoch seconds."""
+    return int((datetime.fromisoformat(text) - EPOCH).total_seconds())
+
+
+def epoch_to_timestamp(epoch, fmt="%Y-%m-%d %H:%M:%S"):
+    """Formats integer epoch seconds, for output and pages only; everything stored is an int."""
+    return (EPOCH + timedelta(seconds=int(epoch))).strftime(fmt)
+
+
+def iter_history(history_csv_path):
+    """Yields (mrn, epoch seconds, creatinine_level) for every result in history.csv, one row at a time.
+
+    Each row is an MRN followed by date/result pairs, with blanks after the patient's last
+    result. Levels are rounded to float32 as they always have been, so reloading the history
+    stores the same values.
+    """
+    with open(history_csv_path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)  # header
+        for row in reader:
+            mrn = int(row[0])
+            for date, level in zip(row[1::2], row[2::2]):
+                if date and level:
+                    yield mrn, timestamp_to_epoch(date), float(np.float32(level))
+
+
+class MedianSketch:
+    """Count, exact minimum and a log-bucketed histogram of compacted creatinine results.
+
+    Bucket boundaries grow geometrically, so every value read back from the histogram is
+    within SKETCH_RELATIVE_ACCURACY of the result it stands for. compacted_until is the
+    timestamp before which all of a patient's results live in the sketch.
+    """
+
+    GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+
+    def __init__(self, count=0, minimum=None, buckets=None, compacted_until=None):
+        self.count = count
+        self.min = minimum
+        self.buckets = buckets or {}
+        self.compacted_until = compacted_until
+
+    @classmethod
+    def from_row(cls, count, minimum, buckets, compacted_until):
+        buckets = {int(index): n for index, n in json.loads(buckets).items()}
+        return cls(count, minimum, buckets, compacted_until)
+
+    def to_row(self):
+        return self.count, self.min, json.dumps(self.buckets), self.compacted_until
+
+    def add(self, value):
+        index = math.ceil(math.log(max(value, 1e-9), self.GAMMA))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+
+    def median(self, values=()):
+        """Median of the sketched results together with the exact values given."""
+        points = sorted(
+            [(2 * self.GAMMA ** index / (self.GAMMA + 1), n) for index, n in self.buckets.items()]
+            + [(value, 1) for value in values]
+        )
+        total = sum(n for _, n in points)
+        lower, upper = (total - 1) // 2, total // 2
+        seen, low_value = 0, None
+        for value, n in points:
+            if low_value is None and seen + n > lower:
+                low_value = value
+            if seen + n > upper:
+                return (low_value + value) / 2
+            seen += n
+        return np.nan
+
+    def __eq__(self, other):
+        return isinstance(other, MedianSketch) and self.to_row() == other.to_row()
+
+
+class ConnectionPool:
+    """One writer connection plus a pool of read-only WAL connections to the same SQLite file.
+
+    Once claim_writer() is called only the claiming threads may write, one at a time. Readers are checked out by one
+    thread at a time, so cursors are never shared. In-memory databases have no readers and
+    read through the writer instead.
+    """
+
+    def __init__(self, db_name, readers=READER_POOL_SIZE):
+        self.db_name = db_name
+        self.writer = sqlite3.connect(db_name, check_same_thread=False)
+        self.write_lock = threading.RLock()
+        self.owners = set()
+
+        if db_name == ":memory:":
+            readers = 0
+        else:
+            self.writer.execute("PRAGMA journal_mode=WAL")
+        self.max_readers = readers
+        self.opened_readers = 0
+        self.readers = queue.LifoQueue()
+        self.readers_lock = threading.Lock()
+
+    def claim_writer(self, thread=None):
+        """Adds thread (by default the calling thread) to the threads allowed to write."""
+        self.owners.add(threading.get_ident() if thread is None else thread.ident)
+
+    @contextmanager
+    def write(self):
+        if self.owners and threading.get_ident() not in self.owners:
+            raise RuntimeError("Writer connection is owned by another thread")
+        with self.write_lock:
+            yield self.writer
+
+    @contextmanager
+    def read(self):
+        if self.max_readers == 0:
+            with self.write_lock:
+                yield self.writer
+            return
+
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    def _checkout(self):
+        try:
+            return self.readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self.readers_lock:
+            if self.opened_readers < self.max_readers:
+                self.opened_readers += 1
+                return sqlite3.connect(f"file:{self.db_name}?mode=ro", uri=True, check_same_thread=False)
+        return self.readers.get()
+
+    def close(self):
+        self.writer.close()
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
 
 
 class Database:
-    def __init__(self, pat_db_name="patients.db", tests_db_name="blood_tests.db"):
-        self.db_exists = os.path.exists(pat_db_name)
+    """Patients and blood test results in a single SQLite file, see ConnectionPool."""
 
-        self.pat_db = sqlite3.connect(pat_db_name, check_same_thread=False)
-        self.pat_cur = self.pat_db.cursor()
+    def __init__(self, db_name="aki.db", readers=READER_POOL_SIZE):
+        self.db_exists = os.path.exists(db_name) and db_name != ":memory:"
 
-        self.tests_db = sqlite3.connect(tests_db_name, check_same_thread=False)
-        self.tests_cur = self.tests_db.cursor()
+        self.pool = ConnectionPool(db_name, readers)
+        self.in_transaction = False
 
         if not self.db_exists:
-            self.pat_cur.execute("CREATE TABLE patients(mrn, dob, sex)")
-            self.tests_cur.execute("CREATE TABLE blood_tests(mrn, timestamp, creatinine_level)")
+            with self.pool.write() as conn:
+                conn.execute("CREATE TABLE patients(mrn, dob, sex)")
+                conn.execute("CREATE TABLE blood_tests(mrn, timestamp, creatinine_level)")
+                conn.execute("CREATE INDEX patients_mrn ON patients(mrn)")
+                conn.execute("CREATE INDEX blood_tests_mrn_timestamp ON blood_tests(mrn, timestamp)")
+                conn.execute("PRAGMA user_version = 1")
+                conn.commit()
+        self.removed_duplicates = self.migrate()
 
-    def populate_history(self, history_csv_path):
+    def migrate(self):
+        """Brings the schema up to SCHEMA_VERSION. Returns the number of duplicate results removed."""
+        removed = 0
+        with self.pool.write() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS blood_test_summaries(
+                        mrn PRIMARY KEY, count, min, sketch, compacted_until)
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS blood_tests_timestamp ON blood_tests(timestamp)")
+            if version < 3:
+                # Results resent after an MLLP reconnect were stored again before this version.
+                removed = conn.execute("""
+                    DELETE FROM blood_tests WHERE rowid NOT IN (
+                        SELECT MIN(rowid) FROM blood_tests GROUP BY mrn, timestamp, creatinine_level)
+                """).rowcount
+                conn.execute("DROP INDEX IF EXISTS blood_tests_mrn_timestamp")
+                conn.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS blood_tests_unique
+                    ON blood_tests(mrn, timestamp, creatinine_level)
+                """)
+            if version < 4:
+                # Timestamps were "YYYY-MM-DD HH:MM:SS" text before this version, blank if unknown.
+                # A text result that converts onto a stored epoch result is a duplicate.
+                conn.execute("""
+                    UPDATE OR IGNORE blood_tests
+                    SET timestamp=CAST(strftime('%s', timestamp) AS INTEGER)
+                    WHERE typeof(timestamp)='text'
+                """)
+                removed += conn.execute("DELETE FROM blood_tests WHERE typeof(timestamp)='text'").rowcount
+                conn.execute("""
+                    UPDATE patients SET dob=CAST(strftime('%s', dob) AS INTEGER)
+                    WHERE typeof(dob)='text'
+                """)
+                conn.execute("""
+                    UPDATE blood_test_summaries
+                    SET compacted_until=CAST(strftime('%s', compacted_until) AS INTEGER)
+                    WHERE typeof(compacted_until)='text'
+                """)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        return removed
+
+    def migrate_legacy(self, pat_db_name, tests_db_name):
+        """Copies rows from the old split patients.db / blood_tests.db files into this store."""
+        with self.pool.write() as conn:
+            conn.execute("ATTACH DATABASE ? AS legacy_patients", (pat_db_name,))
+            conn.execute("ATTACH DATABASE ? AS legacy_tests", (tests_db_name,))
+            try:
+                # The split files hold "YYYY-MM-DD HH:MM:SS" text dates (a blank becomes NULL).
+                conn.execute(
+                    "INSERT INTO patients SELECT mrn, CAST(strftime('%s', dob) AS INTEGER), sex "
+                    "FROM legacy_patients.patients ORDER BY rowid"
+                )
+                conn.execute(
+                    "INSERT OR IGNORE INTO blood_tests "
+                    "SELECT mrn, CAST(strftime('%s', timestamp) AS INTEGER), creatinine_level "
+                    "FROM legacy_tests.blood_tests ORDER BY rowid"
+                )
+                conn.commit()
+            finally:
+                conn.execute("DETACH DATABASE legacy_patients")
+                conn.execute("DETACH DATABASE legacy_tests")
+        self.db_exists = True
+
+    @contextmanager
+    def transaction(self):
+        """Groups several writes into a single commit."""
+        with self.pool.write() as conn:
+            self.in_transaction = True
+            try:
+                yield self
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.in_transaction = False
+
+    def populate_history(self, history_csv_path, keep=None):
+        """Loads history.csv into a new database. keep(mrn), if given, selects the patients to load."""
         if self.db_exists:
             return
 
-        hist = pd.read_csv(history_csv_path)
-        hist_rows = []
+        rows = iter_history(history_csv_path)
+        if keep is not None:
+            rows = (row for row in rows if keep(row[0]))
+        self.write_history(rows)
 
-        for _, row in hist.iterrows():
-            row = row[~pd.isnull(row)]
-            mrn = row["mrn"]
-            date_creatinine = row.values[1:].reshape(-1, 2)
-            dates = list(map(datetime.fromisoformat, date_creatinine[:, 0]))
-            creatinine_levels = date_creatinine[:, 1].astype(np.float32)
-            for date, creatinine_level in zip(dates, creatinine_levels):
-                hist_rows.append(f"({mrn}, '{date}', {creatinine_level})")
+    def write_history(self, rows, chunk_size=HISTORY_CHUNK_SIZE):
+        """Bulk-inserts (mrn, timestamp, creatinine_level) rows in one transaction.
 
-        self.tests_cur.execute(f"""
-            INSERT INTO blood_tests VALUES {", ".join(hist_rows)}
-        """)
-        self.tests_db.commit()
+        rows may be any iterable; it is consumed chunk_size rows at a time, so memory use
+        does not grow with its length.
+        """
+        rows = iter(rows)
+        with self.pool.write() as conn:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                conn.executemany("INSERT OR IGNORE INTO blood_tests VALUES (?, ?, ?)", chunk)
+            conn.commit()
 
     def write_pas_data(self, mrn, dob, sex):
-        self.pat_cur.execute(f"""
-            INSERT INTO patients VALUES ({mrn}, '{dob}', {sex})
-        """)
-        self.pat_db.commit()
+        with self.pool.write() as conn:
+            conn.execute("INSERT INTO patients VALUES (?, ?, ?)", (int(mrn), dob, sex))
+            if not self.in_transaction:
+                conn.commit()
 
     def write_lims_data(self, mrn, date, result):
-        self.tests_cur.execute(f"""
-            INSERT INTO blood_tests VALUES ({mrn}, '{date}', {result})
-        """)
-        self.tests_db.commit()
+        """Returns False if the same result is already stored (e.g. resent after a reconnect).
 
-    def read_pas_data(self, mrn):
-        res = self.pat_cur.execute(
-            f"SELECT * FROM patients WHERE mrn={mrn} ORDER BY rowid DESC"
-        )
-        return res.fetchone()
+        A result older than the patient's compacted_until goes straight into their summary,
+        so no raw result is ever stored before it.
+        """
+        mrn = int(mrn)
+        with self.pool.write() as conn:
+            inserted = conn.execute(
+                """
+                INSERT OR IGNORE INTO blood_tests SELECT ?, ?, ? WHERE NOT EXISTS (
+                    SELECT 1 FROM blood_test_summaries WHERE mrn=? AND compacted_until>?)
+                """,
+                (mrn, date, float(result), mrn, date),
+            ).rowcount == 1
+            if not inserted:
+                inserted = self._fold_late_result(conn, mrn, date, float(result))
+            if not self.in_transaction:
+                conn.commit()
+            return inserted
 
-    def read_lims_data(self, mrn, timestamp):
-        res = self.tests_cur.execute(
-            f"SELECT * FROM blood_tests WHERE mrn={mrn} AND timestamp<='{timestamp}' ORDER BY timestamp"
+    def _fold_late_result(self, conn, mrn, date, result):
+        row = conn.execute(
+            "SELECT count, min, sketch, compacted_until FROM blood_test_summaries WHERE mrn=?", (mrn,)
+        ).fetchone()
+        if row is None or date >= row[3]:
+            return False
+        summary = MedianSketch.from_row(*row)
+        summary.add(result)
+        conn.execute(
+            "INSERT OR REPLACE INTO blood_test_summaries VALUES (?, ?, ?, ?, ?)", (mrn, *summary.to_row())
         )
-        return res.fetchall()
+        return True
+
+    def read_pas_data(self, mrn):
+        with self.pool.read() as conn:
+            res = conn.execute(
+                "SELECT * FROM patients WHERE mrn=? ORDER BY rowid DESC LIMIT 1", (int(mrn),)
+            )
+            return res.fetchone()
+
+    def read_lims_data(self, mrn, timestamp=None):
+        with self.pool.read() as conn:
+            if timestamp is None:
+                res = conn.execute(
+                    "SELECT * FROM blood_tests WHERE mrn=? AND timestamp IS NOT NULL ORDER BY timestamp, rowid",
+                    (int(mrn),),
+                )
+                return res.fetchall()
+            res = conn.execute(
+                "SELECT * FROM blood_tests WHERE mrn=? AND timestamp<=? ORDER BY timestamp, rowid",
+                (int(mrn), timestamp),
+            )
+            return res.fetchall()
+
+    def read_summary(self, mrn):
+        with self.pool.read() as conn:
+            row = conn.execute(
+                "SELECT count, min, sketch, compacted_until FROM blood_test_summaries WHERE mrn=?",
+                (int(mrn),),
+            ).fetchone()
+        return None if row is None else MedianSketch.from_row(*row)
+
+    def latest_timestamp(self):
+        with self.pool.read() as conn:
+            return conn.execute("SELECT MAX(timestamp) FROM blood_tests").fetchone()[0]
+
+    def compaction_candidates(self, cutoff, limit):
+        """Returns up to limit MRNs with results older than cutoff that compact_patient would fold."""
+        with self.pool.read() as conn:
+            res = conn.execute(
+                """
+                SELECT DISTINCT b.mrn FROM blood_tests b
+                WHERE b.timestamp<? AND EXISTS (
+                    SELECT 1 FROM blood_tests n WHERE n.mrn=b.mrn AND n.timestamp>b.timestamp)
+                LIMIT ?
+                """,
+                (cutoff, limit),
+            )
+            return [row[0] for row in res.fetchall()]
+
+    def compact_patient(self, mrn, cutoff):
+        """Folds the patient's results older than cutoff into their summary, in one transaction.
+
+        The latest result is always kept raw. Returns the updated summary, or None if there
+        was nothing to compact.
+        """
+        mrn = int(mrn)
+        with self.pool.write() as conn:
+            latest = conn.execute("SELECT MAX(timestamp) FROM blood_tests WHERE mrn=?", (mrn,)).fetchone()[0]
+            if latest is None:
+                return None
+            cutoff = min(cutoff, latest)
+            rows = conn.execute(
+                "SELECT creatinine_level FROM blood_tests WHERE mrn=? AND timestamp<?", (mrn, cutoff)
+            ).fetchall()
+            if not rows:
+                return None
+
+            row = conn.execute(
+                "SELECT count, min, sketch, compacted_until FROM blood_test_summaries WHERE mrn=?", (mrn,)
+            ).fetchone()
+            summary = MedianSketch() if row is None else MedianSketch.from_row(*row)
+            for (creatinine_level,) in rows:
+                summary.add(creatinine_level)
+            summary.compacted_until = max(summary.compacted_until or cutoff, cutoff)
+
+            conn.execute(
+                "INSERT OR REPLACE INTO blood_test_summaries VALUES (?, ?, ?, ?, ?)",
+                (mrn, *summary.to_row()),
+            )
+            conn.execute("DELETE FROM blood_tests WHERE mrn=? AND timestamp<?", (mrn, cutoff))
+            conn.commit()
+        return summary
+
+    def max_rowids(self):
+        """Returns the committed (patients, blood_tests) rowid high-water marks."""
+        with self.pool.read() as conn:
+            res = conn.execute(
+                "SELECT (SELECT MAX(rowid) FROM patients), (SELECT MAX(rowid) FROM blood_tests)"
+            )
+            pat_rowid, tests_rowid = res.fetchone()
+        return pat_rowid or 0, tests_rowid or 0
+
+    def count_patients(self):
+        """Number of distinct patients with PAS data."""
+        with self.pool.read() as conn:
+            return conn.execute("SELECT COUNT(DISTINCT mrn) FROM patients").fetchone()[0]
+
+    def read_pas_since(self, rowid):
+        with self.pool.read() as conn:
+            res = conn.execute(
+                "SELECT mrn, dob, sex FROM patients WHERE rowid>? ORDER BY rowid", (int(rowid),)
+            )
+            return res.fetchall()
+
+    def read_lims_since(self, rowid):
+        with self.pool.read() as conn:
+            res = conn.execute(
+                "SELECT mrn, timestamp, creatinine_level FROM blood_tests WHERE rowid>? ORDER BY rowid",
+                (int(rowid),),
+            )
+            return res.fetchall()
 
     def fetch_data(self, mrn, timestamp):
-        pas_data = self.read_pas_data(mrn)
-        if pas_data is None:
+        # One statement: the latest PAS row joined with the summary of compacted results
+        # and the raw results up to timestamp.
+        with self.pool.read() as conn:
+            rows = conn.execute(
+                """
+                SELECT p.mrn, p.dob, p.sex, b.timestamp, b.creatinine_level,
+                       s.count, s.min, s.sketch, s.compacted_until
+                FROM (SELECT mrn, dob, sex FROM patients WHERE mrn=? ORDER BY rowid DESC LIMIT 1) p
+                LEFT JOIN blood_test_summaries s ON s.mrn=p.mrn
+                LEFT JOIN blood_tests b ON b.mrn=p.mrn AND b.timestamp<=?
+                ORDER BY b.timestamp, b.rowid
+                """,
+                (int(mrn), timestamp),
+            ).fetchall()
+        if not rows:
             return None
 
-        lims_data = self.read_lims_data(mrn, timestamp)
+        lims_data = [row for row in rows if row[3] is not None]
         data = {
-            "mrn": pas_data[0],
-            "dob": pas_data[1],
-            "sex": pas_data[2],
-            "dates": [ld[1] for ld in lims_data],
-            "creatinine_levels": [ld[2] for ld in lims_data],
+            "mrn": rows[0][0],
+            "dob": rows[0][1],
+            "sex": rows[0][2],
+            "dates": [ld[3] for ld in lims_data],
+            "creatinine_levels": [ld[4] for ld in lims_data],
         }
+        if rows[0][5] is not None:
+            data["summary"] = MedianSketch.from_row(*rows[0][5:])
         return data
 
     def close(self):
-        self.pat_db.close()
-        self.tests_db.close()
+        self.pool.close()
 
 
 if __name__ == "__main__":
     pas_messages = [
-        ("149539321", "19860417", 0),
-        ("124674001", "20230416", 1),
-        ("186512977", "20180109", 0),
+        ("149539321", timestamp_to_epoch("1986-04-17"), 0),
+        ("124674001", timestamp_to_epoch("2023-04-16"), 1),
+        ("186512977", timestamp_to_epoch("2018-01-09"), 0),
     ]
     lims_messages = [
-        ("153541819", "20240411055800", 104.50414808079834),
-        ("153541819", "20240411060800", 170.21986290958355),
-        ("124674001", "20240218071300", 109.10220038311532),
-        ("186512977", "20240605111400", 113.48685810736936),
-        ("186512977", "20240605112800", 135.39630713592294),
-        ("186512977", "20240605113500", 158.48822434796762),
-        ("186512977", "20240605113800", 102.66797910333874),
+        ("153541819", timestamp_to_epoch("2024-04-11 05:58:00"), 104.50414808079834),
+        ("153541819", timestamp_to_epoch("2024-04-11 06:08:00"), 170.21986290958355),
+        ("124674001", timestamp_to_epoch("2024-02-18 07:13:00"), 109.10220038311532),
+        ("186512977", timestamp_to_epoch("2024-06-05 11:14:00"), 113.48685810736936),
+        ("186512977", timestamp_to_epoch("2024-06-05 11:28:00"), 135.39630713592294),
+        ("186512977", timestamp_to_epoch("2024-06-05 11:35:00"), 158.48822434796762),
+        ("186512977", timestamp_to_epoch("2024-06-05 11:38:00"), 102.66797910333874),
     ]
     db = Database()
     db.populate_history("history.csv")
@@ -0,0 +1,44 @@
+import logging
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class DebugRequestHandler(BaseHTTPRequestHandler):
+    routes = {}  # path -> handler(query) returning (content_type, body bytes)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            self.send_error(404)
+            return
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            content_type, body = handler(query)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"{url.path} failed: {e}")
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds; request lines would flood the log
+
+
+def start_debug_server(port, routes, host=""):
+    """Serves GET routes, e.g. /metrics next to the /debug endpoints, from a daemon thread.
+
+    routes maps a path to handler(query) -> (content_type, body bytes), query being the last
+    value of each query string parameter. Routes added to the dict later are served too.
+    Returns the server; server.server_port is the port.
+    """
+    handler = type("RoutedRequestHandler", (DebugRequestHandler,), {"routes": routes})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
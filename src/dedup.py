@@ -0,0 +1,39 @@
+from collections import OrderedDict
+
+
+DEDUP_CAPACITY = 100000
+
+
+class DedupIndex:
+    """Bounded LRU set of recently seen blood test results, keyed by (MRN, OBR-7 timestamp, value).
+
+    Answers in O(1) whether a result was already processed, so results resent after an MLLP
+    reconnect are dropped before touching SQLite or the pager. Keys evicted from the set are
+    still caught by the UNIQUE index on blood_tests, which makes the write a no-op.
+    """
+
+    def __init__(self, capacity=DEDUP_CAPACITY):
+        self.capacity = capacity
+        self.keys = OrderedDict()
+        self.duplicates = 0
+
+    @staticmethod
+    def key(result):
+        return result.mrn, result.date, result.value
+
+    def seen(self, key):
+        """Returns True (and counts a duplicate) if key was already processed."""
+        if key not in self.keys:
+            return False
+        self.keys.move_to_end(key)
+        self.duplicates += 1
+        return True
+
+    def add(self, key):
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        if len(self.keys) > self.capacity:
+            self.keys.popitem(last=False)
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,42 @@
+import threading
+from collections import deque
+
+
+class LIMSQueue:
+    """LIMS results (parser.Result) waiting for PAS data, retried by a background thread.
+
+    Holds at most maxlen results; appending to a full queue drops the oldest. A retry pass
+    works on a copy and then keeps whatever is still waiting, so results appended meanwhile,
+    and any they push out, do not disturb it.
+    """
+
+    def __init__(self, maxlen):
+        self.lock = threading.Lock()
+        self.results = deque(maxlen=maxlen)
+
+    def __len__(self):
+        return len(self.results)
+
+    def append(self, result):
+        """Queues a result. Returns True if the oldest one was dropped to make room."""
+        with self.lock:
+            full = len(self.results) == self.results.maxlen
+            self.results.append(result)
+            return full
+
+    def items(self):
+        with self.lock:
+            return list(self.results)
+
+    def retry(self, score):
+        """Calls score(result) for every waiting result and removes those it returns True for.
+
+        Returns the number removed.
+        """
+        done = {id(result): result for result in self.items() if score(result)}
+        if done:
+            with self.lock:
+                self.results = deque(
+                    (result for result in self.results if id(result) not in done), maxlen=self.results.maxlen
+                )
+        return len(done)
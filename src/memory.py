@@ -0,0 +1,182 @@
+import gc
+import os
+import sys
+import time
+import itertools
+import logging
+import threading
+import tracemalloc
+from collections import deque
+
+
+MEMORY_BUDGET_MB = 800  # the pod requests 1G
+MEMORY_CHECK_INTERVAL_SECONDS = 30
+EVICTION_FRACTION = 0.1
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+SIZE_SAMPLE = 20  # entries walked to estimate the size of a container
+
+
+def rss_bytes():
+    """Resident set size of this process, from /proc/self/statm."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def approximate_size(obj):
+    """Bytes held by obj and everything reachable through its containers and instance attributes.
+
+    Attributes are those in the instance __dict__ and in __slots__ declared along the class's MRO.
+
+    Objects reachable twice are counted once. Containers are copied before they are walked, so
+    the structure may be changed by other threads meanwhile; the result is then approximate.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for key, value in list(obj.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(obj))
+        elif not isinstance(obj, type):
+            if hasattr(obj, "__dict__"):
+                stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get("__slots__", ()):
+                    if name != "__dict__" and hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+    return total
+
+
+def estimated_size(obj, sample=SIZE_SAMPLE):
+    """Size of a container from a sample of its entries, without walking all of them.
+
+    The container itself plus its length times the mean approximate_size of its first sample
+    entries (key and value for a dict). Other objects are walked with approximate_size.
+    """
+    if isinstance(obj, dict):
+        entries = lambda: itertools.islice(obj.items(), sample)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        entries = lambda: itertools.islice(obj, sample)
+    else:
+        return approximate_size(obj)
+    for _ in range(3):
+        try:
+            sampled = list(entries())
+            break
+        except RuntimeError:  # changed size during iteration by another thread
+            continue
+    else:
+        return sys.getsizeof(obj)
+    if not sampled:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        sampled_bytes = sum(approximate_size(key) + approximate_size(value) for key, value in sampled)
+    else:
+        sampled_bytes = sum(approximate_size(entry) for entry in sampled)
+    return sys.getsizeof(obj) + len(obj) * sampled_bytes // len(sampled)
+
+
+class MemoryMonitor:
+    """Background thread that keeps RSS under a soft budget and sizes structures on request.
+
+    Every interval it compares RSS with budget_bytes, and nothing else. While RSS is over budget,
+    each check calls evict(fraction) to drop that share of the patient cache and runs a full
+    collection, so memory is given back before the kernel OOM-kills the pod. budget_bytes=None
+    only measures. structures maps names to callables returning the object; estimated_size(name)
+    samples a few entries and is cheap enough for every metrics scrape, while measured_sizes()
+    walks everything and is meant for debugging only.
+    """
+
+    def __init__(self, structures, evict, budget_bytes=MEMORY_BUDGET_MB << 20,
+                 interval=MEMORY_CHECK_INTERVAL_SECONDS, fraction=EVICTION_FRACTION):
+        self.structures = structures
+        self.evict = evict  # fraction -> number of entries evicted
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self.fraction = fraction
+        self.rss = 0
+        self.over_budget = 0
+        self.evicted = 0
+        self.logger = logging.getLogger(__name__)
+
+    def check(self):
+        """Reads RSS once and evicts if over budget. Returns the number of entries evicted."""
+        self.rss = rss_bytes()
+        if self.budget_bytes is None or self.rss <= self.budget_bytes:
+            return 0
+
+        self.over_budget += 1
+        evicted = self.evict(self.fraction)
+        gc.collect()
+        self.evicted += evicted
+        self.logger.warning(
+            f"RSS {self.rss >> 20} MB over the {self.budget_bytes >> 20} MB budget, "
+            f"evicted {evicted} patients ({rss_bytes() >> 20} MB now)"
+        )
+        return evicted
+
+    def estimated_size(self, name):
+        return estimated_size(self.structures[name]())
+
+    def measured_sizes(self):
+        """approximate_size of every structure. Walks every object they hold, so can take seconds."""
+        return {name: approximate_size(get()) for name, get in self.structures.items()}
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.warning(f"Memory check failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+
+class AllocationTracker:
+    """tracemalloc snapshots on demand, for the /debug/memory endpoint.
+
+    Tracing slows down every allocation, so it is off until the first report starts it and
+    can be stopped again. Each report lists the lines holding the most memory, or with diff
+    the lines whose allocations grew the most since the previous report.
+    """
+
+    def __init__(self, frames=TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self.previous = None
+
+    def report(self, limit=TOP_ALLOCATIONS, diff=False, stop=False):
+        if stop:
+            tracemalloc.stop()
+            self.previous = None
+            return "tracemalloc stopped\n"
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            return "tracemalloc started, request again for the allocations made since\n"
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        if diff and self.previous is not None:
+            stats = snapshot.compare_to(self.previous, "lineno")
+        else:
+            stats = snapshot.statistics("lineno")
+        self.previous = snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced {current >> 10} KiB, peak {peak >> 10} KiB"]
+        lines += [str(stat) for stat in stats[:limit]]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,148 @@
+import logging
+import threading
+from collections import deque
+
+
+MLLP_START_OF_BLOCK = 0x0b
+MLLP_END_OF_BLOCK = 0x1c
+MLLP_CARRIAGE_RETURN = 0x0d
+FRAME_END = bytes([MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN])
+
+INITIAL_BUFFER_SIZE = 64 << 10
+MAX_BUFFER_SIZE = 1 << 20  # an unterminated frame longer than this is discarded
+MIN_RECV_SIZE = 4 << 10  # never ask the kernel for less than this at once
+
+
+class MLLPReceiver:
+    """Receives MLLP frames with recv_into straight into a preallocated ring buffer.
+
+    receive() returns each complete message as a memoryview of the buffer, without copying it.
+    A frame stays valid until the consumer hands it back with release(), in the order the frames
+    were received; until then its bytes are never overwritten, so a consumer that falls behind
+    eventually makes receive() wait instead of the buffer growing.
+
+    New data is written after the last byte received. When the end of the buffer is reached,
+    the incomplete frame at the tail (if any) is moved to the front once that space has been
+    released, which is the only copy made. A frame too large for the buffer doubles it, up to
+    max_size; frames still held keep the old buffer alive until they are released.
+    """
+
+    def __init__(self, initial_size=INITIAL_BUFFER_SIZE, max_size=MAX_BUFFER_SIZE):
+        self.max_size = max_size
+        self.cond = threading.Condition()
+        self.outstanding = deque()  # (buffer, start) of frames not released yet, oldest first
+        self.recv_calls = 0
+        self.bytes_received = 0
+        self.bytes_copied = 0
+        self.messages = 0
+        self.discarded_bytes = 0
+        self.logger = logging.getLogger(__name__)
+        self._allocate(initial_size)
+
+    def _allocate(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first byte not framed yet
+        self.end = 0  # end of the data received
+        self.scan = 0  # where the search for the end of the current frame resumes
+
+    @property
+    def size(self):
+        return len(self.buffer)
+
+    def receive(self, sock):
+        """Reads once from sock. Returns the frames it completed, possibly none."""
+        with self.cond:
+            lo, hi = self._room()
+        n = sock.recv_into(self.view[lo:hi])
+        self.recv_calls += 1
+        if n == 0:
+            raise ConnectionError("MLLP connection closed by peer")
+        self.bytes_received += n
+        with self.cond:
+            self.end += n
+            return self._frames()
+
+    def release(self):
+        """Gives back the oldest frame returned by receive."""
+        with self.cond:
+            self.outstanding.popleft()
+            self.cond.notify()
+
+    def reset(self):
+        """Drops an incomplete frame, e.g. after a reconnect: the sender starts it again."""
+        with self.cond:
+            self.start = self.scan = self.end
+            self._rewind()
+
+    def _head(self):
+        """Start of the oldest byte still needed in the current buffer."""
+        for buffer, start in self.outstanding:
+            if buffer is self.buffer:
+                return start
+        return self.start
+
+    def _rewind(self):
+        if self._head() == self.start == self.end:
+            self.start = self.end = self.scan = 0
+
+    def _move(self, buffer, view):
+        partial = self.end - self.start
+        view[:partial] = self.view[self.start:self.end]  # memmove, the regions may overlap
+        self.bytes_copied += partial
+        self.scan -= self.start
+        self.buffer, self.view = buffer, view
+        self.start, self.end = 0, partial
+
+    def _room(self):
+        """Returns a free region of at least MIN_RECV_SIZE bytes, making one if needed."""
+        while True:
+            head = self._head()
+            if head > self.start:
+                # Wrapped: frames are still held at the back, new data goes in front of them.
+                if head - self.end >= MIN_RECV_SIZE:
+                    return self.end, head
+            elif self.size - self.end >= MIN_RECV_SIZE:
+                return self.end, self.size
+            else:
+                partial = self.end - self.start
+                if partial + MIN_RECV_SIZE > self.size:
+                    self._grow(partial + MIN_RECV_SIZE)
+                    continue
+                if head == self.start or partial + MIN_RECV_SIZE <= head:
+                    self._move(self.buffer, self.view)
+                    continue
+            self.cond.wait()
+
+    def _grow(self, needed):
+        if needed > self.max_size:
+            self.logger.warning(f"Discarded {self.end - self.start} bytes of an unterminated MLLP frame")
+            self.discarded_bytes += self.end - self.start
+            self.reset()
+            return
+        size = self.size
+        while size < needed:
+            size *= 2
+        buffer = bytearray(min(size, self.max_size))
+        self._move(buffer, memoryview(buffer))
+
+    def _frames(self):
+        frames = []
+        while self.start < self.end:
+            if self.buffer[self.start] != MLLP_START_OF_BLOCK:
+                resync = self.buffer.find(MLLP_START_OF_BLOCK, self.start, self.end)
+                resync = self.end if resync == -1 else resync
+                self.logger.warning(f"Bad MLLP encoding, discarded {resync - self.start} bytes")
+                self.discarded_bytes += resync - self.start
+                self.start = self.scan = resync
+                continue
+            stop = self.buffer.find(FRAME_END, max(self.scan, self.start + 1), self.end)
+            if stop == -1:
+                self.scan = max(self.start + 1, self.end - 1)
+                break
+            frames.append(self.view[self.start + 1:stop])
+            self.outstanding.append((self.buffer, self.start))
+            self.start = self.scan = stop + len(FRAME_END)
+            self.messages += 1
+        self._rewind()
+        return frames
@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections import deque
+
+
+ACTIVE_POINTER = "ACTIVE"
+ROLLBACK_MARKER = "ROLLBACK"
+MODEL_SUFFIX = ".pkl"
+RECENT_TRAFFIC_SIZE = 500
+MIN_AGREEMENT = 0.9
+MAX_LATENCY_RATIO = 2.0
+POLL_INTERVAL_SECONDS = 10
+
+
+class ModelRegistry:
+    """Serves the active predictor and hot-swaps in new model files dropped into a directory.
+
+    New models are published by writing <name>.pkl into the directory (write to a temporary
+    name and rename, so a half-written file is never picked up). A background thread loads
+    each new file and validates it against the active model on recently scored inputs:
+    predictions must agree on at least min_agreement of them and the p99 single-prediction
+    latency may be at most max_latency_ratio times the active model's. A model that passes
+    is staged, and the ingest thread swaps it in between two messages by calling
+    activate_pending. The previous model stays loaded; touching a ROLLBACK file in the
+    directory swaps it back. The active file name is recorded in ACTIVE, so restarts keep it.
+    clock is what latencies are measured with.
+    """
+
+    def __init__(self, directory, load, default_path, min_agreement=MIN_AGREEMENT,
+                 max_latency_ratio=MAX_LATENCY_RATIO, interval=POLL_INTERVAL_SECONDS, clock=time.perf_counter):
+        self.directory = directory
+        self.load = load  # path -> predictor
+        self.min_agreement = min_agreement
+        self.max_latency_ratio = max_latency_ratio
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=RECENT_TRAFFIC_SIZE)  # fetch_data dicts the active model scored
+        self.pending = None  # (version, predictor) validated and waiting for a message boundary
+        self.previous = None
+        self.seen = set()  # (file name, mtime) already validated or rejected
+        self.swaps = 0
+        self.rejections = 0
+        self.logger = logging.getLogger(__name__)
+
+        os.makedirs(directory, exist_ok=True)
+        self.version, self.predictor = "default", None
+        active = self._read_pointer()
+        if active is not None:
+            try:
+                self.version, self.predictor = active, self.load(os.path.join(directory, active))
+                self.seen.add(self._key(active))
+            except Exception as e:
+                self.logger.warning(f"Couldn't load active model {active}: {e}. Using {default_path}")
+        if self.predictor is None:
+            self.predictor = self.load(default_path)
+
+    def record(self, data):
+        """Remembers an input the active model has just scored, for validating candidates."""
+        self.recent.append(data)
+
+    def activate_pending(self):
+        """Swaps in a staged model or rollback. Call from the ingest thread between messages."""
+        if self.pending is None:
+            return False
+        with self.lock:
+            version, predictor = self.pending
+            self.pending = None
+            self.previous = (self.version, self.predictor)
+            self.version, self.predictor = version, predictor
+            self.swaps += 1
+        self._write_pointer(version)
+        self.logger.info(f"Model {version} is now active (previous: {self.previous[0]})")
+        return True
+
+    def _key(self, name):
+        try:
+            return name, os.path.getmtime(os.path.join(self.directory, name))
+        except OSError:
+            return name, None
+
+    def _read_pointer(self):
+        try:
+            with open(os.path.join(self.directory, ACTIVE_POINTER)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _write_pointer(self, version):
+        pointer = os.path.join(self.directory, ACTIVE_POINTER)
+        if version == "default":
+            if os.path.exists(pointer):
+                os.remove(pointer)
+            return
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)
+
+    def _latency(self, predictor, data):
+        start = self.clock()
+        predictor.predict(data)
+        return self.clock() - start
+
+    def validate(self, candidate):
+        """Compares a candidate with the active model on recent traffic. Returns None if it passes."""
+        inputs = list(self.recent)
+        active = self.predictor
+        agreement = np.mean([active.predict(data)[0] == candidate.predict(data)[0] for data in inputs])
+        if agreement < self.min_agreement:
+            return f"agreement {agreement:.3f} below {self.min_agreement}"
+        # Interleaved, so load from other threads affects both models alike.
+        latencies = np.array([(self._latency(active, data), self._latency(candidate, data)) for data in inputs])
+        active_p99, candidate_p99 = np.percentile(latencies, 99, axis=0)
+        if candidate_p99 > self.max_latency_ratio * active_p99:
+            return f"p99 latency {candidate_p99 * 1e3:.2f}ms vs {active_p99 * 1e3:.2f}ms for the active model"
+        return None
+
+    def poll(self):
+        """Looks for a rollback marker or a new model file once. Returns True if something was staged."""
+        marker = os.path.join(self.directory, ROLLBACK_MARKER)
+        if os.path.exists(marker):
+            os.remove(marker)
+            if self.previous is None:
+                self.logger.warning("Rollback requested but there is no previous model")
+                return False
+            with self.lock:
+                self.pending = self.previous
+            self.logger.info(f"Rolling back to model {self.previous[0]}")
+            return True
+
+        if not self.recent:
+            return False  # nothing to validate against yet; new files are picked up once traffic arrives
+        names = sorted(
+            (name for name in os.listdir(self.directory) if name.endswith(MODEL_SUFFIX)),
+            key=lambda name: self._key(name)[1] or 0,
+        )
+        for name in reversed(names):  # newest first
+            key = self._key(name)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            try:
+                candidate = self.load(os.path.join(self.directory, name))
+                reason = self.validate(candidate)
+            except Exception as e:
+                reason = f"failed: {e}"
+            if reason is not None:
+                self.rejections += 1
+                self.logger.warning(f"Model {name} rejected: {reason}")
+                continue
+            self.seen.update(self._key(older) for older in names)  # superseded by this one
+            with self.lock:
+                self.pending = (name, candidate)
+            self.logger.info(f"Model {name} validated, swapping in at the next message")
+            return True
+        return False
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.warning(f"Model registry poll failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
@@ -1,8 +1,73 @@
 from hl7apy.parser import parse_message
-from datetime import datetime
+from datetime import datetime, timedelta
 from hl7apy.exceptions import HL7apyException
 
 
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+
+class Record:
+    """Base of the parsed message records: fixed slots instead of a dict per instance.
+
+    Records are built by the parser and passed through persist and score as they are, so each
+    holds numbers rather than the message's text: MRNs and dates (epoch seconds) as ints and
+    creatinine values as floats. Equality and repr go by the slots.
+    """
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Admission(Record):
+    """ADT^A01: sex is 0 for M and 1 for F."""
+
+    __slots__ = ("mrn", "dob", "sex")
+
+    def __init__(self, mrn, dob, sex):
+        self.mrn = mrn
+        self.dob = dob
+        self.sex = sex
+
+
+class Discharge(Record):
+    """ADT^A03."""
+
+    __slots__ = ("mrn",)
+
+    def __init__(self, mrn):
+        self.mrn = mrn
+
+
+class Result(Record):
+    """One creatinine result of an ORU^R01 message. date is None when OBR-7 is blank."""
+
+    __slots__ = ("mrn", "date", "value")
+
+    def __init__(self, mrn, date, value):
+        self.mrn = mrn
+        self.date = date
+        self.value = value
+
+
+class LabReport(Record):
+    """ORU^R01: its creatinine results, in message order, as a tuple of Result."""
+
+    __slots__ = ("mrn", "results")
+
+    def __init__(self, mrn, results):
+        self.mrn = mrn
+        self.results = results
+
+
 class HL7MessageParser:
     def parse(self, hl7_message):
         """Determines the message type and routes to the appropriate handler."""
@@ -10,11 +75,11 @@ class HL7MessageParser:
             message = parse_message(hl7_message, find_groups=False)
             pid = message.PID
             msg_type = message.msh.MSH_9.value
-            mrn = pid.PID_3.value
-            mrn = pid.PID_3.value
+            mrn = self._convert_mrn(pid.PID_3.value)
         except (HL7apyException, AttributeError, TypeError):
             return None, None, "error"
-        
+        if mrn is None:
+            return None, None, "error"
 
         if msg_type == "ADT^A01":
             return self._handle_adt_a01(pid, mrn)
@@ -28,18 +93,18 @@ class HL7MessageParser:
     def _handle_adt_a01(self, pid, mrn):
         """Handles ADT^A01 (Patient Admission) messages."""
         try: 
-            dob = self._convert_to_datetime(pid.PID_7.value)
+            dob = self._convert_to_epoch(pid.PID_7.value)
             sex = pid.PID_8.value
         except (AttributeError, TypeError, ValueError):
             return None, None, "error"
         sex = {"M": 0, "F": 1}.get(sex, None)
         if dob == None or sex == None:
             return None, None, "error"
-        return "PAS_admit", {"mrn": mrn, "dob": dob, "sex": sex}, "no error"
+        return "PAS_admit", Admission(mrn, dob, sex), "no error"
 
     def _handle_adt_a03(self, mrn):
         """Handles ADT^A03 (Patient Discharge) messages."""
-        return "PAS_discharge", {"mrn": mrn}, "no error"
+        return "PAS_discharge", Discharge(mrn), "no error"
 
     def _handle_oru_r01(self, message, mrn):
         """Handles ORU^R01 (Lab Results) messages."""
@@ -52,14 +117,13 @@ class HL7MessageParser:
                 current_obr = segment  
             
             elif segment.name == "OBX" and segment.OBX_3.value == "CREATININE":
-                creatinine_value = segment.OBX_5.value 
+                creatinine_value = self._convert_value(segment.OBX_5.value)
+                if creatinine_value is None:
+                    return None, None, "error"
 
-                creatinine_date = self._convert_to_datetime(current_obr.OBR_7.value) if current_obr.OBR_7.value else " "
+                creatinine_date = self._convert_to_epoch(current_obr.OBR_7.value)
 
-                results.append({
-                    "result": creatinine_value,
-                    "date": creatinine_date
-                })
+                results.append(Result(mrn, creatinine_date, creatinine_value))
             #else:
                 #return None, None, "error"
             
@@ -67,29 +131,85 @@ class HL7MessageParser:
         if not results:
             return None, None, "error"  # No Creatinine test found
 
-        return "LIMS", {"mrn": mrn, "results": results}, "no error"
+        return "LIMS", LabReport(mrn, tuple(results)), "no error"
+
+    @staticmethod
+    def _convert_mrn(mrn):
+        """PID-3 as an int, or None if it is not a number."""
+        mrn = (mrn or "").strip()
+        return int(mrn) if mrn.isdigit() else None
+
+    @staticmethod
+    def _convert_value(value):
+        """OBX-5 as a float, or None if it is not a number."""
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
 
     @staticmethod
-    def _convert_to_datetime(date_str):
-        """Converts HL7 date string (YYYYMMDD, YYYYMMDDHHMM, YYYYMMDDHHMMSS) to a formatted datetime string (YYYY-MM-DD HH:MM:SS)."""
-        if not date_str:
+    def _convert_to_epoch(date_str):
+        """Converts an HL7 date string (YYYYMMDD, YYYYMMDDHH, YYYYMMDDHHMM, YYYYMMDDHHMMSS) to integer epoch seconds."""
+        if not date_str or len(date_str) not in (8, 10, 12, 14) or not date_str.isdigit():
             return None
+        parts = [int(date_str[:4])] + [int(date_str[i:i + 2]) for i in range(4, len(date_str), 2)]
         try:
-            if len(date_str) == 8:
-                dt = datetime.strptime(date_str, "%Y%m%d")
-            elif len(date_str) == 10:
-                dt = datetime.strptime(date_str, "%Y%m%d%H")
-            elif len(date_str) == 12:
-                dt = datetime.strptime(date_str, "%Y%m%d%H%M")
-            elif len(date_str) == 14:
-                dt = datetime.strptime(date_str, "%Y%m%d%H%M%S")
-            else:
-                return None
-            return dt.strftime("%Y-%m-%d %H:%M:%S")
+            return (datetime(*parts) - EPOCH) // ONE_SECOND
         except ValueError:
             return None
 
 
+class SplitHL7MessageParser(HL7MessageParser):
+    """Parses by splitting on the segment and field separators instead of building an hl7apy tree.
+
+    Returns the same results as HL7MessageParser for the simulator's messages at a fraction
+    of the cost, which matters when replaying a whole feed offline.
+    """
+
+    def parse(self, hl7_message):
+        segments = [segment.split("|") for segment in hl7_message.split("\r") if segment]
+        names = [segment[0] for segment in segments]
+        if "MSH" not in names or "PID" not in names:
+            return None, None, "error"
+        msh = segments[names.index("MSH")]
+        pid = segments[names.index("PID")]
+        msg_type = self._field(msh, 8)  # MSH-1 is the field separator itself
+        mrn = self._convert_mrn(self._field(pid, 3))
+        if mrn is None:
+            return None, None, "error"
+
+        if msg_type == "ADT^A01":
+            dob = self._convert_to_epoch(self._field(pid, 7))
+            sex = {"M": 0, "F": 1}.get(self._field(pid, 8), None)
+            if dob == None or sex == None:
+                return None, None, "error"
+            return "PAS_admit", Admission(mrn, dob, sex), "no error"
+        elif msg_type == "ADT^A03":
+            return self._handle_adt_a03(mrn)
+        elif msg_type == "ORU^R01":
+            results = []
+            current_obr = None
+            for segment in segments:
+                if segment[0] == "OBR":
+                    current_obr = segment
+                elif segment[0] == "OBX" and self._field(segment, 3) == "CREATININE":
+                    if current_obr is None:
+                        return None, None, "error"
+                    value = self._convert_value(self._field(segment, 5))
+                    if value is None:
+                        return None, None, "error"
+                    results.append(Result(mrn, self._convert_to_epoch(self._field(current_obr, 7)), value))
+            if not results:
+                return None, None, "error"
+            return "LIMS", LabReport(mrn, tuple(results)), "no error"
+        else:
+            return None, None, "error"
+
+    @staticmethod
+    def _field(segment, index):
+        return segment[index] if index < len(segment) else ""
+
+
 if __name__ == "__main__":
     message2 = (
         "MSH|^~\&|SIMULATION|SOUTH RIVERSIDE|||20240107133000||ADT^A01|||2.5\r"
@@ -133,6 +253,6 @@ if __name__ == "__main__":
     parser = HL7MessageParser()
     parsed_message = parser.parse(message)
     print(parsed_message)
-    print(type(parsed_message[1]['mrn']))
+    print(type(parsed_message[1].mrn))
     #self.assertEqual(parsed_message[1]['mrn'], '185620675')
     # print(parser.parse())
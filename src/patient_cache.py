@@ -0,0 +1,381 @@
+import os
+import json
+import bisect
+import time
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+
+SNAPSHOT_POINTER = "CURRENT"
+SNAPSHOT_COLUMNS = ("mrns", "dobs", "sexes", "offsets", "timestamps", "creatinine_levels")
+ADMISSIONS_TRACKED = 10000  # admitted patients awaiting their first result, for the prefetch hit rate
+
+
+class PatientCache:
+    """In-memory patient state (demographics plus creatinine series) in front of a Database.
+
+    Writes go to SQLite first and are mirrored in memory; reads are served from memory and
+    fall through to SQLite on a miss. The state can be saved as a columnar snapshot and
+    memory-mapped back on startup, so only writes made after the snapshot are replayed.
+    Discharged patients are demoted to SQLite, and the least recently used patients can be
+    evicted to stay within a memory budget. Admitted patients, re-admissions included, can be
+    prefetched from SQLite by another thread ahead of their first result.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.saving = threading.Lock()  # one save_snapshot at a time
+        self.patients = {}  # mrn -> (dob, sex), least recently used first
+        self.series = {}  # mrn -> ([epoch dates], [creatinine_levels]), sorted by date
+        self.summaries = {}  # mrn -> MedianSketch of results compacted out of SQLite
+        self.base = None  # memory-mapped snapshot columns
+        self.base_generation = None  # snapshot directory self.base maps, never rewritten or removed
+        self.stale = set()  # snapshot patients whose entry predates a demotion or eviction
+        self.dropped = None  # patients demoted or evicted since the running save read the cache
+        self.loading = {}  # mrn -> whether it changed while prefetch was reading it from SQLite
+        self.awaiting = {}  # admitted patients whose first result was not fetched yet, oldest first
+        self.demoted = 0
+        self.evicted = 0
+        self.prefetch_hits = 0  # first fetches after admission served from memory
+        self.prefetch_misses = 0
+
+    def __len__(self):
+        """Patients held in memory, counting those still only in the mapped snapshot."""
+        with self.lock:
+            if self.base is None:
+                return len(self.patients)
+            skip = np.asarray(list(self.patients) + list(self.stale), dtype=np.int64)
+            return len(self.patients) + int((~np.isin(self.base["mrns"], skip)).sum())
+
+    def write_pas_data(self, mrn, dob, sex):
+        with self.lock:
+            self.db.write_pas_data(mrn, dob, sex)
+            mrn = int(mrn)
+            self._touch(mrn)
+            if self._load(mrn, from_db=False):
+                self.patients[mrn] = (dob, sex)
+            self.awaiting.pop(mrn, None)
+            self.awaiting[mrn] = None
+            if len(self.awaiting) > ADMISSIONS_TRACKED:
+                del self.awaiting[next(iter(self.awaiting))]
+
+    def write_lims_data(self, mrn, date, result):
+        with self.lock:
+            inserted = self.db.write_lims_data(mrn, date, result)
+            mrn = int(mrn)
+            self._touch(mrn)
+            if inserted and self._load(mrn, from_db=False):
+                self._append(mrn, date, float(result))
+            return inserted
+
+    def write_lims_results(self, mrn, results):
+        """Writes all results of one ORU message (parser.Result records) in a single transaction.
+
+        Returns the results that were not already stored.
+        """
+        with self.lock:
+            with self.db.transaction():
+                inserted = [r for r in results if self.db.write_lims_data(r.mrn, r.date, r.value)]
+            self._touch(int(mrn))
+            if self._load(int(mrn), from_db=False):
+                for r in inserted:
+                    self._append(int(mrn), r.date, r.value)
+            return inserted
+
+    def fetch_data(self, mrn, timestamp):
+        """Same contract as Database.fetch_data, served from memory when possible."""
+        with self.lock:
+            mrn = int(mrn)
+            if mrn in self.awaiting:
+                del self.awaiting[mrn]
+                if mrn in self.patients:
+                    self.prefetch_hits += 1
+                else:
+                    self.prefetch_misses += 1
+            if not self._load(mrn):
+                return None
+            dob, sex = self.patients[mrn]
+            dates, creatinine_levels = self.series[mrn]
+            end = bisect.bisect_right(dates, timestamp)
+            data = {
+                "mrn": mrn,
+                "dob": dob,
+                "sex": sex,
+                "dates": dates[:end],
+                "creatinine_levels": creatinine_levels[:end],
+            }
+            if mrn in self.summaries:
+                data["summary"] = self.summaries[mrn]
+            return data
+
+    def compact_patient(self, mrn, cutoff):
+        """Database.compact_patient, also dropping the compacted results from memory."""
+        with self.lock:
+            summary = self.db.compact_patient(mrn, cutoff)
+            self._touch(int(mrn))
+            if summary is not None and int(mrn) in self.patients:
+                self._apply_summary(int(mrn), summary)
+            return summary
+
+    def _apply_summary(self, mrn, summary):
+        self.summaries[mrn] = summary
+        dates, creatinine_levels = self.series[mrn]
+        start = bisect.bisect_left(dates, summary.compacted_until)
+        self.series[mrn] = (dates[start:], creatinine_levels[start:])
+
+    def demote(self, mrn):
+        """Moves a discharged patient out of memory; SQLite remains the cold tier."""
+        with self.lock:
+            mrn = int(mrn)
+            self._touch(mrn)
+            self.awaiting.pop(mrn, None)
+            self._drop(mrn)
+            self.demoted += 1
+
+    def evict(self, count):
+        """Drops the count least recently used patients from memory. Returns how many were dropped.
+
+        Unlike demote, evicted patients are not cold: their next read loads them from SQLite.
+        """
+        with self.lock:
+            victims = list(self.patients)[:count]
+            for mrn in victims:
+                self._drop(mrn)
+            self.evicted += len(victims)
+            return len(victims)
+
+    def prefetch(self, mrn):
+        """Loads an admitted patient into memory ahead of their first result.
+
+        SQLite is read without holding the lock, so ingest is not held up meanwhile; if the
+        patient is written to or demoted during the read, the result is discarded and the next
+        read loads them as usual. Returns the time taken in seconds, or None if nothing was loaded.
+        """
+        start = time.perf_counter()
+        mrn = int(mrn)
+        with self.lock:
+            if mrn in self.patients or mrn in self.loading:
+                return None
+            if self._load_from_snapshot(mrn):
+                return time.perf_counter() - start
+            self.loading[mrn] = False
+        try:
+            state = self._read(mrn)
+        except Exception:
+            with self.lock:
+                del self.loading[mrn]
+            raise
+        with self.lock:
+            if self.loading.pop(mrn) or state is None or mrn in self.patients:
+                return None
+            self._install(mrn, state)
+            return time.perf_counter() - start
+
+    @property
+    def prefetch_hit_rate(self):
+        first_fetches = self.prefetch_hits + self.prefetch_misses
+        return self.prefetch_hits / first_fetches if first_fetches else 0.0
+
+    def _drop(self, mrn):
+        self.patients.pop(mrn, None)
+        self.series.pop(mrn, None)
+        self.summaries.pop(mrn, None)
+        if self._snapshot_index(mrn) is not None:
+            self.stale.add(mrn)
+        dropped = self.dropped  # may be reset by save_snapshot without the lock
+        if dropped is not None:
+            dropped.add(mrn)
+
+    def _touch(self, mrn):
+        if mrn in self.loading:
+            self.loading[mrn] = True
+
+    def _append(self, mrn, date, creatinine_level):
+        if date is None:
+            return  # results without a date stay in SQLite only and are never scored
+        summary = self.summaries.get(mrn)
+        if summary is not None and date < summary.compacted_until:
+            self.summaries[mrn] = self.db.read_summary(mrn)  # Database folded it into the summary
+            return
+        dates, creatinine_levels = self.series[mrn]
+        i = bisect.bisect_right(dates, date)
+        dates.insert(i, date)
+        creatinine_levels.insert(i, creatinine_level)
+
+    def _load(self, mrn, from_db=True):
+        """Makes mrn resident in memory. Returns False if there is no PAS data for it."""
+        if mrn in self.patients:
+            self.patients[mrn] = self.patients.pop(mrn)  # most recently used
+            return True
+        if self._load_from_snapshot(mrn):
+            return True
+        if not from_db:
+            # Not resident: SQLite already holds the write and a later read will load it.
+            return False
+
+        state = self._read(mrn)
+        if state is None:
+            return False
+        self._install(mrn, state)
+        return True
+
+    def _read(self, mrn):
+        """Reads a patient's state from SQLite. Returns None if there is no PAS data for it."""
+        pas_data = self.db.read_pas_data(mrn)
+        if pas_data is None:
+            return None
+        return (pas_data[1], pas_data[2]), self.db.read_lims_data(mrn), self.db.read_summary(mrn)
+
+    def _install(self, mrn, state):
+        patient, lims_data, summary = state
+        self.patients[mrn] = patient
+        self.series[mrn] = ([ld[1] for ld in lims_data], [ld[2] for ld in lims_data])
+        if summary is not None:
+            self.summaries[mrn] = summary
+
+    def _snapshot_index(self, mrn):
+        if self.base is None:
+            return None
+        mrns = self.base["mrns"]
+        i = np.searchsorted(mrns, mrn)
+        return i if i < len(mrns) and mrns[i] == mrn else None
+
+    def _load_from_snapshot(self, mrn):
+        if mrn in self.stale:
+            return False
+        i = self._snapshot_index(mrn)
+        if i is None:
+            return False
+
+        start, end = self.base["offsets"][i], self.base["offsets"][i + 1]
+        self.patients[mrn] = (int(self.base["dobs"][i]), int(self.base["sexes"][i]))
+        self.series[mrn] = (
+            self.base["timestamps"][start:end].tolist(),
+            self.base["creatinine_levels"][start:end].tolist(),
+        )
+        # The snapshot may predate a compaction of this patient.
+        summary = self.db.read_summary(mrn)
+        if summary is not None:
+            self._apply_summary(mrn, summary)
+        return True
+
+    def save_snapshot(self, directory, blocking=True):
+        """Writes the resident state as a new columnar snapshot generation under directory.
+
+        Every save writes a new generation, points CURRENT at it and then maps it in place of
+        the previous one, which is removed only once it is no longer mapped. With blocking=False
+        (e.g. from a signal handler that may have interrupted a cache operation) nothing is
+        written and None is returned if the cache is busy.
+        """
+        if not self.saving.acquire(blocking):
+            return None
+        try:
+            if not self.lock.acquire(blocking):
+                return None
+            try:
+                watermark = self.db.max_rowids()
+                columns = self._columns()
+                self.dropped = set()
+            finally:
+                self.lock.release()
+
+            os.makedirs(directory, exist_ok=True)
+            temp = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+            for name in SNAPSHOT_COLUMNS:
+                np.save(os.path.join(temp, f"{name}.npy"), columns[name])
+            with open(os.path.join(temp, "meta.json"), "w") as f:
+                json.dump({"patients_rowid": watermark[0], "blood_tests_rowid": watermark[1]}, f)
+            generation = f"{time.time_ns()}-{watermark[0]}-{watermark[1]}"
+            path = os.path.join(directory, generation)
+            os.rename(temp, path)
+
+            pointer = os.path.join(directory, SNAPSHOT_POINTER)
+            with open(pointer + ".tmp", "w") as f:
+                f.write(generation)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(pointer + ".tmp", pointer)
+
+            base = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in SNAPSHOT_COLUMNS}
+            if self.lock.acquire(blocking):
+                try:
+                    self.base, self.base_generation = base, generation
+                    self.stale = {mrn for mrn in self.dropped if self._snapshot_index(mrn) is not None}
+                finally:
+                    self.lock.release()
+            keep = self.base_generation
+            for old in os.listdir(directory):
+                old_path = os.path.join(directory, old)
+                if old not in (generation, keep) and os.path.isdir(old_path):
+                    shutil.rmtree(old_path, ignore_errors=True)
+            return path
+        finally:
+            self.dropped = None
+            self.saving.release()
+
+    def _columns(self):
+        mrns = sorted(self.patients)
+        dobs = [self.patients[mrn][0] for mrn in mrns]
+        sexes = [self.patients[mrn][1] for mrn in mrns]
+        timestamps = [np.asarray(self.series[mrn][0], dtype=np.int64) for mrn in mrns]
+        creatinine_levels = [np.asarray(self.series[mrn][1], dtype=np.float64) for mrn in mrns]
+
+        if self.base is not None:
+            # Carry over snapshot patients that were never made resident, without hydrating them.
+            offsets = self.base["offsets"]
+            skip = np.asarray(mrns + list(self.stale), dtype=np.int64)
+            for i in np.flatnonzero(~np.isin(self.base["mrns"], skip)):
+                mrns.append(int(self.base["mrns"][i]))
+                dobs.append(int(self.base["dobs"][i]))
+                sexes.append(int(self.base["sexes"][i]))
+                timestamps.append(self.base["timestamps"][offsets[i]:offsets[i + 1]])
+                creatinine_levels.append(self.base["creatinine_levels"][offsets[i]:offsets[i + 1]])
+
+        order = np.argsort(np.asarray(mrns, dtype=np.int64), kind="stable")
+        lengths = np.asarray([len(timestamps[i]) for i in order], dtype=np.int64)
+        return {
+            "mrns": np.asarray(mrns, dtype=np.int64)[order],
+            "dobs": np.asarray(dobs, dtype=np.int64)[order],
+            "sexes": np.asarray(sexes, dtype=np.int8)[order],
+            "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            "timestamps": np.concatenate([np.empty(0, np.int64)] + [timestamps[i] for i in order]),
+            "creatinine_levels": np.concatenate(
+                [np.empty(0, np.float64)] + [creatinine_levels[i] for i in order]
+            ),
+        }
+
+    def load_snapshot(self, directory):
+        """Memory-maps the latest snapshot and replays SQLite writes made after it.
+
+        Returns the number of replayed rows, or None if there is no snapshot.
+        """
+        pointer = os.path.join(directory, SNAPSHOT_POINTER)
+        if not os.path.isfile(pointer):
+            return None
+        with open(pointer) as f:
+            generation = f.read().strip()
+        path = os.path.join(directory, generation)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        with self.lock:
+            self.base = {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                for name in SNAPSHOT_COLUMNS
+            }
+            self.base_generation = generation
+            self.patients, self.series, self.summaries = {}, {}, {}
+            self.stale = set()
+
+            pas_rows = self.db.read_pas_since(meta["patients_rowid"])
+            for mrn, dob, sex in pas_rows:
+                if self._load(mrn, from_db=False):
+                    self.patients[mrn] = (dob, sex)
+            lims_rows = self.db.read_lims_since(meta["blood_tests_rowid"])
+            for mrn, date, creatinine_level in lims_rows:
+                if self._load(mrn, from_db=False):
+                    self._append(mrn, date, creatinine_level)
+        return len(pas_rows) + len(lims_rows)
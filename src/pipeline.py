@@ -0,0 +1,111 @@
+import time
+import queue
+import logging
+import threading
+
+
+STAGE_QUEUE_SIZE = 64
+STOP_TIMEOUT_SECONDS = 10
+_STOP = object()  # wakes a stage waiting for its next item so it can stop
+
+
+class Pipeline:
+    """Runs items through a chain of stages, one thread per stage, joined by bounded queues.
+
+    Each stage is a (name, handler) pair; handler(item, emit) does the stage's work and calls
+    emit(next_item) for every item the next stage should see. emit and put block while the
+    queue in front of the next stage is full, so a stage that falls behind stalls the stages
+    before it instead of letting anything grow, and ultimately put, i.e. whoever feeds the
+    first stage. Memory is bounded by queue_size items per stage.
+
+    blocked_seconds[name] is the time spent waiting for room in front of stage name, which
+    together with depth(name) shows the stage that is holding everything back. stop(name) lets
+    a stage finish the item in hand and ends its thread, leaving the rest queued for drain.
+    """
+
+    def __init__(self, stages, queue_size=STAGE_QUEUE_SIZE):
+        self.names = [name for name, _ in stages]
+        self.handlers = [handler for _, handler in stages]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.processed = {name: 0 for name in self.names}
+        self.failed = {name: 0 for name in self.names}
+        self.blocked_seconds = {name: 0.0 for name in self.names}
+        self.stopping = [threading.Event() for _ in stages]
+        self.threads = []
+        self.logger = logging.getLogger(__name__)
+
+    def _put(self, i, item):
+        try:
+            self.queues[i].put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queues[i].put(item)
+            self.blocked_seconds[self.names[i]] += time.perf_counter() - start
+
+    def put(self, item):
+        """Hands an item to the first stage, waiting while it is full."""
+        self._put(0, item)
+
+    def depth(self, name):
+        return self.queues[self.names.index(name)].qsize()
+
+    def drain(self, name):
+        """Removes and returns the items still waiting for stage name, e.g. to save them on shutdown."""
+        items = []
+        stage_queue = self.queues[self.names.index(name)]
+        while True:
+            try:
+                item = stage_queue.get_nowait()
+            except queue.Empty:
+                return items
+            stage_queue.task_done()
+            if item is not _STOP:
+                items.append(item)
+
+    def join(self):
+        """Waits until every item put so far has been through all stages."""
+        for stage_queue in self.queues:
+            stage_queue.join()
+
+    def run_stage(self, i):
+        name, handler, stage_queue = self.names[i], self.handlers[i], self.queues[i]
+        if i + 1 < len(self.queues):
+            emit = lambda item: self._put(i + 1, item)
+        else:
+            emit = lambda item: None
+        while not self.stopping[i].is_set():
+            item = stage_queue.get()
+            if item is _STOP:
+                stage_queue.task_done()
+                continue
+            try:
+                handler(item, emit)
+                self.processed[name] += 1
+            except Exception as e:
+                self.failed[name] += 1
+                self.logger.warning(f"Pipeline stage {name} failed: {e}")
+            finally:
+                stage_queue.task_done()
+
+    def stop(self, name, timeout=STOP_TIMEOUT_SECONDS):
+        """Ends stage name's thread once its current item is done. Returns False if it did not end in time.
+
+        Stop stages from first to last: a stage still running may be waiting for room in the next.
+        """
+        i = self.names.index(name)
+        self.stopping[i].set()
+        try:
+            self.queues[i].put_nowait(_STOP)
+        except queue.Full:
+            pass  # the stage is busy and sees the flag before taking another item
+        if i < len(self.threads):
+            self.threads[i].join(timeout)
+            return not self.threads[i].is_alive()
+        return True
+
+    def start(self):
+        for i, name in enumerate(self.names):
+            thread = threading.Thread(target=self.run_stage, args=(i,), name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self.threads
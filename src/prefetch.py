@@ -0,0 +1,50 @@
+import queue
+import logging
+import threading
+
+
+PREFETCH_QUEUE_SIZE = 1000
+
+
+class Prefetcher:
+    """Background thread that loads admitted patients into the patient cache ahead of their results.
+
+    The ingest thread calls submit on every admission, which only enqueues without blocking;
+    when the bounded queue is full the admission is dropped and counted, and the patient's
+    first result loads them as before. The worker calls cache.prefetch and reports the time
+    each load took through on_load(seconds).
+    """
+
+    def __init__(self, cache, queue_size=PREFETCH_QUEUE_SIZE, on_load=None):
+        self.cache = cache
+        self.on_load = on_load
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.loaded = 0
+        self.dropped = 0
+        self.logger = logging.getLogger(__name__)
+
+    def submit(self, mrn):
+        """Queues an admitted patient for loading. Never blocks."""
+        try:
+            self.queue.put_nowait(mrn)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            mrn = self.queue.get()
+            try:
+                seconds = self.cache.prefetch(mrn)
+            except Exception as e:
+                self.logger.warning(f"Prefetch of MRN {mrn} failed: {e}")
+                continue
+            if seconds is None:
+                continue
+            self.loaded += 1
+            if self.on_load is not None:
+                self.on_load(seconds)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 120
+SAMPLE_HZ = 100
+MAX_SAMPLE_HZ = 1000
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the Python stacks of every thread on demand, for the /debug/profile endpoint.
+
+    Nothing runs until profile() is called: the calling thread then wakes hz times a second
+    for the given number of seconds, records each other thread's stack with
+    sys._current_frames(), and returns the counts in collapsed-stack format ("thread;outer;...;inner
+    count" per line), which flamegraph.pl and speedscope read directly. Threads waiting on a lock
+    or in a C call such as a socket read or an SQLite query are sampled at the Python frame that
+    made the call, so waiting shows up as well as running. Only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = 0
+
+    def profile(self, seconds=PROFILE_SECONDS, hz=SAMPLE_HZ):
+        """Samples for seconds. Returns a Counter of collapsed stack -> samples, or None if busy."""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(seconds, hz)
+        finally:
+            self.lock.release()
+
+    def _sample(self, seconds, hz):
+        me = threading.get_ident()
+        stacks = Counter()
+        interval = 1 / hz
+        deadline = time.perf_counter() + seconds
+        next_sample = time.perf_counter()
+        while next_sample < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+            now = time.perf_counter()
+            next_sample = max(next_sample + interval, now)  # samples missed under load are skipped
+            time.sleep(next_sample - now)
+        return stacks
+
+
+def collapsed(stacks):
+    """Collapsed-stack text, one "stack count" line per distinct stack, most sampled first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
@@ -0,0 +1,35 @@
+def replay_stream(hl7_messages, db, parser, predictor, on_message=None):
+    """Replays messages one at a time: parse, write, fetch and predict, as main_simulator does.
+
+    Results for patients without PAS data, with a blank date, or already stored, are not scored.
+    Returns (seq, mrn, epoch timestamp) for every positive prediction, seq being the message position.
+    """
+    outputs = []
+    for seq, message in enumerate(hl7_messages):
+        msg, fields, _ = parser.parse(message.decode("utf-8"))
+        if on_message is not None:
+            on_message(msg)
+
+        if msg == "PAS_admit":
+            db.write_pas_data(fields.mrn, fields.dob, fields.sex)
+        elif msg == "LIMS":
+            new_results = [r for r in fields.results if db.write_lims_data(r.mrn, r.date, r.value)]
+            for result in new_results:
+                if result.date is None:
+                    continue
+                data = db.fetch_data(result.mrn, result.date)
+                if data is None:
+                    continue  # no PAS data for this patient yet
+                y_pred, latest_date = predictor.predict(data, count=True)
+                if y_pred == 1:
+                    outputs.append((seq, result.mrn, latest_date))
+    return outputs
+
+
+def message_mrn(message):
+    """Reads PID-3 straight from the raw message bytes, without parsing it. Returns None if absent."""
+    for segment in message.split(b"\r"):
+        if segment.startswith(b"PID|"):
+            fields = segment.split(b"|")
+            return fields[3].decode("utf-8") if len(fields) > 3 else None
+    return None
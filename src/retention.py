@@ -0,0 +1,65 @@
+import time
+import logging
+from threading import Thread
+
+
+RETENTION_DAYS = 90
+COMPACTION_BATCH_SIZE = 50
+COMPACTION_INTERVAL_SECONDS = 60
+
+
+class RetentionCompactor:
+    """Background thread that keeps raw blood test results for a retention window only.
+
+    Older results are folded, one patient per transaction, into the per-patient summaries
+    kept by Database.compact_patient, so ingest only ever waits for a single small write.
+    The window is measured against the newest result timestamp rather than the wall clock,
+    which keeps replays of old feeds correct.
+    """
+
+    def __init__(self, db, target=None, window_days=RETENTION_DAYS,
+                 batch_size=COMPACTION_BATCH_SIZE, interval=COMPACTION_INTERVAL_SECONDS):
+        self.db = db
+        self.target = db if target is None else target  # a PatientCache also drops compacted results from memory
+        self.window = window_days * 86400  # seconds
+        self.batch_size = batch_size
+        self.interval = interval
+        self.compacted_patients = 0
+        self.logger = logging.getLogger(__name__)
+
+    def cutoff(self):
+        latest = self.db.latest_timestamp()
+        if latest is None:
+            return None
+        return latest - self.window
+
+    def run_once(self):
+        """Compacts up to batch_size patients. Returns how many were compacted."""
+        cutoff = self.cutoff()
+        if cutoff is None:
+            return 0
+
+        compacted = 0
+        for mrn in self.db.compaction_candidates(cutoff, self.batch_size):
+            if self.target.compact_patient(mrn, cutoff) is not None:
+                compacted += 1
+        self.compacted_patients += compacted
+        return compacted
+
+    def run(self):
+        self.db.pool.claim_writer()
+        while True:
+            try:
+                compacted = self.run_once()
+            except Exception as e:
+                self.logger.warning(f"Blood test compaction failed: {e}")
+                compacted = 0
+            if compacted:
+                self.logger.info(f"Compacted blood test history of {compacted} patients")
+            if compacted < self.batch_size:
+                time.sleep(self.interval)
+
+    def start(self):
+        thread = Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
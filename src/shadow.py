@@ -0,0 +1,80 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+
+SHADOW_QUEUE_SIZE = 1000
+SHADOW_MAX_SHARE = 0.2
+
+
+class ShadowLane:
+    """Scores LIMS results with candidate models off the critical path. Never pages.
+
+    The ingest thread calls submit, which only enqueues without blocking; when the bounded
+    queue is full the result is dropped from shadow evaluation and counted. A single worker
+    thread scores each queued result with every candidate and reports, per candidate, whether
+    it agreed with production, how long it took and how far its AKI probability was from
+    production's through on_result(name, agreed, seconds, divergence).
+
+    The worker shares the GIL with ingest, so its overhead is budgeted: after each result it
+    sleeps long enough to stay busy at most max_share of the wall-clock time, and falls
+    behind (and drops) rather than slowing ACKs.
+    """
+
+    def __init__(self, candidates, on_result, queue_size=SHADOW_QUEUE_SIZE, max_share=SHADOW_MAX_SHARE):
+        self.candidates = candidates  # name -> predictor
+        self.on_result = on_result
+        self.max_share = max_share
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.scored = 0
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_paths(cls, paths, load, on_result, **kwargs):
+        return cls({os.path.basename(path): load(path) for path in paths}, on_result, **kwargs)
+
+    def submit(self, data, predictor, y_pred):
+        """Queues a result production has scored with predictor. Never blocks."""
+        try:
+            self.queue.put_nowait((data, predictor, y_pred))
+        except queue.Full:
+            self.dropped += 1
+
+    @staticmethod
+    def _probability(predictor, data):
+        x, _ = predictor.preprocess_and_transform(data)
+        return predictor.model.predict_proba(x[None, :])[0, 1]
+
+    def evaluate(self, data, predictor, y_pred):
+        production_probability = None
+        for name, candidate in self.candidates.items():
+            start = time.perf_counter()
+            candidate_pred, _ = candidate.predict(data)
+            seconds = time.perf_counter() - start
+
+            divergence = None
+            if hasattr(candidate.model, "predict_proba") and hasattr(predictor.model, "predict_proba"):
+                if production_probability is None:
+                    production_probability = self._probability(predictor, data)
+                divergence = abs(self._probability(candidate, data) - production_probability)
+            self.on_result(name, candidate_pred == y_pred, seconds, divergence)
+        self.scored += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            start = time.perf_counter()
+            try:
+                self.evaluate(*item)
+            except Exception as e:
+                self.logger.warning(f"Shadow evaluation failed: {e}")
+            busy = time.perf_counter() - start
+            time.sleep(busy * (1 - self.max_share) / self.max_share)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,226 @@
+import time
+import bisect
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque
+
+
+VIRTUAL_NODES = 64
+SHARD_WINDOW = 1
+ACK_TIMEOUT_SECONDS = 10
+MLLP_START = b"\x0b"
+MLLP_END = b"\x1c\x0d"
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of MRNs onto shards 0..shards-1.
+
+    Each shard owns vnodes points on a 64-bit ring and an MRN belongs to the shard owning the
+    first point after the MRN's hash. Growing from N to N + 1 shards moves about 1/(N + 1) of
+    the MRNs, all of them to the new shard. Messages without a numeric MRN go to shard 0.
+    """
+
+    def __init__(self, shards, vnodes=VIRTUAL_NODES):
+        points = sorted((_hash(f"shard-{shard}-{i}"), shard) for shard in range(shards) for i in range(vnodes))
+        self.shards = shards
+        self.points = [point for point, _ in points]
+        self.owners = [shard for _, shard in points]
+
+    def owner(self, mrn):
+        mrn = str(mrn).strip()
+        if not mrn.isdigit():
+            return 0
+        i = bisect.bisect_right(self.points, _hash(str(int(mrn))))
+        return self.owners[i % len(self.owners)]
+
+
+class Journal:
+    """Messages acknowledged to the sender but not yet to their shard, in an SQLite file.
+
+    The router acknowledges a message once it is committed here, so a message is never lost
+    between the sender and a shard: the journal is replayed when the router restarts.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS journal (id INTEGER PRIMARY KEY AUTOINCREMENT, message BLOB)")
+        self.conn.commit()
+
+    def append(self, message):
+        with self.lock:
+            id = self.conn.execute("INSERT INTO journal (message) VALUES (?)", (message,)).lastrowid
+            self.conn.commit()
+            return id
+
+    def remove(self, id):
+        with self.lock:
+            self.conn.execute("DELETE FROM journal WHERE id=?", (id,))
+            self.conn.commit()
+
+    def pending(self):
+        """(id, message) of every message still to be delivered, oldest first."""
+        with self.lock:
+            return [(id, bytes(message)) for id, message in self.conn.execute("SELECT id, message FROM journal ORDER BY id")]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ShardLink:
+    """Forwards one shard's messages to its engine and matches the engine's ACKs to them.
+
+    The engine connects to listener exactly as it would to the hospital's sender. Up to window
+    messages are sent ahead of their ACKs, which are matched in order; each acknowledged message
+    is removed from the journal. A message the engine rejects (MSA other than AA) is sent again.
+    If the connection drops, or the oldest message waits for its ACK longer than ack_timeout,
+    the connection is closed and every unacknowledged message is sent again once the engine
+    reconnects. Engines drop results resent this way, so nothing is paged twice.
+
+    Matching in order requires the engine to acknowledge every message it receives. It does,
+    except when storing one fails; with the default window of 1, such a message is simply sent
+    again after the timeout.
+    """
+
+    def __init__(self, shard, listener, journal, new_receiver, window=SHARD_WINDOW, ack_timeout=ACK_TIMEOUT_SECONDS):
+        self.shard = shard
+        self.listener = listener
+        self.journal = journal
+        self.new_receiver = new_receiver  # () -> MLLP receiver, see mllp.MLLPReceiver
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.cond = threading.Condition()
+        self.queue = deque()  # (id, message) not sent yet
+        self.in_flight = deque()  # (id, message, sent at) waiting for their ACK
+        self.connected = False
+        self.forwarded = 0
+        self.acknowledged = 0
+        self.resent = 0
+        self.connections = 0
+        self.logger = logging.getLogger(__name__)
+
+    def put(self, id, message):
+        with self.cond:
+            self.queue.append((id, message))
+            self.cond.notify_all()
+
+    def depth(self):
+        return len(self.queue) + len(self.in_flight)
+
+    def run(self):
+        while True:
+            sock, address = self.listener.accept()
+            self.connections += 1
+            self.logger.info(f"Shard {self.shard} engine connected from {address[0]}:{address[1]}")
+            try:
+                self.serve(sock)
+            except Exception as e:
+                self.logger.warning(f"Shard {self.shard} connection failed: {e}")
+            finally:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)  # wakes up the ACK reader
+                except OSError:
+                    pass
+                sock.close()
+                with self.cond:
+                    self.connected = False
+                    self.resent += len(self.in_flight)
+                    self.queue.extendleft(reversed([(id, message) for id, message, _ in self.in_flight]))
+                    self.in_flight.clear()
+
+    def serve(self, sock):
+        with self.cond:
+            self.connected = True
+        reader = threading.Thread(target=self.read_acks, args=(sock,), daemon=True)
+        reader.start()
+        while True:
+            with self.cond:
+                while not self.queue or len(self.in_flight) >= self.window:
+                    if not self.connected:
+                        return
+                    if self.in_flight and time.monotonic() - self.in_flight[0][2] > self.ack_timeout:
+                        raise TimeoutError(f"no ACK within {self.ack_timeout}s")
+                    self.cond.wait(self.ack_timeout / 10 if self.in_flight else None)
+                if not self.connected:
+                    return
+                id, message = self.queue.popleft()
+                self.in_flight.append((id, message, time.monotonic()))
+            sock.sendall(MLLP_START + message + MLLP_END)
+            self.forwarded += 1
+
+    def read_acks(self, sock):
+        receiver = self.new_receiver()
+        try:
+            while True:
+                for frame in receiver.receive(sock):
+                    accepted = b"MSA|AA" in bytes(frame)
+                    receiver.release()
+                    with self.cond:
+                        if not self.in_flight:
+                            continue  # an ACK for a message sent on an earlier connection
+                        id, message, _ = self.in_flight.popleft()
+                        if not accepted:
+                            self.queue.appendleft((id, message))
+                        self.cond.notify_all()
+                    if accepted:
+                        self.journal.remove(id)
+                        self.acknowledged += 1
+                    else:
+                        self.logger.warning(f"Shard {self.shard} rejected a message, sending it again")
+        except Exception:
+            pass
+        finally:
+            with self.cond:
+                self.connected = False
+                self.cond.notify_all()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+
+class Router:
+    """Routes framed messages from the sender to the shard owning their MRN.
+
+    route() journals the message and queues it on its shard's link; the caller acknowledges
+    the sender once it returns. Messages left in the journal by a previous run are queued again
+    by restore(), on the shard owning them now, so the shard count may change between runs.
+    """
+
+    def __init__(self, ring, journal, links, message_mrn):
+        self.ring = ring
+        self.journal = journal
+        self.links = links
+        self.message_mrn = message_mrn  # raw message bytes -> MRN, or None
+        self.routed = [0] * len(links)
+
+    def route(self, message):
+        shard = self.ring.owner(self.message_mrn(message))
+        id = self.journal.append(message)
+        self.links[shard].put(id, message)
+        self.routed[shard] += 1
+        return shard
+
+    def restore(self):
+        pending = self.journal.pending()
+        for id, message in pending:
+            self.links[self.ring.owner(self.message_mrn(message))].put(id, message)
+        return len(pending)
+
+    def start(self):
+        return [link.start() for link in self.links]
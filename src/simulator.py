@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import datetime
 import http.server
+import math
+import random
 import signal
 import socket
 import threading
@@ -20,7 +23,7 @@ MLLP_BUFFER_SIZE = 1024
 MLLP_TIMEOUT_SECONDS = 10
 SHUTDOWN_POLL_INTERVAL_SECONDS = 2
 
-def serve_mllp_client(client, source, messages, shutdown_mllp, short_messages):
+def serve_mllp_client(client, source, messages, shutdown_mllp, short_messages, recorder=None):
     i = 0
     buffer = b""
     while i < len(messages) and not shutdown_mllp.is_set():
@@ -28,6 +31,8 @@ def serve_mllp_client(client, source, messages, shutdown_mllp, short_messages):
             mllp = bytes(chr(MLLP_START_OF_BLOCK), "ascii")
             mllp += messages[i]
             mllp += bytes(chr(MLLP_END_OF_BLOCK) + chr(MLLP_CARRIAGE_RETURN), "ascii")
+            if recorder:
+                recorder.record(f"{time.time():.6f}", i, *message_fields(messages[i]))
             if not short_messages:
                 client.sendall(mllp)
             else:
@@ -76,7 +81,7 @@ def verify_ack(messages):
         return False, "Wrong number of fields in MSA segment"
     return fields[HL7_MSA_ACK_CODE_FIELD] == HL7_MSA_ACK_CODE_ACCEPT, None
 
-def run_mllp_server(host, port, hl7_messages, shutdown_mllp, short_messages):
+def run_mllp_server(host, port, hl7_messages, shutdown_mllp, short_messages, recorder=None):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((host, port))
@@ -91,7 +96,7 @@ def run_mllp_server(host, port, hl7_messages, shutdown_mllp, short_messages):
             source = f"{host}:{port}"
             print(f"mllp: {source}: accepted connection")
             client.settimeout(MLLP_TIMEOUT_SECONDS)
-            t = threading.Thread(target=serve_mllp_client, args=(client, source, hl7_messages, shutdown_mllp, short_messages), daemon=True)
+            t = threading.Thread(target=serve_mllp_client, args=(client, source, hl7_messages, shutdown_mllp, short_messages, recorder), daemon=True)
             t.start()
         print("mllp: graceful shutdown")
 
@@ -129,6 +134,33 @@ def read_hl7_messages(filename):
                 raise Exception(f"{filename}: Unexpected data at end of file")
         return messages
 
+def parse_page(body):
+    """Returns (mrn, timestamp or None, error or None) for the body of a /page request."""
+    error = None
+    mrn = None
+    timestamp = None
+    parts = str(body, "ascii").split(",")
+    if len(parts) < 3:
+        mrn = 0
+        try:
+            mrn = int(parts[0])
+        except:
+            error = "bad MRN in body"
+        if not error and len(parts) == 2:
+            try:
+                timestamp = datetime.datetime.strptime(parts[1], "%Y%m%d%H%M%S")
+            except:
+                error = "bad timestamp in body"
+    else:
+        error = "expected at most two values: mrn,timestamp"
+    return mrn, timestamp, error
+
+def print_page(mrn, timestamp):
+    if timestamp:
+        print(f"pager: paging for MRN {mrn} at {timestamp}")
+    else:
+        print(f"pager: paging for MRN {mrn}")
+
 class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
 
     def __init__(self, shutdown, *args, **kwargs):
@@ -160,32 +192,13 @@ class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
             self.send_response(http.HTTPStatus.BAD_REQUEST, "No Content-Length")
             self.end_headers()
             return
-        error = None
-        mrn = None
-        timestamp = None
-        parts = str(self.rfile.read(length), "ascii").split(",")
-        if len(parts) < 3:
-            mrn = 0
-            try:
-                mrn = int(parts[0])
-            except:
-                error = "bad MRN in body"
-            if not error and len(parts) == 2:
-                try:
-                    timestamp = datetime.datetime.strptime(parts[1], "%Y%m%d%H%M%S")
-                except:
-                    error = "bad timestamp in body"
-        else:
-            error = "expected at most two values: mrn,timestamp"
+        mrn, timestamp, error = parse_page(self.rfile.read(length))
         if error:
                 print("pager: " + error)
                 self.send_response(http.HTTPStatus.BAD_REQUEST, error)
                 self.end_headers()
                 return
-        if timestamp:
-            print(f"pager: paging for MRN {mrn} at {timestamp}")
-        else:
-            print(f"pager: paging for MRN {mrn}")
+        print_page(mrn, timestamp)
         self.send_response(http.HTTPStatus.OK)
         self.send_header("Content-Type", "text/plain")
         self.end_headers()
@@ -207,16 +220,206 @@ class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
     def log_message(*args):
         pass # Prevent default logging
 
+LATENCY_DISTRIBUTIONS = {
+    "fixed": lambda rng, seconds: seconds,
+    "uniform": lambda rng, low, high: rng.uniform(low, high),
+    "exponential": lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0,
+    "lognormal": lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma),
+}
+
+def parse_latency(spec):
+    """Parses "fixed:S", "uniform:LOW,HIGH", "exponential:MEAN" or "lognormal:MEDIAN,SIGMA", in seconds."""
+    name, _, args = spec.partition(":")
+    if name not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"unknown latency distribution {name!r}: want one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+    args = [float(a) for a in args.split(",")] if args else []
+    distribution = LATENCY_DISTRIBUTIONS[name]
+    distribution(random.Random(0), *args) # fails now on the wrong number of arguments
+    return lambda rng: distribution(rng, *args)
+
+def parse_outage(spec):
+    """Parses "START-END", in seconds since the pager started."""
+    start, _, end = spec.partition("-")
+    start, end = float(start), float(end)
+    if end <= start:
+        raise ValueError(f"outage {spec!r} ends before it starts")
+    return start, end
+
+class CsvRecorder:
+    """Appends rows to a CSV file, from any thread, for load tests to analyse afterwards."""
+
+    def __init__(self, filename, header):
+        self.lock = threading.Lock()
+        self.file = open(filename, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+
+    def record(self, *row):
+        with self.lock:
+            self.writer.writerow(row)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+PAGE_RECORD_HEADER = ["received_at", "mrn", "timestamp", "status"]
+MESSAGE_RECORD_HEADER = ["sent_at", "index", "type", "mrn"]
+
+def message_fields(message):
+    """(type, MRN) of a raw HL7 message, e.g. ("ORU^R01", "478237423"), blank where absent."""
+    fields = {}
+    for segment in message.split(b"\r"):
+        values = segment.split(b"|")
+        if values[0] in (b"MSH", b"PID") and values[0] not in fields:
+            fields[values[0]] = values
+    msh, pid = fields.get(b"MSH", []), fields.get(b"PID", [])
+    return (str(msh[8], "ascii", "replace") if len(msh) > 8 else "",
+            str(pid[3], "ascii", "replace") if len(pid) > 3 else "")
+
+class AsyncPager:
+    """The pager on one asyncio event loop, for load tests: --pager_mode=async.
+
+    Connections are kept alive between requests (HTTP/1.1, or HTTP/1.0 asking for keep-alive),
+    so one thread serves any number of clients and requests without a thread each. Every /page
+    request is delayed by a draw from latency(rng), fails with 500 with probability error_rate,
+    and gets no response at all, its connection closed, while now falls in one of the outages
+    (start, end) in seconds since the pager started. Pages are printed unless quiet, and if
+    recorder is given each /page request is recorded as PAGE_RECORD_HEADER: the epoch seconds it
+    arrived, its MRN and timestamp, and the status sent back or "dropped" during an outage.
+    Has the serve_forever and shutdown of http.server, so main() runs either pager the same way.
+    """
+
+    def __init__(self, address, shutdown, latency=None, error_rate=0, outages=(), recorder=None, quiet=False, seed=None):
+        self.address = address
+        self.on_shutdown = shutdown
+        self.latency = latency
+        self.error_rate = error_rate
+        self.outages = list(outages)
+        self.recorder = recorder
+        self.quiet = quiet
+        self.rng = random.Random(seed)
+        self.loop = asyncio.new_event_loop()
+        self.started = time.monotonic()
+        self.stopped = asyncio.Event()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.serve_client, *address))
+        self.server_address = self.server.sockets[0].getsockname()
+
+    def serve_forever(self, poll_interval=None):
+        try:
+            self.loop.run_until_complete(self.stopped.wait())
+        finally:
+            self.server.close()
+            if self.recorder:
+                self.recorder.close()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+    def in_outage(self):
+        now = time.monotonic() - self.started
+        return any(start <= now < end for start, end in self.outages)
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                request = await read_http_request(reader)
+                if request is None:
+                    break
+                method, path, keep_alive, body = request
+                if path == "/page":
+                    status, keep_alive = await self.page(body, keep_alive)
+                    if status is None:
+                        break
+                elif path == "/healthy":
+                    status = http.HTTPStatus.OK
+                elif path == "/shutdown":
+                    status, keep_alive = http.HTTPStatus.OK, False
+                    self.on_shutdown()
+                else:
+                    print("pager: bad request: not /page")
+                    status = http.HTTPStatus.BAD_REQUEST
+                body = b"ok\n" if status == http.HTTPStatus.OK else b""
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Server: coursework3-simulator/{VERSION}\r\n"
+                    f"Content-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("ascii") + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def page(self, body, keep_alive):
+        """Returns (HTTP status or None to drop the connection, keep_alive)."""
+        received_at = time.time()
+        try:
+            mrn, timestamp, error = parse_page(body)
+        except UnicodeDecodeError:
+            mrn, timestamp, error = None, None, "bad MRN in body"
+        if error:
+            print("pager: " + error)
+            return http.HTTPStatus.BAD_REQUEST, keep_alive
+        if self.in_outage():
+            self.record(received_at, mrn, timestamp, "dropped")
+            return None, False
+        if self.latency:
+            await asyncio.sleep(self.latency(self.rng))
+        if self.rng.random() < self.error_rate:
+            self.record(received_at, mrn, timestamp, http.HTTPStatus.INTERNAL_SERVER_ERROR.value)
+            return http.HTTPStatus.INTERNAL_SERVER_ERROR, keep_alive
+        if not self.quiet:
+            print_page(mrn, timestamp)
+        self.record(received_at, mrn, timestamp, http.HTTPStatus.OK.value)
+        return http.HTTPStatus.OK, keep_alive
+
+    def record(self, received_at, mrn, timestamp, status):
+        if self.recorder:
+            self.recorder.record(f"{received_at:.6f}", mrn, timestamp.strftime("%Y%m%d%H%M%S") if timestamp else "", status)
+
+async def read_http_request(reader):
+    """Reads one request. Returns (method, path, keep_alive, body), or None at end of stream."""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, version = str(line, "ascii").split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = str(line, "ascii").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    return method, path.split("?")[0], keep_alive, body
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--messages", default="messages.mllp", help="HL7 messages to replay, in MLLP format")
     parser.add_argument("--mllp", default=8440, type=int, help="Port on which to replay HL7 messages via MLLP")
     parser.add_argument("--pager", default=8441, type=int, help="Post on which to listen for pager requests via HTTP")
     parser.add_argument("--short_messages", default=False, action="store_true", help="Encourage all outgoing messages to be split in two")
+    parser.add_argument("--mllp_record", default=None, help="CSV file recording when each message was sent, with its type and MRN")
+    parser.add_argument("--pager_mode", default="threaded", choices=["threaded", "async"],
+                        help="threaded: a thread per request; async: one event loop with keep-alive, for load tests")
+    parser.add_argument("--pager_latency", default=None, type=parse_latency,
+                        help="async only: delay before answering each page, e.g. fixed:0.05, uniform:0,0.2, exponential:0.05 or lognormal:0.05,0.5")
+    parser.add_argument("--pager_error_rate", default=0, type=float, help="async only: fraction of pages answered with 500")
+    parser.add_argument("--pager_outage", default=[], type=parse_outage, action="append",
+                        help="async only: START-END seconds after startup during which pages get no response; repeatable")
+    parser.add_argument("--pager_record", default=None, help="async only: CSV file recording every page with the time it arrived")
+    parser.add_argument("--pager_quiet", default=False, action="store_true", help="async only: do not print each page")
+    parser.add_argument("--pager_seed", default=None, type=int, help="async only: seed for latency and error draws")
     flags = parser.parse_args()
     hl7_messages = read_hl7_messages(flags.messages)
     shutdown_event = threading.Event()
-    mllp_thread = threading.Thread(target=run_mllp_server, args=("0.0.0.0", flags.mllp, hl7_messages, shutdown_event, flags.short_messages), daemon=True)
+    message_recorder = CsvRecorder(flags.mllp_record, MESSAGE_RECORD_HEADER) if flags.mllp_record else None
+    mllp_thread = threading.Thread(target=run_mllp_server, args=("0.0.0.0", flags.mllp, hl7_messages, shutdown_event, flags.short_messages, message_recorder), daemon=True)
     mllp_thread.start()
     pager = None
     def shutdown():
@@ -226,12 +429,19 @@ def main():
     signal.signal(signal.SIGTERM, lambda signal, frame: shutdown())
     def new_pager_handler(*args, **kwargs):
         return PagerRequestHandler(shutdown, *args, **kwargs)
-    pager = http.server.ThreadingHTTPServer(("0.0.0.0", flags.pager), new_pager_handler)
+    if flags.pager_mode == "async":
+        recorder = CsvRecorder(flags.pager_record, PAGE_RECORD_HEADER) if flags.pager_record else None
+        pager = AsyncPager(("0.0.0.0", flags.pager), shutdown, flags.pager_latency, flags.pager_error_rate,
+                           flags.pager_outage, recorder, flags.pager_quiet, flags.pager_seed)
+    else:
+        pager = http.server.ThreadingHTTPServer(("0.0.0.0", flags.pager), new_pager_handler)
     print(f"pager: listening on 0.0.0.0:{flags.pager}")
     pager_thread = threading.Thread(target=pager.serve_forever, args=(), kwargs={"poll_interval": SHUTDOWN_POLL_INTERVAL_SECONDS}, daemon=True)
     pager_thread.start()
     mllp_thread.join()
     pager_thread.join()
+    if message_recorder:
+        message_recorder.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from src.alerts import AlertManager
+from src.database import timestamp_to_epoch
+
+
+HOUR = 3600
+
+
+class TestAlertManager(unittest.TestCase):
+
+    def setUp(self):
+        self.sent, self.fail = [], False
+        self.alerts = AlertManager(self.send, window_hours=48, retry_seconds=0.01)
+        self.onset = timestamp_to_epoch("2024-04-01 10:00:00")
+
+    def send(self, pager_data):
+        if self.fail:
+            raise OSError("pager unreachable")
+        self.sent.append(pager_data)
+
+    def test_sustained_aki_pages_once(self):
+        for hours in (0, 6, 12, 50):
+            self.alerts.raise_alert("185620675", self.onset + hours * HOUR)
+        self.alerts.deliver_pending()
+        self.assertEqual(self.sent, [b"185620675,20240401100000"])
+        self.assertEqual(self.alerts.suppressed, 3)
+
+    def test_new_event_after_window(self):
+        self.alerts.raise_alert("185620675", self.onset)
+        self.assertTrue(self.alerts.raise_alert("185620675", self.onset + 49 * HOUR))
+        self.alerts.raise_alert("157828764", self.onset)
+        self.alerts.deliver_pending()
+        self.assertEqual(self.alerts.delivered, 2)
+        self.assertEqual(self.alerts.coalesced, 1)
+
+    def test_failed_delivery_retried_in_order(self):
+        self.fail = True
+        self.alerts.raise_alert("185620675", self.onset)
+        self.alerts.raise_alert("157828764", self.onset)
+        self.alerts.start()
+        time.sleep(0.05)
+        self.assertEqual(len(self.alerts.pending), 2)
+        self.fail = False
+        deadline = time.time() + 5
+        while self.alerts.pending and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.sent, [b"185620675,20240401100000", b"157828764,20240401100000"])
+
+    def test_state_round_trip(self):
+        self.fail = True
+        self.alerts.raise_alert("185620675", self.onset)
+        self.alerts.deliver_pending()
+
+        restarted = AlertManager(self.send)
+        restarted.restore(self.alerts.state())
+        self.assertFalse(restarted.raise_alert("185620675", self.onset + 1 * HOUR))
+        self.fail = False
+        restarted.deliver_pending()
+        self.assertEqual(self.sent, [b"185620675,20240401100000"])
+
+
+if __name__ == "__main__":
+    unittest.main()
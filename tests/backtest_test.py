@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from backtest import save_history_snapshot, _init_worker, replay_shard, in_shard
+from src.database import Database
+from src.parser import SplitHL7MessageParser
+from src.replay import replay_stream, message_mrn
+from src.simulator import MLLP_START_OF_BLOCK, MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN, read_hl7_messages
+from model.model_class import AKIPredictor
+from tests.batch_test import MESSAGES
+
+
+class TestBacktest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = os.path.join(self.directory, "history.csv")
+        with open(self.history, "w") as f:
+            f.write("mrn,creatinine_date_0,creatinine_result_0,creatinine_date_1,creatinine_result_1\n")
+            f.write("185620675,2024-01-01 15:13:00,126.48,2024-02-05 14:34:00,98.38\n")
+            f.write("157828764,2024-01-01 15:51:00,52.56,,\n")
+        self.messages = os.path.join(self.directory, "messages.mllp")
+        with open(self.messages, "wb") as f:
+            for message in MESSAGES:
+                f.write(bytes([MLLP_START_OF_BLOCK]) + message + bytes([MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN]))
+        save_history_snapshot(self.history, self.directory)
+        _init_worker(self.directory, "model/xgb_model.pkl", hl7apy=False)
+
+    def test_message_mrn(self):
+        self.assertEqual(message_mrn(MESSAGES[1]), "185620675")
+        self.assertIsNone(message_mrn(b"MSH|^~\\&|SIMULATION\r"))
+
+    def test_in_shard_strips_padded_mrn(self):
+        self.assertTrue(in_shard(" 185620675 ", 185620675 % 4, 4))
+        self.assertFalse(in_shard(" 185620675 ", 0, 4))
+        self.assertTrue(in_shard(None, 0, 4))
+        self.assertTrue(in_shard("12a", 0, 4))
+
+    def test_shards_merge_to_serial_replay(self):
+        db = Database(":memory:")
+        db.populate_history(self.history)
+        serial = replay_stream(
+            read_hl7_messages(self.messages), db, SplitHL7MessageParser(), AKIPredictor("model/xgb_model.pkl")
+        )
+        db.close()
+
+        pages, replayed = [], 0
+        for shard in range(3):
+            outputs, n_messages = replay_shard(self.messages, shard, 3)
+            pages += outputs
+            replayed += n_messages
+        self.assertEqual(replayed, len(MESSAGES))
+        self.assertEqual(sorted(pages, key=lambda page: page[0]), serial)
+        self.assertEqual(replay_shard(self.messages, 0, 1)[0], serial)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.batch import parse_messages, read_history, point_in_time_features, score, f_score, FEATURES
+from src.database import Database
+from src.parser import HL7MessageParser, SplitHL7MessageParser
+from model.model_class import AKIPredictor
+
+
+def admit(mrn, dob, sex):
+    return (
+        "MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240401000000||ADT^A01|||2.5\r"
+        f"PID|1||{mrn}||KAYLA HENRY||{dob}|{sex}\r"
+    ).encode()
+
+
+def result(mrn, *observations):
+    segments = [f"MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240401000000||ORU^R01|||2.5", f"PID|1||{mrn}"]
+    for date, value in observations:
+        segments += [f"OBR|1||||||{date}", f"OBX|1|SN|CREATININE||{value}"]
+    return ("\r".join(segments) + "\r").encode()
+
+
+MESSAGES = [
+    result("185620675", ("202404010900", "90.1")),  # no PAS data yet
+    admit("185620675", "19801106", "F"),
+    admit("157828764", "20010203", "M"),
+    result("185620675", ("202404011000", "75.0")),
+    result("157828764", ("202404011000", "230.5"), ("202404010800", "101.2")),  # out of order within a message
+    result("185620675", ("202404010930", "250.0")),  # older than the previous result
+    result("185620675", ("", "80.0")),  # blank date
+    result("185620675", ("202404011000", "260.2")),  # same timestamp as an earlier result
+    result("185620675", ("202404011000", "260.2")),  # resent after a reconnect
+    b"MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240401000000||ADT^A03|||2.5\rPID|1||185620675\r",
+    result("157828764", ("202404020800", "99.0")),
+]
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = os.path.join(self.directory, "history.csv")
+        with open(self.history, "w") as f:
+            f.write("mrn,creatinine_date_0,creatinine_result_0,creatinine_date_1,creatinine_result_1\n")
+            f.write("185620675,2024-01-01 15:13:00,126.48,2024-02-05 14:34:00,98.38\n")
+            f.write("157828764,2024-01-01 15:51:00,52.56,,\n")
+        self.predictor = AKIPredictor("model/xgb_model.pkl")
+
+    def stream_features(self, messages=MESSAGES):
+        db = Database(":memory:")
+        db.populate_history(self.history)
+        parser = HL7MessageParser()
+        features = []
+        for message in messages:
+            msg, fields, _ = parser.parse(message.decode("utf-8"))
+            if msg == "PAS_admit":
+                db.write_pas_data(fields.mrn, fields.dob, fields.sex)
+            elif msg == "LIMS":
+                new_results = [r for r in fields.results if db.write_lims_data(r.mrn, r.date, r.value)]
+                for r in new_results:
+                    data = db.fetch_data(r.mrn, r.date) if r.date is not None else None
+                    if data is not None:
+                        features.append(self.predictor.preprocess_and_transform(data)[0])
+        db.close()
+        return np.asarray(features)
+
+    def test_features_match_streaming_path(self):
+        admits, results = parse_messages(MESSAGES, SplitHL7MessageParser())
+        features = point_in_time_features(admits, results, read_history(self.history))
+        np.testing.assert_array_equal(features[FEATURES].to_numpy(dtype=np.float64), self.stream_features())
+
+    def test_same_timestamp_ordered_by_arrival(self):
+        messages = [
+            admit("185620675", "19801106", "F"),
+            result("185620675", ("202404011000", "300.0")),
+            result("185620675", ("202404011000", "90.0")),  # lower, at the same timestamp
+            result("185620675", ("202404011200", "310.0"), ("202404011200", "95.0")),  # within a message
+        ]
+        admits, results = parse_messages(messages, SplitHL7MessageParser())
+        features = point_in_time_features(admits, results, read_history(self.history))
+        self.assertEqual(features["latest"].tolist(), [300.0, 90.0, 95.0, 95.0])
+        np.testing.assert_array_equal(features[FEATURES].to_numpy(dtype=np.float64), self.stream_features(messages))
+
+    def test_split_parser_matches_hl7apy(self):
+        for message in MESSAGES:
+            message = message.decode("utf-8")
+            self.assertEqual(SplitHL7MessageParser().parse(message), HL7MessageParser().parse(message))
+
+    def test_score_in_one_call(self):
+        admits, results = parse_messages(MESSAGES, SplitHL7MessageParser())
+        scored = score(point_in_time_features(admits, results, read_history(self.history)), self.predictor)
+        expected = self.predictor.model.predict(self.stream_features())
+        np.testing.assert_array_equal(scored["prediction"].to_numpy(), expected)
+
+    def test_f_score(self):
+        self.assertEqual(f_score([(1, "a")], [(1, "a")]), 1.0)
+        self.assertEqual(f_score([(1, "a")], [(2, "a")]), 0.0)
+        self.assertAlmostEqual(f_score([(1, "a"), (2, "a")], [(1, "a")]), 10 / 11)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from threading import Thread
+
+from src.database import Database, iter_history, timestamp_to_epoch as epoch
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.directory, "aki.db"))
+
+    def test_fetch_data_joins_latest_pas_row(self):
+        self.db.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+        self.db.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 0)
+        self.db.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.2")
+        self.db.write_lims_data("185620675", epoch("2024-03-30 10:00:00"), "75.0")
+        self.db.write_lims_data("157828764", epoch("2024-03-30 11:00:00"), "99.0")
+
+        data = self.db.fetch_data("185620675", epoch("2024-03-31 00:54:00"))
+        self.assertEqual(data["sex"], 0)
+        self.assertEqual(data["dates"], [epoch("2024-03-30 10:00:00"), epoch("2024-03-31 00:54:00")])
+        self.assertEqual(data["creatinine_levels"], [75.0, 81.2])
+        self.assertEqual(self.db.count_patients(), 1)  # 157828764 has results only
+
+    def test_fetch_data_without_results(self):
+        self.db.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+        data = self.db.fetch_data("185620675", epoch("2024-03-31 00:54:00"))
+        self.assertEqual(data["dates"], [])
+        self.assertIsNone(self.db.fetch_data("157828764", epoch("2024-03-31 00:54:00")))
+
+    def test_transaction_rolls_back_all_writes(self):
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.2")
+                self.db.write_lims_data("185620675", epoch("2024-03-31 01:54:00"), "91.2")
+                raise RuntimeError
+        self.assertEqual(self.db.read_lims_data("185620675"), [])
+
+    def test_migrate_legacy(self):
+        pat_db_name = os.path.join(self.directory, "patients.db")
+        tests_db_name = os.path.join(self.directory, "blood_tests.db")
+        with sqlite3.connect(pat_db_name) as pat_db:
+            pat_db.execute("CREATE TABLE patients(mrn, dob, sex)")
+            pat_db.execute("INSERT INTO patients VALUES (185620675, '2021-11-06 00:00:00', 1)")
+        with sqlite3.connect(tests_db_name) as tests_db:
+            tests_db.execute("CREATE TABLE blood_tests(mrn, timestamp, creatinine_level)")
+            tests_db.execute("INSERT INTO blood_tests VALUES (185620675, '2024-03-31 00:54:00', 81.2)")
+
+        self.db.migrate_legacy(pat_db_name, tests_db_name)
+        self.assertTrue(self.db.db_exists)
+        self.assertEqual(
+            self.db.fetch_data("185620675", epoch("2024-04-01 00:00:00"))["creatinine_levels"], [81.2]
+        )
+
+    def test_readers_run_concurrently_with_writer(self):
+        self.db.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+        errors, results = [], []
+
+        def read():
+            try:
+                for _ in range(50):
+                    results.append(self.db.fetch_data("185620675", epoch("2024-04-01 00:00:00")))
+            except Exception as e:
+                errors.append(e)
+
+        readers = [Thread(target=read) for _ in range(6)]
+        for reader in readers:
+            reader.start()
+        for i in range(50):
+            self.db.write_lims_data("185620675", epoch(f"2024-03-31 00:{i:02d}:00"), "81.2")
+        for reader in readers:
+            reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 300)
+        self.assertLessEqual(self.db.pool.opened_readers, 4)
+
+    def test_writer_owned_by_claiming_thread(self):
+        self.db.pool.claim_writer()
+        errors = []
+
+        def write():
+            try:
+                self.db.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+            except RuntimeError as e:
+                errors.append(e)
+
+        writer = Thread(target=write)
+        writer.start()
+        writer.join()
+        self.assertEqual(len(errors), 1)
+        self.assertIsNone(self.db.read_pas_data("185620675"))
+
+    def test_duplicate_results_ignored(self):
+        self.assertTrue(self.db.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.2"))
+        self.assertFalse(self.db.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.2"))
+        self.assertTrue(self.db.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.3"))
+        self.assertEqual(len(self.db.read_lims_data("185620675")), 2)
+
+    def test_migration_removes_duplicates(self):
+        db_name = os.path.join(self.directory, "v2.db")
+        with sqlite3.connect(db_name) as conn:
+            conn.execute("CREATE TABLE patients(mrn, dob, sex)")
+            conn.execute("CREATE TABLE blood_tests(mrn, timestamp, creatinine_level)")
+            conn.execute("CREATE INDEX blood_tests_mrn_timestamp ON blood_tests(mrn, timestamp)")
+            conn.execute("CREATE TABLE blood_test_summaries(mrn PRIMARY KEY, count, min, sketch, compacted_until)")
+            conn.execute("INSERT INTO patients VALUES (185620675, '2021-11-06 00:00:00', 1)")
+            conn.executemany("INSERT INTO blood_tests VALUES (?, ?, ?)", [
+                (185620675, "2024-03-31 00:54:00", 81.2),
+                (185620675, "2024-03-31 00:54:00", 81.2),
+                (185620675, "2024-03-31 01:54:00", 81.2),
+                (185620675, " ", 90.0),  # blank OBR-7 date
+            ])
+            conn.execute("PRAGMA user_version = 2")
+
+        db = Database(db_name)
+        self.assertEqual(db.removed_duplicates, 1)
+        self.assertEqual(db.read_pas_data("185620675"), (185620675, epoch("2021-11-06 00:00:00"), 1))
+        self.assertEqual(db.read_lims_data("185620675"), [
+            (185620675, epoch("2024-03-31 00:54:00"), 81.2), (185620675, epoch("2024-03-31 01:54:00"), 81.2),
+        ])
+        self.assertFalse(db.write_lims_data("185620675", epoch("2024-03-31 01:54:00"), "81.2"))
+        db.close()
+
+    def test_populate_history_streams_rows(self):
+        history = os.path.join(self.directory, "history.csv")
+        with open(history, "w") as f:
+            f.write("mrn,creatinine_date_0,creatinine_result_0,creatinine_date_1,creatinine_result_1\n")
+            f.write("185620675,2024-01-01 15:13:00,126.48,2024-02-05 14:34:00,98.38\n")
+            f.write("157828764,2024-01-01 15:51:00,52.56,,\n")
+        rows = list(iter_history(history))
+        self.assertEqual([row[:2] for row in rows], [
+            (185620675, epoch("2024-01-01 15:13:00")), (185620675, epoch("2024-02-05 14:34:00")), (157828764, epoch("2024-01-01 15:51:00")),
+        ])
+        self.assertAlmostEqual(rows[0][2], 126.48, places=4)
+
+        self.db.write_history(iter_history(history), chunk_size=2)
+        self.assertEqual([row[1:] for row in self.db.read_lims_data("185620675")], [row[1:] for row in rows[:2]])
+
+    def test_in_memory_database(self):
+        db = Database(":memory:")
+        db.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+        db.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.2")
+        self.assertEqual(db.fetch_data("185620675", epoch("2024-04-01 00:00:00"))["creatinine_levels"], [81.2])
+        db.close()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
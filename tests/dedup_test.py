@@ -0,0 +1,31 @@
+import unittest
+
+from src.dedup import DedupIndex
+from src.parser import Result
+from src.database import timestamp_to_epoch as epoch
+
+
+class TestDedupIndex(unittest.TestCase):
+
+    def test_seen_after_add(self):
+        dedup = DedupIndex()
+        key = DedupIndex.key(Result(185620675, epoch("2024-03-31 00:54:00"), 81.2))
+        self.assertFalse(dedup.seen(key))
+        dedup.add(key)
+        self.assertTrue(dedup.seen(key))
+        self.assertTrue(dedup.seen((185620675, epoch("2024-03-31 00:54:00"), 81.2)))
+        self.assertEqual(dedup.duplicates, 2)
+
+    def test_least_recently_seen_evicted(self):
+        dedup = DedupIndex(capacity=2)
+        dedup.add(1)
+        dedup.add(2)
+        dedup.seen(1)
+        dedup.add(3)
+        self.assertEqual(len(dedup), 2)
+        self.assertTrue(dedup.seen(1))
+        self.assertFalse(dedup.seen(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from benchmarks.harness import compare
+
+
+def stats(p50, p90):
+    return {"p50": p50, "p90": p90}
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_slower_beyond_threshold_and_baseline_p90(self):
+        rows = compare({"case": stats(100.0, 105.0)}, {"case": stats(120.0, 125.0)}, threshold=0.10)
+        self.assertEqual(rows, [("case", 100.0, 120.0, 1.2, True)])
+
+    def test_within_threshold(self):
+        rows = compare({"case": stats(100.0, 105.0)}, {"case": stats(109.0, 112.0)}, threshold=0.10)
+        self.assertFalse(rows[0][4])
+
+    def test_noisy_baseline_not_flagged(self):
+        # 20% slower, but still within the baseline's own p90
+        rows = compare({"case": stats(100.0, 130.0)}, {"case": stats(120.0, 125.0)}, threshold=0.10)
+        self.assertFalse(rows[0][4])
+
+    def test_faster_not_flagged(self):
+        rows = compare({"case": stats(100.0, 105.0)}, {"case": stats(50.0, 55.0)})
+        self.assertAlmostEqual(rows[0][3], 0.5)
+        self.assertFalse(rows[0][4])
+
+    def test_only_cases_in_both(self):
+        rows = compare({"a": stats(1.0, 1.0), "b": stats(1.0, 1.0)}, {"b": stats(1.0, 1.0), "c": stats(1.0, 1.0)})
+        self.assertEqual([row[0] for row in rows], ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
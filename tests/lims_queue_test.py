@@ -0,0 +1,43 @@
+import unittest
+
+from src.lims_queue import LIMSQueue
+from src.parser import Result
+
+
+def result(mrn):
+    return Result(mrn, 1711843200, 90.0)
+
+
+class TestLIMSQueue(unittest.TestCase):
+
+    def test_append_drops_oldest_when_full(self):
+        queue = LIMSQueue(2)
+        self.assertFalse(queue.append(result(1)))
+        self.assertFalse(queue.append(result(2)))
+        self.assertTrue(queue.append(result(3)))
+        self.assertEqual([r.mrn for r in queue.items()], [2, 3])
+
+    def test_retry_removes_scored_results(self):
+        queue = LIMSQueue(10)
+        for mrn in (1, 2, 3):
+            queue.append(result(mrn))
+        self.assertEqual(queue.retry(lambda r: r.mrn != 2), 2)
+        self.assertEqual([r.mrn for r in queue.items()], [2])
+
+    def test_queue_filled_during_a_pass(self):
+        queue = LIMSQueue(3)
+        for mrn in (1, 2, 3):
+            queue.append(result(mrn))
+
+        def score(r):
+            queue.append(result(r.mrn + 10))  # pushes out the oldest waiting results
+            return r.mrn != 3
+
+        self.assertEqual(queue.retry(score), 2)
+        self.assertEqual([r.mrn for r in queue.items()], [11, 12, 13])
+        self.assertEqual(queue.retry(lambda r: True), 3)
+        self.assertEqual(len(queue), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import tracemalloc
+import urllib.request
+import urllib.error
+
+from src.memory import MemoryMonitor, AllocationTracker, approximate_size, estimated_size, rss_bytes
+from src.parser import LabReport, Result
+from src.debug_server import start_debug_server
+
+
+class TestMemory(unittest.TestCase):
+
+    def test_approximate_size_grows_with_contents(self):
+        small = {1: ([1.0], [2.0])}
+        large = {mrn: ([float(i) for i in range(100)], [0.5] * 100) for mrn in range(100)}
+        self.assertGreater(approximate_size(large), 100 * approximate_size(small))
+        shared = [1.5] * 1000
+        self.assertLess(approximate_size([shared, shared]), 1.5 * approximate_size([shared]))
+
+    def test_approximate_size_follows_slots(self):
+        results = tuple(Result(185620675, 1711846440 + i, 80.0 + i) for i in range(100))
+        self.assertGreater(approximate_size(LabReport(185620675, results)), approximate_size(results))
+        self.assertGreater(approximate_size(results[0]), approximate_size(Result(None, None, None)))
+
+    def test_estimated_size_samples_entries(self):
+        series = {mrn: ([float(i) for i in range(20)], [0.5 + i for i in range(20)]) for mrn in range(10000)}
+        self.assertAlmostEqual(estimated_size(series) / approximate_size(series), 1, delta=0.05)
+        queue = [Result(185620675 + i, 1711846440 + i, 80.0 + i) for i in range(1000)]
+        self.assertAlmostEqual(estimated_size(queue) / approximate_size(queue), 1, delta=0.05)
+        self.assertEqual(estimated_size({}), approximate_size({}))
+        self.assertEqual(estimated_size(1.5), approximate_size(1.5))
+
+    def test_over_budget_evicts(self):
+        fractions = []
+        evict = lambda fraction: fractions.append(fraction) or 7
+        monitor = MemoryMonitor({"cache": lambda: {1: [1.0]}}, evict, budget_bytes=1, fraction=0.25)
+        self.assertEqual(monitor.check(), 7)
+        self.assertEqual(fractions, [0.25])
+        self.assertEqual(monitor.evicted, 7)
+        self.assertGreater(monitor.estimated_size("cache"), 0)
+        self.assertEqual(monitor.measured_sizes(), {"cache": approximate_size({1: [1.0]})})
+
+    def test_within_budget_only_measures(self):
+        for budget in (None, 2 * rss_bytes()):
+            monitor = MemoryMonitor({}, lambda fraction: self.fail("evicted"), budget_bytes=budget)
+            self.assertEqual(monitor.check(), 0)
+            self.assertGreater(monitor.rss, 0)
+
+    def test_allocation_report(self):
+        tracker = AllocationTracker()
+        self.assertIn("started", tracker.report())
+        try:
+            held = [str(i) * 10 for i in range(10000)]
+            self.assertIn("memory_test.py", tracker.report(limit=3))
+            held += [str(i) * 20 for i in range(10000)]
+            self.assertIn("memory_test.py", tracker.report(limit=3, diff=True))
+        finally:
+            tracker.report(stop=True)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_debug_server_routes(self):
+        routes = {"/metrics": lambda query: ("text/plain", b"metrics")}
+        server = start_debug_server(0, routes, host="127.0.0.1")
+        url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            routes["/debug/echo"] = lambda query: ("text/plain", query["n"].encode())
+            self.assertEqual(urllib.request.urlopen(f"{url}/metrics").read(), b"metrics")
+            self.assertEqual(urllib.request.urlopen(f"{url}/debug/echo?n=3").read(), b"3")
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/missing")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
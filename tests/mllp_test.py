@@ -0,0 +1,109 @@
+import socket
+import threading
+import unittest
+
+from src.mllp import MLLPReceiver, MIN_RECV_SIZE
+
+
+def frame(message):
+    return b"\x0b" + message + b"\x1c\x0d"
+
+
+def message(i, size=100):
+    return f"MSH|{i}|".encode().ljust(size, b"x")
+
+
+class TestMLLPReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.sender, self.sock = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.sock.close()
+
+    def receive(self, receiver, data):
+        self.sender.sendall(data)
+        return [bytes(f) for f in receiver.receive(self.sock)]
+
+    def test_frame_split_across_receives(self):
+        receiver = MLLPReceiver()
+        data = frame(message(1)) + frame(message(2))
+        self.assertEqual(self.receive(receiver, data[:50]), [])
+        self.assertEqual(self.receive(receiver, data[50:-1]), [message(1)])
+        self.assertEqual(self.receive(receiver, data[-1:]), [message(2)])
+        self.assertEqual(receiver.bytes_copied, 0)
+
+    def test_held_frames_survive_wraparound(self):
+        receiver = MLLPReceiver(initial_size=4 * MIN_RECV_SIZE)
+        held, received = [], 0
+        for i in range(200):
+            # Each frame arrives in two pieces, so the buffer often wraps in the middle of one.
+            data = frame(message(i, 700))
+            for piece in (data[:600], data[600:]):
+                self.sender.sendall(piece)
+                held += receiver.receive(self.sock)
+            while len(held) > 4:
+                self.assertEqual(bytes(held.pop(0)), message(received, 700))
+                receiver.release()
+                received += 1
+        self.assertEqual(receiver.size, 4 * MIN_RECV_SIZE)
+        self.assertGreater(receiver.bytes_copied, 0)
+        self.assertLess(receiver.bytes_copied, 200 * 700 / 4)
+
+    def test_receive_waits_for_release_when_full(self):
+        receiver = MLLPReceiver(initial_size=2 * MIN_RECV_SIZE)
+        held = self.receive(receiver, b"".join(frame(message(i, 1000)) for i in range(7)))
+        self.sender.sendall(frame(message(7, 1000)))
+
+        frames = []
+        reader = threading.Thread(target=lambda: frames.extend(receiver.receive(self.sock)), daemon=True)
+        reader.start()
+        reader.join(0.3)
+        self.assertTrue(reader.is_alive())
+        for _ in held:
+            receiver.release()
+        reader.join(5)
+        self.assertEqual([bytes(f) for f in frames], [message(7, 1000)])
+
+    def test_large_frame_grows_buffer(self):
+        receiver = MLLPReceiver(initial_size=2 * MIN_RECV_SIZE)
+        large = message(1, 5 * MIN_RECV_SIZE)
+        threading.Thread(target=self.sender.sendall, args=(frame(large),), daemon=True).start()
+        frames = []
+        while not frames:
+            frames = receiver.receive(self.sock)
+        self.assertEqual(bytes(frames[0]), large)
+        self.assertGreaterEqual(receiver.size, 5 * MIN_RECV_SIZE)
+
+    def test_oversized_frame_discarded(self):
+        receiver = MLLPReceiver(initial_size=2 * MIN_RECV_SIZE, max_size=4 * MIN_RECV_SIZE)
+        threading.Thread(
+            target=self.sender.sendall, args=(frame(message(1, 6 * MIN_RECV_SIZE)) + frame(message(2)),), daemon=True
+        ).start()
+        frames = []
+        while not frames:
+            frames = [bytes(f) for f in receiver.receive(self.sock)]
+        self.assertEqual(frames[-1], message(2))
+        self.assertGreater(receiver.discarded_bytes, 0)
+
+    def test_bad_encoding_resynchronises(self):
+        receiver = MLLPReceiver()
+        self.assertEqual(self.receive(receiver, b"junk" + frame(message(1))), [message(1)])
+        self.assertEqual(receiver.discarded_bytes, 4)
+
+    def test_reset_drops_partial_frame(self):
+        receiver = MLLPReceiver()
+        self.assertEqual(self.receive(receiver, frame(message(1))[:20]), [])
+        receiver.reset()
+        self.assertEqual(self.receive(receiver, frame(message(2))), [message(2)])
+
+    def test_closed_connection(self):
+        receiver = MLLPReceiver()
+        self.sender.close()
+        with self.assertRaises(ConnectionError):
+            receiver.receive(self.sock)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,13 @@
+import os
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch, mock_open
 import pickle
 import numpy as np
 import pandas as pd
-from model.model_class import AKIPredictor  # Import your class
+from model.model_class import AKIPredictor, margin_upper_bound  # Import your class
+from tests.model_registry_test import AlwaysPositive
 
 class TestAKIPredictor(unittest.TestCase):
     
@@ -68,5 +72,59 @@ class TestAKIPredictor(unittest.TestCase):
         self.assertEqual(mrn, 1002)
         self.assertEqual(latest_date, pd.Timestamp("2023-02-10"))
 
+class TestCascade(unittest.TestCase):
+
+    def setUp(self):
+        self.plain = AKIPredictor("model/xgb_model.pkl")
+        self.cascade = AKIPredictor("model/xgb_model.pkl", cascade=True)
+        self.rng = np.random.default_rng(0)
+
+    def rows(self, n, rv1_high, rv2_high):
+        return np.column_stack([
+            self.rng.integers(0, 110, n), self.rng.integers(0, 2, n), self.rng.uniform(10, 2000, n),
+            self.rng.uniform(0.2, rv1_high, n), self.rng.uniform(0.2, rv2_high, n),
+        ])
+
+    def test_thresholds_certified_by_the_trees(self):
+        rv1, rv2 = self.cascade.thresholds
+        self.assertGreater(min(rv1, rv2), 1.0)
+        x = self.rows(200000, rv1, rv2)
+        x[:100, 3] = np.nextafter(rv1, 0)  # just inside the box
+        x[100:200, 4] = np.nextafter(rv2, 0)
+        self.assertTrue(self.cascade.settled_negative(x).all())
+        margins = self.plain.model.predict(x, output_margin=True)
+        self.assertLess(margins.max(), margin_upper_bound(self.plain.model, {"rv1": rv1, "rv2": rv2}))
+        self.assertLess(margin_upper_bound(self.plain.model, {"rv1": rv1, "rv2": rv2}), 0)
+
+    def test_predictions_unchanged(self):
+        x = self.rows(20000, 4.0, 4.0)
+        x[:10, 3] = np.nan
+        settled = self.cascade.settled_negative(x)
+        self.assertTrue(0 < settled.sum() < len(x))
+        self.assertFalse(settled[:10].any())
+        np.testing.assert_array_equal(self.plain.model.predict(x[settled]), 0)
+
+        for rv1, rv2 in [(1.0, 1.0), (1.47, 1.2), (1.6, 1.0), (1.0, 1.3), (3.0, 3.0)]:
+            # ratios around the thresholds, on both sides
+            data = {"mrn": 1, "dob": 0, "sex": 1, "dates": [86400 * 365 * 50] * 3,
+                    "creatinine_levels": [100.0, 100.0 * rv1 / rv2, 100.0 * rv1]}
+            self.assertEqual(self.cascade.predict(data, count=True)[0], self.plain.predict(data)[0])
+        self.assertGreater(self.cascade.short_circuited, 0)
+        self.assertGreater(self.cascade.model_calls, 0)
+        self.assertGreater(self.cascade.latency_saved_seconds, 0)
+        self.assertEqual(self.plain.model_calls, 0)  # predictions made without count=True, as in validation
+
+    def test_models_without_trees_are_not_short_circuited(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "positive.pkl")
+        with open(path, "wb") as f:
+            pickle.dump(AlwaysPositive(), f)
+        predictor = AKIPredictor(path, cascade=True)
+        shutil.rmtree(directory)
+        self.assertIsNone(predictor.thresholds)
+        data = {"mrn": 1, "dob": 0, "sex": 1, "dates": [86400 * 365 * 50], "creatinine_levels": [100.0]}
+        self.assertEqual(predictor.predict(data)[0], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
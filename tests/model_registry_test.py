@@ -0,0 +1,113 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from src.model_registry import ModelRegistry, ACTIVE_POINTER, ROLLBACK_MARKER
+from model.model_class import AKIPredictor
+from src.database import timestamp_to_epoch as epoch
+
+
+class AlwaysPositive:
+    def predict(self, x):
+        return [1] * len(x)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Timed:
+    """A predictor whose every prediction takes the given seconds on a FakeClock."""
+
+    def __init__(self, predictor, clock, seconds):
+        self.predictor = predictor
+        self.clock = clock
+        self.seconds = seconds
+
+    def predict(self, data):
+        self.clock.now += self.seconds
+        return self.predictor.predict(data)
+
+
+def patient(latest):
+    return {
+        "mrn": 185620675, "dob": epoch("1980-11-06 00:00:00"), "sex": 1,
+        "dates": [epoch("2024-03-30 10:00:00"), epoch("2024-03-31 00:54:00")], "creatinine_levels": [75.0, latest],
+    }
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.registry = ModelRegistry(self.directory, self.load, "model/xgb_model.pkl", clock=self.clock)
+        for latest in (70.0, 80.0, 90.0, 300.0):
+            self.registry.record(patient(latest))
+
+    def load(self, path):
+        """Predictions from files named slow*.pkl take 3ms, the rest 1ms."""
+        seconds = 0.003 if os.path.basename(path).startswith("slow") else 0.001
+        return Timed(AKIPredictor(path), self.clock, seconds)
+
+    def publish(self, name, source="model/xgb_model.pkl"):
+        shutil.copy(source, os.path.join(self.directory, name))
+
+    def test_new_model_swapped_in_between_messages(self):
+        self.publish("v2.pkl")
+        self.assertTrue(self.registry.poll())
+        self.assertEqual(self.registry.version, "default")
+        self.assertTrue(self.registry.activate_pending())
+        self.assertEqual(self.registry.version, "v2.pkl")
+        self.assertFalse(self.registry.poll())
+
+        restarted = ModelRegistry(self.directory, self.load, "model/xgb_model.pkl", clock=self.clock)
+        self.assertEqual(restarted.version, "v2.pkl")
+
+    def test_rollback(self):
+        default = self.registry.predictor
+        self.publish("v2.pkl")
+        self.registry.poll()
+        self.registry.activate_pending()
+
+        open(os.path.join(self.directory, ROLLBACK_MARKER), "w").close()
+        self.assertTrue(self.registry.poll())
+        self.registry.activate_pending()
+        self.assertEqual(self.registry.version, "default")
+        self.assertIs(self.registry.predictor, default)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, ACTIVE_POINTER)))
+
+    def test_disagreeing_model_rejected(self):
+        with open(os.path.join(self.directory, "bad.pkl"), "wb") as f:
+            pickle.dump(AlwaysPositive(), f)
+        self.assertFalse(self.registry.poll())
+        self.assertEqual(self.registry.rejections, 1)
+        self.assertFalse(self.registry.activate_pending())
+
+    def test_slow_model_rejected(self):
+        self.publish("slow.pkl")
+        self.assertFalse(self.registry.poll())
+        self.assertEqual(self.registry.rejections, 1)
+
+        self.publish("v2.pkl")
+        self.assertTrue(self.registry.poll())
+
+    def test_unreadable_model_rejected(self):
+        with open(os.path.join(self.directory, "broken.pkl"), "wb") as f:
+            f.write(b"not a pickle")
+        self.assertFalse(self.registry.poll())
+        self.assertEqual(self.registry.rejections, 1)
+        self.assertEqual(self.registry.version, "default")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
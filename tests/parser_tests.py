@@ -1,5 +1,5 @@
 import unittest
-from src.parser import HL7MessageParser
+from src.parser import HL7MessageParser, SplitHL7MessageParser, Admission, Discharge, LabReport, Result
 
 class TestHL7MessageParser(unittest.TestCase):
 
@@ -52,9 +52,7 @@ class TestHL7MessageParser(unittest.TestCase):
             "PID|1||185620675||KAYLA HENRY||20211106|F\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['mrn'], '185620675')
-        self.assertEqual(parsed_message[1]['dob'], '2021-11-06 00:00:00')
-        self.assertEqual(parsed_message[1]['sex'], 1)
+        self.assertEqual(parsed_message[1], Admission(185620675, 1636156800, 1))  # 2021-11-06 00:00:00
 
 
     def test_parse_adt_a03(self):
@@ -63,7 +61,7 @@ class TestHL7MessageParser(unittest.TestCase):
             "PID|1||112034143\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['mrn'], '112034143')
+        self.assertEqual(parsed_message[1], Discharge(112034143))
 
 
     def test_parse_oru_r01_with_seconds(self):
@@ -74,9 +72,9 @@ class TestHL7MessageParser(unittest.TestCase):
             "OBX|1|SN|CREATININE||81.24564330381325\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['mrn'], '157828764')
-        self.assertEqual(parsed_message[1]['results'][0]['date'], '2024-03-31 00:54:00')
-        self.assertEqual(parsed_message[1]['results'][0]['result'], '81.24564330381325')
+        self.assertEqual(parsed_message[1].mrn, 157828764)
+        self.assertEqual(parsed_message[1].results[0].date, 1711846440)  # 2024-03-31 00:54:00
+        self.assertEqual(parsed_message[1].results[0].value, 81.24564330381325)
 
 
     def test_parse_oru_r01_with_minutes(self):
@@ -87,7 +85,7 @@ class TestHL7MessageParser(unittest.TestCase):
             "OBX|1|SN|CREATININE||103.4\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['results'][0]['date'], '2024-01-20 22:43:00')
+        self.assertEqual(parsed_message[1].results[0].date, 1705790580)  # 2024-01-20 22:43:00
 
     def test_parse_oru_r01_with_hours(self):
         message = (
@@ -97,7 +95,7 @@ class TestHL7MessageParser(unittest.TestCase):
         "OBX|1|SN|CREATININE||55.459808442525905\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['results'][0]['date'],  '2024-03-31 07:00:00')
+        self.assertEqual(parsed_message[1].results[0].date, 1711868400)  # 2024-03-31 07:00:00
 
 
     def test_parse_oru_r01_no_time(self):
@@ -108,7 +106,7 @@ class TestHL7MessageParser(unittest.TestCase):
             "OBX|1|SN|CREATININE||55.459808442525905\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['results'][0]['date'], '2024-03-31 00:00:00')
+        self.assertEqual(parsed_message[1].results[0].date, 1711843200)  # 2024-03-31 00:00:00
 
 
     def test_adt_a01_missing_dob(self):
@@ -141,7 +139,42 @@ class TestHL7MessageParser(unittest.TestCase):
             "OBX|1|SN|CREATININE||55.459808442525905\r"
         )
         parsed_message = self.parser.parse(message)
-        self.assertEqual(parsed_message[1]['results'][0]['date'], ' ')
+        self.assertIsNone(parsed_message[1].results[0].date)
+
+
+    def test_parse_oru_r01_bad_value(self):
+        message = (
+            "MSH|^~\&|SIMULATION|SOUTH RIVERSIDE|||20240331073300||ORU^R01|||2.5\r"
+            "PID|1||172480767\r"
+            "OBR|1||||||20240331\r"
+            "OBX|1|SN|CREATININE||pending\r"
+        )
+        self.assertEqual(self.parser.parse(message), (None, None, "error"))
+
+
+    def test_non_numeric_mrn(self):
+        message = (
+            "MSH|^~\&|SIMULATION|SOUTH RIVERSIDE|||20240331054700||ADT^A03|||2.5\r"
+            "PID|1||NHS112034143\r"
+        )
+        self.assertEqual(self.parser.parse(message), (None, None, "error"))
+
+
+    def test_split_parser_returns_same_records(self):
+        message = (
+            "MSH|^~\&|SIMULATION|SOUTH RIVERSIDE|||202401201630||ORU^R01|||2.5\r"
+            "PID|1||478237423\r"
+            "OBR|1||||||202401202243\r"
+            "OBX|1|SN|CREATININE||103.4\r"
+            "OBR|1||||||202401210243\r"
+            "OBX|1|SN|CREATININE||100.4\r"
+        )
+        expected = LabReport(478237423, (
+            Result(478237423, 1705790580, 103.4),  # 2024-01-20 22:43:00
+            Result(478237423, 1705804980, 100.4),  # 2024-01-21 02:43:00
+        ))
+        self.assertEqual(self.parser.parse(message), ("LIMS", expected, "no error"))
+        self.assertEqual(SplitHL7MessageParser().parse(message), ("LIMS", expected, "no error"))
 
 
 if __name__ == "__main__":
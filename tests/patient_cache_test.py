@@ -0,0 +1,226 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.database import Database, timestamp_to_epoch as epoch
+from src.patient_cache import PatientCache
+from src.parser import Result
+
+
+class TestPatientCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = self.open_database()
+        self.cache = PatientCache(self.db)
+        self.cache.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+        self.cache.write_lims_data("185620675", epoch("2024-03-31 00:54:00"), "81.2")
+        self.cache.write_lims_data("185620675", epoch("2024-03-30 10:00:00"), "75.0")
+        self.cache.write_pas_data("157828764", epoch("1984-02-03 00:00:00"), 0)
+        self.cache.write_lims_data("157828764", epoch("2024-03-31 05:00:00"), "103.4")
+
+    def open_database(self):
+        return Database(os.path.join(self.directory, "aki.db"))
+
+    def test_fetch_matches_database(self):
+        for mrn in ("185620675", "157828764"):
+            for timestamp in (epoch("2024-03-30 12:00:00"), epoch("2024-04-01 00:00:00")):
+                self.assertEqual(
+                    self.cache.fetch_data(mrn, timestamp), self.db.fetch_data(mrn, timestamp)
+                )
+
+    def test_same_timestamp_ordered_by_arrival(self):
+        self.cache.fetch_data("157828764", epoch("2024-04-01 00:00:00"))  # resident, so writes are appended
+        self.cache.write_lims_data("157828764", epoch("2024-03-31 06:00:00"), "300.0")
+        self.cache.write_lims_data("157828764", epoch("2024-03-31 06:00:00"), "90.0")
+        for evict in (False, True):
+            if evict:
+                self.cache.evict(len(self.cache.patients))
+            data = self.cache.fetch_data("157828764", epoch("2024-04-01 00:00:00"))
+            self.assertEqual(data["creatinine_levels"], [103.4, 300.0, 90.0])
+            self.assertEqual(data, self.db.fetch_data("157828764", epoch("2024-04-01 00:00:00")))
+
+    def test_fetch_without_pas_data(self):
+        self.cache.write_lims_data("478237423", epoch("2024-03-31 00:00:00"), "90.0")
+        self.assertIsNone(self.cache.fetch_data("478237423", epoch("2024-04-01 00:00:00")))
+        self.cache.write_pas_data("478237423", epoch("1990-01-01 00:00:00"), 0)
+        data = self.cache.fetch_data("478237423", epoch("2024-04-01 00:00:00"))
+        self.assertEqual(data["creatinine_levels"], [90.0])
+
+    def test_write_lims_results(self):
+        self.cache.fetch_data("185620675", epoch("2024-04-01 00:00:00"))
+        self.cache.write_lims_results(185620675, [
+            Result(185620675, epoch("2024-04-01 01:00:00"), 90.0),
+            Result(185620675, epoch("2024-04-01 02:00:00"), 95.0),
+        ])
+        self.assertEqual(
+            self.cache.fetch_data("185620675", epoch("2024-04-02 00:00:00")),
+            self.db.fetch_data("185620675", epoch("2024-04-02 00:00:00")),
+        )
+
+    def test_discharge_demotes_and_admission_prefetches(self):
+        self.cache.fetch_data("185620675", epoch("2024-04-01 00:00:00"))
+        self.cache.demote("185620675")
+        self.assertNotIn(185620675, self.cache.patients)
+        self.assertEqual(self.cache.demoted, 1)
+        self.assertEqual(self.cache.stale, set())  # there is no snapshot
+
+        self.cache.write_lims_data("185620675", epoch("2024-04-05 00:00:00"), "120.0")
+        self.cache.write_pas_data("185620675", epoch("2021-11-06 00:00:00"), 1)
+        self.assertNotIn(185620675, self.cache.patients)
+        self.assertIsNotNone(self.cache.prefetch("185620675"))
+        self.assertIsNone(self.cache.prefetch("185620675"))  # already resident
+        self.assertEqual(
+            self.cache.fetch_data("185620675", epoch("2024-04-06 00:00:00")),
+            self.db.fetch_data("185620675", epoch("2024-04-06 00:00:00")),
+        )
+
+    def test_evict_least_recently_used(self):
+        for mrn in ("157828764", "185620675", "157828764"):
+            self.cache.fetch_data(mrn, epoch("2024-04-01 00:00:00"))
+        self.assertEqual(self.cache.evict(1), 1)
+        self.assertEqual(list(self.cache.patients), [157828764])
+        self.assertEqual(self.cache.demoted, 0)
+
+        self.cache.write_lims_data("185620675", epoch("2024-04-02 00:00:00"), "140.0")
+        self.assertEqual(
+            self.cache.fetch_data("185620675", epoch("2024-04-03 00:00:00")),
+            self.db.fetch_data("185620675", epoch("2024-04-03 00:00:00")),
+        )
+        self.assertEqual(self.cache.evicted, 1)
+
+    def test_prefetch_before_first_result(self):
+        self.cache.write_pas_data("478237423", epoch("1990-01-01 00:00:00"), 0)
+        self.assertNotIn(478237423, self.cache.patients)
+        self.assertIsNotNone(self.cache.prefetch("478237423"))
+        self.assertIsNone(self.cache.prefetch("478237423"))  # already resident
+        self.cache.write_lims_data("478237423", epoch("2024-04-01 00:00:00"), "90.0")
+        data = self.cache.fetch_data("478237423", epoch("2024-04-02 00:00:00"))
+        self.assertEqual(data, self.db.fetch_data("478237423", epoch("2024-04-02 00:00:00")))
+
+        self.cache.write_pas_data("518354251", epoch("1990-01-01 00:00:00"), 1)  # not prefetched
+        self.cache.fetch_data("518354251", epoch("2024-04-02 00:00:00"))
+        self.assertEqual((self.cache.prefetch_hits, self.cache.prefetch_misses), (1, 1))
+        self.assertEqual(self.cache.prefetch_hit_rate, 0.5)
+
+    def test_prefetch_discarded_when_written_meanwhile(self):
+        self.cache.write_pas_data("478237423", epoch("1990-01-01 00:00:00"), 0)
+        read = self.cache._read
+
+        def read_while_result_arrives(mrn):
+            state = read(mrn)
+            self.cache.write_lims_data("478237423", epoch("2024-04-01 00:00:00"), "90.0")
+            return state
+
+        self.cache._read = read_while_result_arrives
+        self.assertIsNone(self.cache.prefetch("478237423"))
+        self.cache._read = read
+        self.assertNotIn(478237423, self.cache.patients)
+        self.assertEqual(self.cache.loading, {})
+        data = self.cache.fetch_data("478237423", epoch("2024-04-02 00:00:00"))
+        self.assertEqual(data["creatinine_levels"], [90.0])
+
+    def test_demoted_patient_is_not_restored_from_snapshot(self):
+        snapshot_dir = os.path.join(self.directory, "snapshot")
+        self.cache.fetch_data("185620675", epoch("2024-04-01 00:00:00"))
+        self.cache.save_snapshot(snapshot_dir)
+
+        restarted = PatientCache(self.open_database())
+        restarted.load_snapshot(snapshot_dir)
+        restarted.demote("185620675")
+        restarted.write_lims_data("185620675", epoch("2024-04-05 00:00:00"), "120.0")
+        self.assertEqual(len(restarted), 0)
+        self.assertEqual(
+            restarted.fetch_data("185620675", epoch("2024-04-06 00:00:00"))["creatinine_levels"][-1], 120.0
+        )
+
+    def test_snapshot_round_trip_replays_tail(self):
+        snapshot_dir = os.path.join(self.directory, "snapshot")
+        self.cache.fetch_data("185620675", epoch("2024-04-01 00:00:00"))
+        self.cache.save_snapshot(snapshot_dir)
+        self.cache.write_lims_data("185620675", epoch("2024-04-01 08:00:00"), "160.0")
+
+        restarted = PatientCache(self.open_database())
+        replayed = restarted.load_snapshot(snapshot_dir)
+        self.assertEqual(replayed, 1)
+        self.assertEqual(len(restarted.patients), 1)
+        self.assertEqual(len(restarted), 1)
+
+        data = restarted.fetch_data("185620675", epoch("2024-04-02 00:00:00"))
+        self.assertEqual(data, self.db.fetch_data("185620675", epoch("2024-04-02 00:00:00")))
+
+    def test_snapshot_keeps_unhydrated_patients(self):
+        snapshot_dir = os.path.join(self.directory, "snapshot")
+        self.cache.fetch_data("157828764", epoch("2024-04-01 00:00:00"))
+        self.cache.save_snapshot(snapshot_dir)
+
+        restarted = PatientCache(self.open_database())
+        restarted.load_snapshot(snapshot_dir)
+        restarted.fetch_data("185620675", epoch("2024-04-01 00:00:00"))
+        restarted.save_snapshot(snapshot_dir)
+        self.assertEqual(len(os.listdir(snapshot_dir)), 2)
+
+        again = PatientCache(self.open_database())
+        again.load_snapshot(snapshot_dir)
+        self.assertEqual(len(again), 2)
+        self.assertEqual(
+            again.fetch_data("157828764", epoch("2024-04-01 00:00:00")),
+            self.db.fetch_data("157828764", epoch("2024-04-01 00:00:00")),
+        )
+
+    def test_saves_without_writes_leave_mapped_snapshot_intact(self):
+        snapshot_dir = os.path.join(self.directory, "snapshot")
+        for mrn in ("185620675", "157828764"):
+            self.cache.fetch_data(mrn, epoch("2024-04-01 00:00:00"))
+        self.cache.save_snapshot(snapshot_dir)
+
+        restarted = PatientCache(self.open_database())
+        restarted.load_snapshot(snapshot_dir)
+        restarted.demote("185620675")  # writes nothing to SQLite
+        first = restarted.save_snapshot(snapshot_dir)
+        second = restarted.save_snapshot(snapshot_dir)
+        self.assertNotEqual(first, second)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(os.path.join(snapshot_dir, restarted.base_generation)))
+        self.assertEqual(
+            restarted.fetch_data("157828764", epoch("2024-04-01 00:00:00")),
+            self.db.fetch_data("157828764", epoch("2024-04-01 00:00:00")),
+        )
+
+        again = PatientCache(self.open_database())
+        again.load_snapshot(snapshot_dir)
+        self.assertEqual(len(again), 1)
+
+    def test_save_clears_stale_patients(self):
+        snapshot_dir = os.path.join(self.directory, "snapshot")
+        self.cache.fetch_data("157828764", epoch("2024-04-01 00:00:00"))
+        self.cache.save_snapshot(snapshot_dir)
+
+        restarted = PatientCache(self.open_database())
+        restarted.load_snapshot(snapshot_dir)
+        restarted.demote("157828764")
+        restarted.demote("185620675")  # not in the snapshot
+        self.assertEqual(restarted.stale, {157828764})
+        restarted.save_snapshot(snapshot_dir)
+        self.assertEqual(restarted.stale, set())
+        self.assertEqual(len(restarted), 0)
+        self.assertEqual(os.listdir(snapshot_dir).count(restarted.base_generation), 1)
+        self.assertEqual(len(os.listdir(snapshot_dir)), 2)  # the previous generation is no longer mapped
+
+        restarted.write_lims_data("157828764", epoch("2024-04-01 08:00:00"), "160.0")
+        self.assertEqual(
+            restarted.fetch_data("157828764", epoch("2024-04-02 00:00:00")),
+            self.db.fetch_data("157828764", epoch("2024-04-02 00:00:00")),
+        )
+
+    def test_load_without_snapshot(self):
+        self.assertIsNone(self.cache.load_snapshot(os.path.join(self.directory, "missing")))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
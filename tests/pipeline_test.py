@@ -0,0 +1,92 @@
+import threading
+import unittest
+
+from src.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_items_pass_through_stages_in_order(self):
+        results = []
+        pipeline = Pipeline([
+            ("double", lambda item, emit: emit(item * 2)),
+            ("split", lambda item, emit: [emit(item), emit(item + 1)]),
+            ("collect", lambda item, emit: results.append(item)),
+        ])
+        pipeline.start()
+        for item in range(5):
+            pipeline.put(item)
+        pipeline.join()
+        self.assertEqual(results, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(pipeline.processed, {"double": 5, "split": 5, "collect": 10})
+
+    def test_slow_stage_blocks_upstream(self):
+        release = threading.Event()
+        pipeline = Pipeline([
+            ("fast", lambda item, emit: emit(item)),
+            ("slow", lambda item, emit: release.wait()),
+        ], queue_size=2)
+        pipeline.start()
+
+        fed = []
+        feeder = threading.Thread(target=lambda: [fed.append(pipeline.put(item)) for item in range(10)], daemon=True)
+        feeder.start()
+        feeder.join(0.5)
+        # One item in each stage's hands plus two queued per stage; the feeder waits for room.
+        self.assertTrue(feeder.is_alive())
+        self.assertEqual(len(fed), 6)
+        self.assertEqual(pipeline.depth("slow"), 2)
+
+        release.set()
+        feeder.join(5)
+        pipeline.join()
+        self.assertEqual(pipeline.processed["slow"], 10)
+        self.assertGreater(pipeline.blocked_seconds["slow"], 0.4)
+
+    def test_failed_item_does_not_stop_stage(self):
+        results = []
+
+        def handle(item, emit):
+            if item == 1:
+                raise ValueError("bad item")
+            results.append(item)
+
+        pipeline = Pipeline([("only", handle)])
+        pipeline.start()
+        for item in range(3):
+            pipeline.put(item)
+        pipeline.join()
+        self.assertEqual(results, [0, 2])
+        self.assertEqual(pipeline.failed["only"], 1)
+
+    def test_stop_finishes_item_in_hand_and_leaves_the_rest(self):
+        started, release = threading.Event(), threading.Event()
+        scored = []
+
+        def score(item, emit):
+            started.set()
+            release.wait()
+            scored.append(item)
+
+        pipeline = Pipeline([("persist", lambda item, emit: emit(item)), ("score", score)])
+        pipeline.start()
+        for item in range(4):
+            pipeline.put(item)
+        started.wait(5)
+        self.assertTrue(pipeline.stop("persist"))
+        threading.Timer(0.2, release.set).start()
+        self.assertTrue(pipeline.stop("score"))
+        self.assertEqual(scored, [0])
+        self.assertEqual(pipeline.drain("score"), [1, 2, 3])
+        self.assertFalse(any(thread.is_alive() for thread in pipeline.threads))
+
+    def test_drain(self):
+        pipeline = Pipeline([("first", lambda item, emit: emit(item)), ("second", lambda item, emit: None)])
+        for item in range(3):
+            pipeline.put(item)
+        self.assertEqual(pipeline.drain("first"), [0, 1, 2])
+        self.assertEqual(pipeline.depth("first"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
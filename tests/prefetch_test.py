@@ -0,0 +1,41 @@
+import time
+import unittest
+
+from src.database import Database, timestamp_to_epoch as epoch
+from src.patient_cache import PatientCache
+from src.prefetch import Prefetcher
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Database(":memory:")
+        self.cache = PatientCache(self.db)
+        self.loads = []
+        self.prefetcher = Prefetcher(self.cache, queue_size=2, on_load=self.loads.append)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_submit_drops_when_full(self):
+        for mrn in ("185620675", "157828764", "478237423"):
+            self.prefetcher.submit(mrn)
+        self.assertEqual(self.prefetcher.dropped, 1)
+        self.assertEqual(self.prefetcher.queue.qsize(), 2)
+
+    def test_worker_loads_admitted_patients(self):
+        self.cache.write_pas_data("185620675", epoch("1980-11-06 00:00:00"), 1)
+        self.cache.write_lims_data("185620675", epoch("2024-03-30 10:00:00"), "75.0")
+        self.prefetcher.submit("185620675")
+        self.prefetcher.submit("999999999")  # no PAS data, nothing to load
+        self.prefetcher.start()
+        deadline = time.time() + 5
+        while self.prefetcher.loaded < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.prefetcher.loaded, 1)
+        self.assertEqual(len(self.loads), 1)
+        self.assertIn(185620675, self.cache.patients)
+
+
+if __name__ == "__main__":
+    unittest.main()
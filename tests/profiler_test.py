@@ -0,0 +1,48 @@
+import threading
+import time
+import unittest
+
+from src.profiler import StackSampler, collapsed
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestStackSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=spin, args=(self.stop,), name="spinner", daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+
+    def test_collapsed_stacks_of_other_threads(self):
+        sampler = StackSampler()
+        stacks = sampler.profile(seconds=0.3, hz=100)
+        self.assertGreater(sampler.samples, 10)
+        spinning = [stack for stack in stacks if stack.startswith("spinner;")]
+        self.assertTrue(spinning)
+        self.assertTrue(all(stack.split(";")[-1].startswith("spin (profiler_test.py:") for stack in spinning))
+        self.assertFalse(any("_sample (profiler.py" in stack for stack in stacks))  # not itself
+
+        line = collapsed(stacks).splitlines()[0]
+        stack, count = line.rsplit(" ", 1)
+        self.assertEqual(int(count), stacks.most_common(1)[0][1])
+
+    def test_one_profile_at_a_time(self):
+        sampler = StackSampler()
+        running = threading.Thread(target=sampler.profile, args=(0.5,), daemon=True)
+        running.start()
+        time.sleep(0.1)
+        self.assertIsNone(sampler.profile(0.1))
+        running.join()
+        self.assertIsNotNone(sampler.profile(0.05))
+
+
+if __name__ == "__main__":
+    unittest.main()
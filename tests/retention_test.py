@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from src.database import Database, MedianSketch, SKETCH_RELATIVE_ACCURACY, timestamp_to_epoch as epoch
+from src.patient_cache import PatientCache
+from src.retention import RetentionCompactor
+from model.model_class import AKIPredictor
+
+
+class TestMedianSketch(unittest.TestCase):
+
+    def test_median_within_relative_accuracy(self):
+        rng = np.random.default_rng(0)
+        for n in (2, 3, 10, 101, 1000):
+            values = rng.uniform(30, 300, n)
+            sketch = MedianSketch()
+            for value in values[: n // 2]:
+                sketch.add(value)
+            self.assertEqual(sketch.min, values[: n // 2].min() if n > 1 else None)
+            self.assertAlmostEqual(
+                sketch.median(values[n // 2:]) / np.median(values), 1, delta=SKETCH_RELATIVE_ACCURACY
+            )
+
+    def test_empty_sketch_is_exact(self):
+        self.assertEqual(MedianSketch().median([3.0, 1.0, 2.0, 10.0]), 2.5)
+
+    def test_row_round_trip(self):
+        sketch = MedianSketch()
+        sketch.add(81.2)
+        sketch.compacted_until = epoch("2024-01-01 00:00:00")
+        self.assertEqual(MedianSketch.from_row(*sketch.to_row()), sketch)
+
+
+class TestRetentionCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.directory, "aki.db"))
+        self.cache = PatientCache(self.db)
+        self.levels = [70.0 + 5 * (i % 7) for i in range(30)]
+        self.cache.write_pas_data("185620675", epoch("1980-11-06 00:00:00"), 1)
+        for day, level in enumerate(self.levels):
+            self.cache.write_lims_data("185620675", epoch(f"2024-01-{day + 1:02d} 10:00:00"), level)
+        self.cache.write_pas_data("157828764", epoch("1984-02-03 00:00:00"), 0)
+        self.cache.write_lims_data("157828764", epoch("2023-06-01 10:00:00"), 99.0)
+        self.compactor = RetentionCompactor(self.db, self.cache, window_days=10, batch_size=1)
+
+    def test_compaction_keeps_features(self):
+        predictor = AKIPredictor("model/xgb_model.pkl")
+        before, _ = predictor.preprocess_and_transform(
+            self.cache.fetch_data("185620675", epoch("2024-02-01 00:00:00"))
+        )
+        while self.compactor.run_once():
+            pass
+
+        for data in (
+            self.cache.fetch_data("185620675", epoch("2024-02-01 00:00:00")),
+            self.db.fetch_data("185620675", epoch("2024-02-01 00:00:00")),
+        ):
+            self.assertEqual(len(data["dates"]), 11)
+            self.assertEqual(data["summary"].count, 19)
+            after, _ = predictor.preprocess_and_transform(data)
+            np.testing.assert_array_equal(after[:4], before[:4])
+            self.assertAlmostEqual(after[4] / before[4], 1, delta=SKETCH_RELATIVE_ACCURACY)
+
+    def test_latest_result_is_never_compacted(self):
+        while self.compactor.run_once():
+            pass
+        self.assertEqual(self.compactor.compacted_patients, 1)
+        self.assertEqual(len(self.db.read_lims_data("157828764")), 1)
+        self.assertIsNone(self.db.read_summary("157828764"))
+
+    def test_compaction_is_incremental(self):
+        self.assertEqual(self.compactor.run_once(), 1)
+        self.cache.write_lims_data("185620675", epoch("2024-02-20 10:00:00"), 80.0)
+        self.assertEqual(self.compactor.run_once(), 1)
+        self.assertEqual(self.db.read_summary("185620675").count, 30)
+
+        restarted = PatientCache(self.db)
+        data = restarted.fetch_data("185620675", epoch("2024-03-01 00:00:00"))
+        self.assertEqual(data["creatinine_levels"], [80.0])
+
+    def test_late_result_before_compacted_until_is_folded(self):
+        while self.compactor.run_once():
+            pass
+        until = epoch("2024-02-01 00:00:00")
+        self.assertTrue(self.cache.write_lims_data("185620675", epoch("2024-01-05 12:00:00"), 300.0))
+        self.assertEqual(self.db.read_summary("185620675").count, 20)
+        self.assertEqual(self.cache.fetch_data("185620675", until), self.db.fetch_data("185620675", until))
+
+        snapshot_dir = os.path.join(self.directory, "snapshot")
+        self.cache.save_snapshot(snapshot_dir)
+        self.cache.write_lims_data("185620675", epoch("2024-01-06 12:00:00"), 40.0)
+        restarted = PatientCache(self.db)
+        restarted.load_snapshot(snapshot_dir)
+        data = restarted.fetch_data("185620675", until)
+        self.assertEqual(data, self.db.fetch_data("185620675", until))
+        self.assertEqual(len(data["dates"]), 11)
+        self.assertEqual(data["summary"].count, 21)
+        self.assertEqual(data["summary"].min, 40.0)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
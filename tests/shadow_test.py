@@ -0,0 +1,49 @@
+import time
+import unittest
+
+from src.shadow import ShadowLane
+from model.model_class import AKIPredictor
+from tests.model_registry_test import patient
+
+
+class TestShadowLane(unittest.TestCase):
+
+    def setUp(self):
+        self.production = AKIPredictor("model/xgb_model.pkl")
+        self.results = []
+        self.lane = ShadowLane.from_paths(
+            ["model/xgb_model.pkl"], AKIPredictor, lambda *result: self.results.append(result), queue_size=2
+        )
+
+    def test_identical_candidate_agrees(self):
+        data = patient(300.0)
+        y_pred, _ = self.production.predict(data)
+        self.lane.evaluate(data, self.production, y_pred)
+        name, agreed, seconds, divergence = self.results[0]
+        self.assertEqual(name, "xgb_model.pkl")
+        self.assertTrue(agreed)
+        self.assertGreater(seconds, 0)
+        self.assertEqual(divergence, 0)
+
+    def test_disagreement_reported(self):
+        self.lane.evaluate(patient(300.0), self.production, 1 - self.production.predict(patient(300.0))[0])
+        self.assertFalse(self.results[0][1])
+
+    def test_submit_drops_when_full(self):
+        for latest in (70.0, 80.0, 90.0):
+            self.lane.submit(patient(latest), self.production, 0)
+        self.assertEqual(self.lane.dropped, 1)
+        self.assertEqual(self.lane.queue.qsize(), 2)
+
+    def test_worker_drains_queue(self):
+        self.lane.submit(patient(70.0), self.production, 0)
+        self.lane.start()
+        deadline = time.time() + 5
+        while self.lane.scored < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.lane.scored, 1)
+        self.assertEqual(len(self.results), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import time
+import socket
+import tempfile
+import unittest
+import threading
+from collections import Counter
+
+from src.database import Database
+from src.mllp import MLLPReceiver
+from src.replay import message_mrn
+from src.sharding import HashRing, Journal, ShardLink, Router
+
+
+def message(mrn, n=0):
+    return f"MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A01|||2.5|{n}\rPID|1||{mrn}||PATIENT".encode()
+
+
+def ack(accepted=True):
+    return b"\x0bMSH|^~\\&|||||20240102135300||ACK|||2.5\rMSA|" + (b"AA" if accepted else b"AR") + b"\r\x1c\x0d"
+
+
+class FakeEngine:
+    """Connects to a shard link and acknowledges what it receives, like main_simulator.py."""
+
+    def __init__(self, port, reject=0, close_after=None):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.received = []
+        self.reject = reject  # messages to reject before accepting
+        self.close_after = close_after  # messages to read, without acknowledging the last, before closing
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        receiver = MLLPReceiver()
+        try:
+            while True:
+                for frame in receiver.receive(self.sock):
+                    self.received.append(bytes(frame))
+                    receiver.release()
+                    if len(self.received) == self.close_after:
+                        self.sock.close()
+                        return
+                    self.sock.sendall(ack(accepted=self.reject <= 0))
+                    self.reject -= 1
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+def wait_for(condition, seconds=5):
+    deadline = time.time() + seconds
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_owner_is_deterministic(self):
+        ring = HashRing(4)
+        self.assertEqual(ring.owner("185620675"), HashRing(4).owner("185620675"))
+        self.assertEqual(ring.owner("185620675"), ring.owner(" 0185620675"))
+
+    def test_balanced(self):
+        ring = HashRing(4)
+        counts = Counter(ring.owner(str(100000000 + 7919 * i)) for i in range(20000))
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        for count in counts.values():
+            self.assertLess(abs(count - 5000), 1500)
+
+    def test_growing_moves_mrns_only_to_new_shard(self):
+        mrns = [str(100000000 + 7919 * i) for i in range(20000)]
+        before, after = HashRing(3), HashRing(4)
+        moved = [mrn for mrn in mrns if before.owner(mrn) != after.owner(mrn)]
+        self.assertTrue(all(after.owner(mrn) == 3 for mrn in moved))
+        self.assertLess(abs(len(moved) / len(mrns) - 0.25), 0.08)
+
+    def test_missing_mrn_goes_to_first_shard(self):
+        ring = HashRing(4)
+        self.assertEqual(ring.owner(None), 0)
+        self.assertEqual(ring.owner("ABC"), 0)
+
+
+class TestJournal(unittest.TestCase):
+
+    def test_append_remove_pending(self):
+        journal = Journal(":memory:")
+        first = journal.append(b"one")
+        journal.append(b"two")
+        journal.remove(first)
+        self.assertEqual([m for _, m in journal.pending()], [b"two"])
+        self.assertEqual(len(journal), 1)
+        journal.close()
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = Journal(":memory:")
+        self.ring = HashRing(2)
+        self.links = [self.link(shard) for shard in range(2)]
+        self.router = Router(self.ring, self.journal, self.links, message_mrn)
+        self.engines = []
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.close()
+        for link in self.links:
+            link.listener.close()
+
+    def link(self, shard, ack_timeout=5):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        return ShardLink(shard, listener, self.journal, MLLPReceiver, ack_timeout=ack_timeout)
+
+    def engine(self, shard, **kwargs):
+        engine = FakeEngine(self.links[shard].listener.getsockname()[1], **kwargs)
+        self.engines.append(engine)
+        return engine
+
+    def mrns(self, shard, n):
+        mrns = (str(100000000 + 7919 * i) for i in range(1000))
+        return [mrn for mrn in mrns if self.ring.owner(mrn) == shard][:n]
+
+    def test_routes_by_mrn_and_clears_journal(self):
+        self.router.start()
+        engines = [self.engine(0), self.engine(1)]
+        messages = [message(mrn) for shard in (0, 1) for mrn in self.mrns(shard, 5)]
+        for m in messages:
+            self.router.route(m)
+        self.assertTrue(wait_for(lambda: sum(link.acknowledged for link in self.links) == 10))
+        for shard, engine in enumerate(engines):
+            self.assertEqual(len(engine.received), 5)
+            self.assertTrue(all(self.ring.owner(message_mrn(m)) == shard for m in engine.received))
+        self.assertEqual(self.router.routed, [5, 5])
+        self.assertEqual(len(self.journal), 0)
+
+    def test_messages_keep_their_order(self):
+        self.router.start()
+        engine = self.engine(0)
+        mrn = self.mrns(0, 1)[0]
+        messages = [message(mrn, n) for n in range(20)]
+        for m in messages:
+            self.router.route(m)
+        self.assertTrue(wait_for(lambda: self.links[0].acknowledged == 20))
+        self.assertEqual(engine.received, messages)
+
+    def test_resends_after_disconnect(self):
+        self.router.start()
+        first = self.engine(0, close_after=3)
+        messages = [message(mrn) for mrn in self.mrns(0, 5)]
+        for m in messages:
+            self.router.route(m)
+        self.assertTrue(wait_for(lambda: len(first.received) == 3 and not self.links[0].connected))
+        second = self.engine(0)
+        self.assertTrue(wait_for(lambda: self.links[0].acknowledged == 5))
+        self.assertEqual(second.received, messages[2:])
+        self.assertEqual(self.links[0].resent, 1)
+        self.assertEqual(len(self.journal), 0)
+
+    def test_resends_rejected_message(self):
+        self.router.start()
+        engine = self.engine(0, reject=1)
+        m = message(self.mrns(0, 1)[0])
+        self.router.route(m)
+        self.assertTrue(wait_for(lambda: self.links[0].acknowledged == 1))
+        self.assertEqual(engine.received, [m, m])
+
+    def test_restore_requeues_journal(self):
+        messages = [message(mrn) for shard in (0, 1) for mrn in self.mrns(shard, 2)]
+        for m in messages:
+            self.router.route(m)  # no engines connected: nothing is acknowledged
+        restarted = [self.link(shard) for shard in range(2)]
+        self.links.extend(restarted)
+        router = Router(self.ring, self.journal, restarted, message_mrn)
+        self.assertEqual(router.restore(), 4)
+        self.assertEqual([link.depth() for link in restarted], [2, 2])
+
+
+class TestShardedHistory(unittest.TestCase):
+
+    def test_populate_history_keeps_shard_patients(self):
+        ring = HashRing(2)
+        mrns = [str(100000000 + 7919 * i) for i in range(1000)]
+        mine = next(mrn for mrn in mrns if ring.owner(mrn) == 0)
+        other = next(mrn for mrn in mrns if ring.owner(mrn) == 1)
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("mrn,creatinine_date_0,creatinine_result_0\n")
+            f.write(f"{mine},2024-01-01 15:13:00,126.48\n{other},2024-01-01 15:51:00,52.56\n")
+        db = Database(":memory:")
+        try:
+            db.populate_history(f.name, keep=lambda mrn: ring.owner(mrn) == 0)
+            self.assertEqual(len(db.read_lims_data(mine)), 1)
+            self.assertEqual(len(db.read_lims_data(other)), 0)
+        finally:
+            db.close()
+            os.remove(f.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
+import csv
 import http
+import http.client
 import os
+import random
 import shutil
 import socket
 import subprocess
 import tempfile
+import threading
 import time
 import unittest
 import urllib.error
@@ -178,5 +182,82 @@ class SimulatorTest(unittest.TestCase):
                 self.simulator.kill()
             shutil.rmtree(self.directory)
 
+class AsyncPagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.record = os.path.join(self.directory, "pages.csv")
+        self.shutdowns = 0
+
+    def start(self, **kwargs):
+        def shutdown():
+            self.shutdowns += 1
+            self.pager.shutdown()
+        recorder = simulator.CsvRecorder(self.record, simulator.PAGE_RECORD_HEADER)
+        self.pager = simulator.AsyncPager(("127.0.0.1", 0), shutdown, recorder=recorder, quiet=True, seed=1, **kwargs)
+        self.thread = threading.Thread(target=self.pager.serve_forever, daemon=True)
+        self.thread.start()
+        return http.client.HTTPConnection(*self.pager.server_address, timeout=5)
+
+    def page(self, connection, body):
+        connection.request("POST", "/page", body=body)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def records(self):
+        self.pager.shutdown()
+        self.thread.join(5)
+        with open(self.record, newline="") as f:
+            return list(csv.DictReader(f))
+
+    def test_pages_over_one_keep_alive_connection(self):
+        connection = self.start()
+        self.assertEqual(self.page(connection, b"1234,202401221000"), http.HTTPStatus.OK)
+        sock = connection.sock
+        self.assertEqual(self.page(connection, b"5678"), http.HTTPStatus.OK)
+        self.assertIs(connection.sock, sock)
+        self.assertEqual(self.page(connection, b"NHS1234"), http.HTTPStatus.BAD_REQUEST)
+        connection.close()
+        records = self.records()
+        self.assertEqual([(r["mrn"], r["timestamp"], r["status"]) for r in records],
+                         [("1234", "20240122100000", "200"), ("5678", "", "200")])
+
+    def test_latency_and_errors(self):
+        connection = self.start(latency=simulator.parse_latency("fixed:0.1"), error_rate=1)
+        start = time.perf_counter()
+        self.assertEqual(self.page(connection, b"1234"), http.HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+        connection.close()
+        self.assertEqual(self.records()[0]["status"], "500")
+
+    def test_outage_drops_pages(self):
+        connection = self.start(outages=[(0, 60)])
+        with self.assertRaises(http.client.HTTPException):
+            self.page(connection, b"1234")
+        connection.close()
+        self.assertEqual(self.records()[0]["status"], "dropped")
+
+    def test_shutdown_request(self):
+        self.start()
+        r = urllib.request.urlopen("http://%s:%d/shutdown" % self.pager.server_address)
+        self.assertEqual(r.status, http.HTTPStatus.OK)
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(self.shutdowns, 1)
+
+    def test_parse_latency(self):
+        rng = random.Random(0)
+        self.assertEqual(simulator.parse_latency("fixed:0.05")(rng), 0.05)
+        self.assertTrue(0.1 <= simulator.parse_latency("uniform:0.1,0.2")(rng) <= 0.2)
+        self.assertGreater(simulator.parse_latency("lognormal:0.05,0.5")(rng), 0)
+        with self.assertRaises(ValueError):
+            simulator.parse_latency("normal:1")
+        with self.assertRaises(TypeError):
+            simulator.parse_latency("uniform:1")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
 if __name__ == "__main__":
     unittest.main()